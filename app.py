@@ -1,25 +1,39 @@
+import atexit
 import threading
+import queue
 import uuid
 import os
 import json
 import secrets # Added
+import shutil
+import socket
 import time
+import random
 import base64
+import hashlib
+import re
+import tempfile
+import zipfile
 import requests
+import httpx
 from io import BytesIO
-from datetime import datetime
+from collections import Counter, namedtuple
+from datetime import datetime, timedelta, timezone, time as dtime
+from zoneinfo import ZoneInfo
 import asyncio
-from urllib.parse import urlparse, parse_qs
+from urllib.parse import urlparse, parse_qs, urljoin
 
-from flask import Flask, render_template, request, send_file, jsonify, redirect, url_for, flash
+from flask import Flask, render_template, request, send_file, jsonify, redirect, url_for, flash, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 
-from PIL import Image as PILImage
+from reportlab import rl_config
 from reportlab.pdfgen import canvas
 from reportlab.lib.utils import ImageReader
 from reportlab.lib.pagesizes import A4
+from PIL import Image as PILImage
+from concurrent.futures import Future, ThreadPoolExecutor
 
 from bs4 import BeautifulSoup
 from selenium import webdriver
@@ -28,7 +42,9 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from webdriver_manager.chrome import ChromeDriverManager
-from telegram import Bot
+from telegram import Bot, InputMediaPhoto
+from telegram.error import BadRequest, NetworkError, RetryAfter
+from telegram.request import HTTPXRequest
 
 # --- Configuration ---
 from flask_mail import Mail, Message # Added
@@ -79,6 +95,7 @@ class User(UserMixin, db.Model):
     telegram_bot_token = db.Column(db.String(200), nullable=True)
     telegram_chat_id = db.Column(db.String(100), nullable=True)
     recovery_code = db.Column(db.String(50), nullable=True) # New column
+    telegram_stream = db.Column(db.Boolean, default=False) # Send charts in albums while the scan runs, PDF at the end
     presets = db.relationship('ScanPreset', backref='owner', lazy=True)
 
     def set_password(self, password):
@@ -98,17 +115,229 @@ class ScanPreset(db.Model):
     range_val = db.Column(db.String(50), default='1 year')
     moving_average = db.Column(db.Boolean, default=True) # Deprecated
     ma_config = db.Column(db.Text, nullable=True) # Stores JSON string
-
-# --- Global Job Store (In-Memory) ---
+    # Cron expressions separated by ';', in SCHEDULER_TZ (e.g. "20 9 * * 1-5; 35 15 * * 1-5")
+    schedule = db.Column(db.String(200), nullable=True)
+    next_run_at = db.Column(db.DateTime, nullable=True, index=True) # UTC, includes the stagger offset
+    last_run_at = db.Column(db.DateTime, nullable=True)
+    # Diff mode: None (full run), 'new' (only newly entered symbols) or 'changes' (new plus dropped-out list)
+    diff_mode = db.Column(db.String(20), nullable=True)
+    last_symbols = db.Column(db.Text, nullable=True) # JSON list: symbols of the last completed diff run
+
+class ScanJob(db.Model):
+    """Durable job record. Web processes enqueue rows; worker processes claim and run them."""
+    id = db.Column(db.String(36), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    status = db.Column(db.String(30), default='queued', index=True)
+    params = db.Column(db.Text, nullable=False) # JSON: screeners [{title, url, period, range, moving_averages}], engine, output
+    processed = db.Column(db.Integer, default=0)
+    total = db.Column(db.Integer, default=0)
+    current_company = db.Column(db.String(200), default='')
+    error = db.Column(db.Text, nullable=True)
+    result_path = db.Column(db.String(500), nullable=True)
+    telegram_sent = db.Column(db.Boolean, default=False)
+    canceled = db.Column(db.Boolean, default=False)
+    stats = db.Column(db.Text, nullable=True) # JSON: cache counters, step timings
+    worker_id = db.Column(db.String(100), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    expired_at = db.Column(db.DateTime, nullable=True) # Output deleted by the retention sweep
+    fingerprint = db.Column(db.String(64), nullable=True, index=True) # job_fingerprint(params), for sharing identical runs
+    priority = db.Column(db.Integer, default=0) # Higher runs first; see JOB_PRIORITY_SCHEDULED
+
+class JobSubscriber(db.Model):
+    """A user who receives a job's result. Identical requests share one job with several subscribers."""
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.String(36), db.ForeignKey('scan_job.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    telegram_stream = db.Column(db.Boolean, nullable=True) # This request's override of the user's setting
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    delivered_at = db.Column(db.DateTime, nullable=True) # Set once every send to their Telegram succeeded
+    delivery_claimed_at = db.Column(db.DateTime, nullable=True) # A worker is sending; expires after TELEGRAM_DELIVERY_LEASE_SECONDS
+    delivery_attempts = db.Column(db.Integer, default=0)
+    __table_args__ = (db.UniqueConstraint('job_id', 'user_id'),)
+
+class ChartTask(db.Model):
+    """One chart of a job, fetched by whichever chart worker claims it (with CHART_QUEUE_ENABLED)."""
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.String(36), db.ForeignKey('scan_job.id'), nullable=False, index=True)
+    task_index = db.Column(db.Integer, nullable=False) # Index in plan_chart_tasks, names the checkpoint file
+    params = db.Column(db.Text, nullable=False) # JSON: url, period, range, moving_averages, engine
+    status = db.Column(db.String(20), default='queued', index=True) # queued, running, done or failed
+    attempts = db.Column(db.Integer, default=0) # Fetches that returned no chart (SYMBOL_MAX_ATTEMPTS)
+    claims = db.Column(db.Integer, default=0) # Every claim, including ones lost to browser failures
+    worker_id = db.Column(db.String(100), nullable=True)
+    claimed_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True) # Refreshed by its worker's process while fetching
+    timings = db.Column(db.Text, nullable=True) # JSON step timings of its fetches, for the job's step_timings
+    company_name = db.Column(db.String(200), nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    __table_args__ = (db.UniqueConstraint('job_id', 'task_index'),)
+
+class UpstreamState(db.Model):
+    """Chartink rate-limiter state shared by every worker process (a single row, see sync_upstream_limit)."""
+    id = db.Column(db.String(20), primary_key=True) # 'chartink'
+    rate = db.Column(db.Float, nullable=False) # Page loads per second across all processes
+    breaker_open_until = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+# --- Live Job State (per worker process) ---
+# Running jobs keep their hot progress here and are synced to ScanJob rows
+# every JOB_SYNC_INTERVAL seconds; the ScanJob table is the source of truth.
 jobs = {}
 
+# --- Chart Fetch Concurrency ---
+# Each chart worker leases one Chrome instance at a time from the shared driver
+# pool. CHART_WORKERS_PER_JOB caps how many a single job may use; MAX_BROWSERS
+# caps the pool (and so the total across all running jobs) so one large scan
+# cannot starve everyone else.
+CHART_WORKERS_PER_JOB = int(os.environ.get('CHART_WORKERS_PER_JOB', 3))
+MAX_BROWSERS = int(os.environ.get('MAX_BROWSERS', 6))
+
+# --- Metrics ---
+# Stage timings are recorded per job (exposed in /status) and aggregated into
+# Prometheus-style histograms for this process (exposed at /metrics).
+METRIC_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+class Histogram:
+    """Minimal thread-safe labelled histogram rendered in Prometheus text format."""
+
+    def __init__(self, name, help_text, buckets=METRIC_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.setdefault(key, {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                labels = ','.join(f'{k}="{v}"' for k, v in key)
+                prefix = f"{labels}," if labels else ''
+                for bound, count in zip(self.buckets, series['buckets']):
+                    lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {count}')
+                lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {series["count"]}')
+                lines.append(f"{self.name}_sum{{{labels}}} {series['sum']:.6f}")
+                lines.append(f"{self.name}_count{{{labels}}} {series['count']}")
+        return '\n'.join(lines)
+
+stage_histogram = Histogram('chartink_stage_duration_seconds', 'Duration of scan pipeline stages.')
+_stage_lock = threading.Lock()
+# Timings recorded after their job left ``jobs`` (Telegram uploads usually finish later);
+# track_telegram_delivery writes them to the job's row
+_late_stage_timings = {}
+# Timings of the chart unit this thread is fetching (job_id, timings): its job runs in another
+# process, so run_chart_unit stores them on the unit's row for the job's PDF stage to pick up
+_unit_stage_timings = threading.local()
+
+def record_stage(job_id, stage, seconds, late=False):
+    """Record one stage duration globally and, if ``job_id`` is running here, on the job.
+
+    With ``late``, the timing of a job that is no longer running here is kept
+    in _late_stage_timings instead of being dropped.
+    """
+    stage_histogram.observe(seconds, stage=stage)
+    if not job_id:
+        return
+    with _stage_lock:
+        job = jobs.get(job_id)
+        if job is not None:
+            timings = job.setdefault('step_timings', {})
+        elif late:
+            timings = _late_stage_timings.setdefault(job_id, {})
+        elif getattr(_unit_stage_timings, 'job_id', None) == job_id:
+            timings = _unit_stage_timings.timings
+        else:
+            return
+        entry = timings.setdefault(stage, {'count': 0, 'total': 0.0, 'max': 0.0})
+        entry['count'] += 1
+        entry['total'] += seconds
+        entry['max'] = max(entry['max'], seconds)
+
+def merge_step_timings(into, timings):
+    """Add the ``{stage: {'count', 'total', 'max'}}`` entries of ``timings`` to ``into``."""
+    for stage, other in (timings or {}).items():
+        entry = into.setdefault(stage, {'count': 0, 'total': 0.0, 'max': 0.0})
+        entry['count'] += other['count']
+        entry['total'] += other['total']
+        entry['max'] = max(entry.get('max', 0), other.get('max', 0))
+    return into
+
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
 
 # --- Helper Functions ---
 
-def web_driver():
+# The driver start-up strategy that worked last time. Resolving it walks a chain
+# of fallbacks (undetected-chromedriver, Selenium Manager, system chromedriver),
+# which is slow, so it is cached after the first successful start.
+_driver_strategy = None
+
+# --- Driver Profiles ---
+# 'full' loads pages like a normal browser. 'lean' is for scraping: it skips
+# images (the chart is read from img#cross's base64 src, never rendered), web
+# fonts, media and ad/analytics hosts, turns off background Chrome features and
+# caps the renderer's JS heap. Picked per stage; the pool keeps each apart.
+# 'lean' is opt-in until the bench has run it against real Chrome and Chartink.
+DRIVER_PROFILES = ('full', 'lean')
+SCREENER_DRIVER_PROFILE = os.environ.get('SCREENER_DRIVER_PROFILE', 'full')
+CHART_DRIVER_PROFILE = os.environ.get('CHART_DRIVER_PROFILE', 'full')
+DRIVER_RENDERER_HEAP_MB = int(os.environ.get('DRIVER_RENDERER_HEAP_MB', 256))
+LEAN_BLOCKED_URLS = [
+    '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot',
+    '*.mp4', '*.webm', '*.mp3',
+    '*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*',
+    '*googlesyndication.com*', '*googleadservices.com*', '*adservice.google.*',
+    '*facebook.net*', '*connect.facebook.*', '*hotjar.com*', '*clarity.ms*',
+    '*taboola.com*', '*outbrain.com*', '*amazon-adsystem.com*', '*onesignal.com*',
+] + [pattern.strip() for pattern in os.environ.get('DRIVER_BLOCKED_URLS', '').split(',') if pattern.strip()]
+
+def _lean_arguments():
+    return [
+        '--blink-settings=imagesEnabled=false',
+        '--disable-extensions',
+        '--disable-background-networking',
+        '--disable-component-update',
+        '--disable-default-apps',
+        '--disable-sync',
+        '--disable-notifications',
+        '--mute-audio',
+        '--no-first-run',
+        '--disable-features=Translate,OptimizationHints,MediaRouter,AutofillServerCommunication',
+        '--renderer-process-limit=2',
+        f'--js-flags=--max-old-space-size={DRIVER_RENDERER_HEAP_MB}',
+    ]
+
+def _lean_prefs():
+    blocked = 2 # Content setting: block
+    return {f'profile.managed_default_content_settings.{kind}': blocked
+            for kind in ('images', 'notifications', 'geolocation', 'media_stream', 'popups', 'plugins')}
+
+def _apply_profile(driver, profile):
+    """Block the lean profile's URL patterns at the network layer (needs Chrome's DevTools protocol)."""
+    if profile != 'lean':
+        return driver
+    try:
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': LEAN_BLOCKED_URLS})
+    except Exception as e:
+        print(f"Could not set blocked URLs on the lean driver: {e}")
+    return driver
+
+def _chrome_options(profile='full'):
     options = webdriver.ChromeOptions()
     options.page_load_strategy = 'eager'
     options.add_argument('--no-sandbox')
@@ -132,108 +361,737 @@ def web_driver():
                 options.binary_location = p
                 break
 
-        # 1️⃣  Try undetected-chromedriver (auto version-matching)
-        try:
-            import undetected_chromedriver as uc
-            uc_options = uc.ChromeOptions()
-            for arg in [
-                '--headless=new', '--no-sandbox', '--disable-gpu',
-                '--disable-dev-shm-usage', '--window-size=1920,1080',
-                '--disable-extensions', '--disable-software-rasterizer'
-            ]:
-                uc_options.add_argument(arg)
-            driver = uc.Chrome(options=uc_options, use_subprocess=False)
-            print("PythonAnywhere: using undetected_chromedriver")
-            return driver
-        except Exception as e:
-            print(f"undetected_chromedriver failed: {e}")
+    # ── Docker / Local Headless ─────────────────────────────────────
+    elif os.path.exists('/.dockerenv') or os.environ.get('HEADLESS', 'false').lower() == 'true':
+        options.add_argument('--headless=new')
+        options.add_argument('--window-size=1920,1080')
+        options.add_argument('--disable-extensions')
 
-        # 2️⃣  Let Selenium Manager auto-download the correct driver (Selenium >= 4.6)
-        try:
-            driver = webdriver.Chrome(options=options)  # No Service() = Selenium Manager
-            print("PythonAnywhere: using Selenium Manager auto-download")
-            return driver
-        except Exception as e:
-            print(f"Selenium Manager failed: {e}")
+    if profile == 'lean':
+        for argument in _lean_arguments():
+            options.add_argument(argument)
+        options.add_experimental_option('prefs', _lean_prefs())
+    return options
 
+def _driver_strategies():
+    """Yield (name, argument) start-up strategies in order of preference."""
+    if 'PYTHONANYWHERE_DOMAIN' in os.environ:
+        # 1️⃣  undetected-chromedriver (auto version-matching)
+        yield ('undetected', None)
+        # 2️⃣  Let Selenium Manager auto-download the correct driver (Selenium >= 4.6)
+        yield ('selenium_manager', None)
         # 3️⃣  Try system chromedriver as last resort
         for cd in ["/usr/bin/chromedriver", "/usr/local/bin/chromedriver",
                    os.path.expanduser("~/.local/bin/chromedriver")]:
             if os.path.exists(cd):
-                try:
-                    driver = webdriver.Chrome(service=Service(cd), options=options)
-                    print(f"PythonAnywhere: using system chromedriver at {cd}")
-                    return driver
-                except Exception as e:
-                    print(f"System chromedriver {cd} failed: {e}")
-
-        raise RuntimeError("All ChromeDriver strategies failed on PythonAnywhere")
-
-    # ── Docker / Local Headless ─────────────────────────────────────
-    if os.path.exists('/.dockerenv') or os.environ.get('HEADLESS', 'false').lower() == 'true':
-        options.add_argument('--headless=new')
-        options.add_argument('--window-size=1920,1080')
-        options.add_argument('--disable-extensions')
-        print("Running in Headless mode (Docker/Env detected)")
+                yield ('system', cd)
+        return
 
     # ── Local development ───────────────────────────────────────────
     try:
-        # webdriver-manager for local dev
-        service = Service(ChromeDriverManager().install())
-        driver = webdriver.Chrome(service=service, options=options)
-        return driver
+        # webdriver-manager for local dev; the resolved path is cached with the strategy
+        yield ('driver_path', ChromeDriverManager().install())
     except Exception as e:
         print(f"webdriver-manager failed ({e}), trying Selenium Manager...")
-        driver = webdriver.Chrome(options=options)  # Selenium Manager fallback
-        return driver
+    yield ('selenium_manager', None)
+
+def _start_driver(strategy, profile='full'):
+    name, arg = strategy
+    if name == 'undetected':
+        import undetected_chromedriver as uc
+        uc_options = uc.ChromeOptions()
+        for a in [
+            '--headless=new', '--no-sandbox', '--disable-gpu',
+            '--disable-dev-shm-usage', '--window-size=1920,1080',
+            '--disable-extensions', '--disable-software-rasterizer'
+        ]:
+            uc_options.add_argument(a)
+        if profile == 'lean':
+            for a in _lean_arguments():
+                uc_options.add_argument(a)
+            uc_options.add_experimental_option('prefs', _lean_prefs())
+        return _apply_profile(uc.Chrome(options=uc_options, use_subprocess=False), profile)
+    if name in ('system', 'driver_path'):
+        return _apply_profile(webdriver.Chrome(service=Service(arg), options=_chrome_options(profile)), profile)
+    return _apply_profile(webdriver.Chrome(options=_chrome_options(profile)), profile)  # No Service() = Selenium Manager
+
+def web_driver(profile='full'):
+    global _driver_strategy
+
+    if _driver_strategy:
+        try:
+            return _start_driver(_driver_strategy, profile)
+        except Exception as e:
+            print(f"Cached driver strategy {_driver_strategy[0]} failed ({e}), re-resolving...")
+            _driver_strategy = None
+
+    last_error = None
+    for strategy in _driver_strategies():
+        try:
+            driver = _start_driver(strategy, profile)
+            _driver_strategy = strategy
+            print(f"Using driver strategy: {strategy[0]}" + (f" ({strategy[1]})" if strategy[1] else ""))
+            return driver
+        except Exception as e:
+            print(f"Driver strategy {strategy[0]} failed: {e}")
+            last_error = e
+
+    raise RuntimeError(f"All ChromeDriver strategies failed: {last_error}")
+
+class PooledDriver:
+    """A live driver plus the bookkeeping the pool needs to decide when to recycle it."""
+
+    def __init__(self, driver, profile='full'):
+        self.driver = driver
+        self.profile = profile
+        self.created_at = time.time()
+        self.pages = 0
+
+class DriverPool:
+    """Process-wide pool of warm Chrome instances with lease/return semantics.
+
+    At most ``max_size`` drivers are alive at once (leased plus idle). Drivers are
+    health-checked when leased and recycled once they have served ``max_pages``
+    pages or are older than ``max_age`` seconds. Idle drivers are kept per
+    profile (see DRIVER_PROFILES); when the pool is full and only drivers of
+    another profile are idle (or a fresh driver is wanted), an idle one is
+    retired to make room.
+    """
+
+    def __init__(self, max_size, max_pages, max_age):
+        self.max_size = max_size
+        self.max_pages = max_pages
+        self.max_age = max_age
+        self._idle = {} # profile -> [PooledDriver]
+        self._live = 0
+        self._cond = threading.Condition()
+
+    def _idle_count(self):
+        return sum(len(idle) for idle in self._idle.values())
+
+    def _pop_any_idle(self):
+        for idle in self._idle.values():
+            if idle:
+                return idle.pop(0) # Oldest first
+        return None
+
+    def _expired(self, pooled):
+        return pooled.pages >= self.max_pages or time.time() - pooled.created_at >= self.max_age
+
+    def _healthy(self, pooled):
+        try:
+            pooled.driver.switch_to.default_content()
+            pooled.driver.execute_script("return 1;")
+            return True
+        except Exception:
+            return False
+
+    def _destroy(self, pooled):
+        try:
+            pooled.driver.quit()
+        except Exception:
+            pass
+        with self._cond:
+            self._live -= 1
+            self._cond.notify()
+
+    def lease(self, job_id=None, profile='full', fresh=False):
+        """Lease a driver of ``profile``; ``fresh`` always starts a new one (e.g. to retry failed charts)."""
+        while True:
+            pooled = None
+            spare = None
+            with self._cond:
+                while not self._idle_count() and self._live >= self.max_size:
+                    self._cond.wait()
+                if self._idle.get(profile) and not fresh:
+                    pooled = self._idle[profile].pop()
+                elif self._live < self.max_size:
+                    self._live += 1
+                else:
+                    spare = self._pop_any_idle()
+            if spare is not None:
+                self._destroy(spare)
+                continue
+
+            if pooled is None:
+                try:
+                    started = time.time()
+                    pooled = PooledDriver(web_driver(profile), profile)
+                    record_stage(job_id, 'driver_startup', time.time() - started)
+                    return pooled
+                except Exception:
+                    with self._cond:
+                        self._live -= 1
+                        self._cond.notify()
+                    raise
+
+            if not self._expired(pooled) and self._healthy(pooled):
+                return pooled
+            self._destroy(pooled)
+
+    def release(self, pooled, broken=False):
+        if broken or self._expired(pooled):
+            self._destroy(pooled)
+            return
+        with self._cond:
+            self._idle.setdefault(pooled.profile, []).append(pooled)
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            idle, self._idle = self._idle, {}
+        for pooled in [pooled for profile_idle in idle.values() for pooled in profile_idle]:
+            self._destroy(pooled)
+
+    def stats(self):
+        with self._cond:
+            return {'live': self._live, 'idle': self._idle_count(), 'max_size': self.max_size}
+
+driver_pool = DriverPool(
+    max_size=MAX_BROWSERS,
+    max_pages=int(os.environ.get('DRIVER_MAX_PAGES', 100)),
+    max_age=int(os.environ.get('DRIVER_MAX_AGE_MIN', 30)) * 60,
+)
+atexit.register(driver_pool.close)
+
+# --- Telegram Delivery ---
+TELEGRAM_MAX_RETRIES = int(os.environ.get('TELEGRAM_MAX_RETRIES', 5))
+TELEGRAM_CONNECTIONS = int(os.environ.get('TELEGRAM_CONNECTIONS', 8))
+TELEGRAM_UPLOAD_TIMEOUT = float(os.environ.get('TELEGRAM_UPLOAD_TIMEOUT', 300)) # Large PDFs on slow uplinks
+TELEGRAM_DELIVERY_ATTEMPTS = int(os.environ.get('TELEGRAM_DELIVERY_ATTEMPTS', 3)) # Per subscriber, across restarts
+TELEGRAM_DELIVERY_LEASE_SECONDS = int(os.environ.get('TELEGRAM_DELIVERY_LEASE_SECONDS', 3600)) # Longer than any one delivery takes
+TELEGRAM_DELIVERY_MAX_AGE_HOURS = float(os.environ.get('TELEGRAM_DELIVERY_MAX_AGE_HOURS', 6))
+
+# httpx errors (the cause PTB chains to its NetworkError) raised before any byte of the request went out
+_UNSENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+class TelegramDelivery:
+    """Sends job output to Telegram from one long-lived event loop thread.
+
+    ``send_*`` can be called from any thread; they queue the delivery and return
+    a ``concurrent.futures.Future`` at once, so job threads never wait on
+    Telegram. Deliveries to one chat go out in order, different chats in
+    parallel. One Bot (and its pooled HTTP connections) is kept per token.
+    Flood limits (RetryAfter) are waited out as Telegram asks; network errors
+    are retried with exponential backoff. Uploads (documents, albums) are only
+    retried when the request never reached Telegram: after a write or read
+    timeout the file may have arrived, and sending it again would duplicate it.
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._lock = threading.Lock()
+        self._bots = {}
+        self._queues = {}
+
+    def send_message(self, token, chat_id, text, job_id=None):
+        return self._submit(token, chat_id, job_id, 'message', text=text[:4096]) # Telegram's message size limit
+
+    def send_document(self, token, chat_id, path, filename, caption=None, job_id=None):
+        return self._submit(token, chat_id, job_id, 'document', path=path, filename=filename, caption=caption)
+
+    def send_album(self, token, chat_id, images, job_id=None):
+        """Send up to 10 chart images, given as ``(path_or_bytes, caption)``, as one media group."""
+        if not 0 < len(images) <= 10:
+            raise ValueError('An album holds 1 to 10 images')
+        return self._submit(token, chat_id, job_id, 'album', images=images)
+
+    def _submit(self, token, chat_id, job_id, kind, **payload):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, daemon=True, name='telegram-delivery').start()
+        future = Future()
+        self._loop.call_soon_threadsafe(self._enqueue, (token, chat_id), (kind, payload, job_id, future))
+        return future
+
+    def _enqueue(self, key, item):
+        chat_queue = self._queues.get(key)
+        if chat_queue is None:
+            chat_queue = self._queues[key] = asyncio.Queue()
+            self._loop.create_task(self._drain(key, chat_queue))
+        chat_queue.put_nowait(item)
+
+    async def _drain(self, key, chat_queue):
+        token, chat_id = key
+        while not chat_queue.empty():
+            kind, payload, job_id, future = chat_queue.get_nowait()
+            try:
+                future.set_result(await self._send_with_retry(token, chat_id, kind, payload, job_id))
+            except Exception as e:
+                print(f"Telegram {kind} to {chat_id} failed: {e}")
+                future.set_exception(e)
+        del self._queues[key] # Runs on the loop thread, so no delivery can slip in between
+
+    async def _bot(self, token):
+        bot = self._bots.get(token)
+        if bot is None:
+            request = HTTPXRequest(connection_pool_size=TELEGRAM_CONNECTIONS, read_timeout=60,
+                                   write_timeout=TELEGRAM_UPLOAD_TIMEOUT, media_write_timeout=TELEGRAM_UPLOAD_TIMEOUT)
+            bot = Bot(token=token, request=request)
+            await bot.initialize()
+            self._bots[token] = bot
+        return bot
+
+    async def _send_with_retry(self, token, chat_id, kind, payload, job_id):
+        for attempt in range(TELEGRAM_MAX_RETRIES + 1):
+            started = time.time()
+            try:
+                result = await self._send(await self._bot(token), chat_id, kind, payload)
+                record_stage(job_id, f'telegram_{kind}', time.time() - started, late=True)
+                return result
+            except RetryAfter as e:
+                delay = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+            except BadRequest:
+                raise # A NetworkError subclass, but retrying will not help
+            except NetworkError as e: # Includes TimedOut
+                if kind != 'message' and not isinstance(e.__cause__, _UNSENT_ERRORS):
+                    raise
+                delay = min(60, 2 ** attempt)
+                if attempt < TELEGRAM_MAX_RETRIES:
+                    print(f"Telegram {kind} to {chat_id} failed ({e}), retrying in {delay}s")
+            if attempt == TELEGRAM_MAX_RETRIES:
+                break
+            await asyncio.sleep(delay)
+        raise RuntimeError(f"Telegram {kind} to {chat_id} still failing after {TELEGRAM_MAX_RETRIES} retries")
+
+    async def _send(self, bot, chat_id, kind, payload):
+        if kind == 'message':
+            return await bot.send_message(chat_id=chat_id, text=payload['text'])
+        if kind == 'document':
+            with open(payload['path'], 'rb') as document:
+                return await bot.send_document(chat_id=chat_id, document=document, filename=payload['filename'],
+                                               caption=payload['caption'])
+        images = []
+        for image, caption in payload['images']:
+            if not isinstance(image, bytes):
+                with open(image, 'rb') as f:
+                    image = f.read()
+            images.append((image, caption))
+        if len(images) == 1: # Media groups need at least two items
+            return await bot.send_photo(chat_id=chat_id, photo=images[0][0], caption=images[0][1])
+        return await bot.send_media_group(chat_id=chat_id, media=[InputMediaPhoto(image, caption=caption) for image, caption in images])
+
+telegram_delivery = TelegramDelivery()
+
+TELEGRAM_STREAM_BATCH = min(10, int(os.environ.get('TELEGRAM_STREAM_BATCH', 10)))
+TELEGRAM_STREAM_MAX_WAIT = float(os.environ.get('TELEGRAM_STREAM_MAX_WAIT', 20))
+
+class TelegramStreamSink:
+    """Sends a job's charts to Telegram in albums while they are still being fetched.
+
+    A chart sink like OrderedPageSink, but charts go out in arrival order: an
+    album is sent once TELEGRAM_STREAM_BATCH charts are waiting, or when a chart
+    arrives and the oldest waiting one is TELEGRAM_STREAM_MAX_WAIT seconds old.
+    Image bytes are read when an album is queued, so the job may delete its
+    chart files before the upload runs. ``futures`` holds every queued album
+    send; ``sent`` and ``failed`` count the charts of those that finished.
+    """
+
+    def __init__(self, targets, job_id=None):
+        self.targets = targets
+        self.job_id = job_id
+        self.futures = []
+        self.sent = 0
+        self.failed = 0
+        self._pending = []
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._count_lock = threading.Lock() # Done callbacks may run inside _send_pending, under _lock
+
+    def put(self, index, item):
+        if not item:
+            return
+        with self._lock:
+            if not self._pending:
+                self._oldest = time.time()
+            self._pending.append(item)
+            if len(self._pending) >= TELEGRAM_STREAM_BATCH or time.time() - self._oldest >= TELEGRAM_STREAM_MAX_WAIT:
+                self._send_pending()
+
+    def flush(self):
+        """Queue whatever is still waiting; call before the final PDF is sent."""
+        with self._lock:
+            if self._pending:
+                self._send_pending()
+
+    def _send_pending(self):
+        images = []
+        for company_name, path in self._pending:
+            try:
+                with open(path, 'rb') as f:
+                    images.append((f.read(), company_name))
+            except OSError as e:
+                print(f"Streaming chart {company_name} skipped: {e}")
+        self._pending = []
+        if not images:
+            return
+        for token, chat_id in self.targets:
+            future = telegram_delivery.send_album(token, chat_id, images, self.job_id)
+            future.add_done_callback(lambda f, charts=len(images): self._count(f, charts))
+            self.futures.append(future)
+
+    def _count(self, future, charts):
+        with self._count_lock:
+            if future.exception() is None:
+                self.sent += charts
+            else:
+                self.failed += charts
+
+def track_telegram_delivery(job_id, futures, streamer=None):
+    """Once all of ``futures`` (and ``streamer``'s albums) are done, store the job's Telegram results.
+
+    Late Telegram timings go into the job's step_timings, failed sends into
+    ``telegram_failed`` and the charts ``streamer`` delivered into
+    ``telegram_streamed``. telegram_sent is set if ``futures`` (the PDFs and
+    summary) and every album went out. Only call this after the job's final
+    state is saved, or the save would overwrite the results.
+    """
+    albums = streamer.futures if streamer else []
+    remaining = [len(futures) + len(albums)]
+    failed = [0]
+    lock = threading.Lock()
+
+    def done(future):
+        with lock:
+            remaining[0] -= 1
+            failed[0] += future.exception() is not None
+            finished = remaining[0] == 0
+        if not finished:
+            return
+        with _stage_lock:
+            late_timings = _late_stage_timings.pop(job_id, None)
+        with app.app_context():
+            row = db.session.get(ScanJob, job_id)
+            if row is not None:
+                stats = json.loads(row.stats) if row.stats else {}
+                merge_step_timings(stats.setdefault('step_timings', {}), late_timings)
+                if failed[0]:
+                    stats['telegram_failed'] = stats.get('telegram_failed', 0) + failed[0]
+                if streamer:
+                    stats['telegram_streamed'] = streamer.sent
+                row.stats = json.dumps(stats)
+                if futures and not failed[0]:
+                    row.telegram_sent = True
+                db.session.commit()
+            db.session.remove()
+
+    # A streamer's own callbacks were added first, so its counts are final when the last one runs here
+    for future in futures + albums:
+        future.add_done_callback(done)
+
+# --- Upstream Rate Limiting ---
+# Every page load against Chartink (screener pages, stock pages, direct HTTP
+# chart fetches) takes a token from one bucket shared by all jobs in the
+# process. The rate adapts AIMD-style: it grows by RATE_LIMIT_INCREASE per
+# second of healthy traffic and halves when pages fail or take much longer than
+# usual. A run of failures opens a circuit breaker that pauses every job for a
+# while, instead of each worker retrying against a struggling upstream. The
+# rate and the breaker are one budget for the whole deployment: every
+# RATE_LIMIT_SYNC_INTERVAL seconds each worker process merges its changes into
+# the UpstreamState row and takes its share of the rate.
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+RATE_LIMIT_INITIAL = float(os.environ.get('RATE_LIMIT_INITIAL', 2)) # Page loads per second
+RATE_LIMIT_MIN = float(os.environ.get('RATE_LIMIT_MIN', 0.2))
+RATE_LIMIT_MAX = float(os.environ.get('RATE_LIMIT_MAX', 10))
+RATE_LIMIT_INCREASE = float(os.environ.get('RATE_LIMIT_INCREASE', 0.1))
+RATE_LIMIT_SLOW_FACTOR = float(os.environ.get('RATE_LIMIT_SLOW_FACTOR', 3)) # Slower than this x the usual time is congestion
+BREAKER_FAILURES = int(os.environ.get('BREAKER_FAILURES', 5))
+BREAKER_PAUSE_SECONDS = float(os.environ.get('BREAKER_PAUSE_SECONDS', 30))
+BREAKER_MAX_PAUSE_SECONDS = float(os.environ.get('BREAKER_MAX_PAUSE_SECONDS', 300))
+RATE_LIMIT_SYNC_INTERVAL = float(os.environ.get('RATE_LIMIT_SYNC_INTERVAL', 2))
+SYMBOL_TIMEOUT = float(os.environ.get('SYMBOL_TIMEOUT', 45)) # Whole Selenium fetch of one chart
+
+class AdaptiveRateLimiter:
+    """Token bucket with AIMD rate adaptation and a circuit breaker.
+
+    Call ``acquire()`` before a page load and ``record(kind, seconds, ok)``
+    after it. ``kind`` groups comparable loads (e.g. 'chart', 'screener'); each
+    kind's usual duration is tracked as a slowly rising minimum, so a load is
+    "slow" relative to what that kind normally takes. After the breaker's pause
+    the next failure reopens it at once, with the pause doubled.
+
+    ``rate`` is the budget of all ``processes`` sharing it (see
+    ``apply_shared``); this bucket refills at its share of it.
+    """
+
+    def __init__(self, rate, min_rate, max_rate, increase, slow_factor, breaker_failures, breaker_pause, max_pause):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.slow_factor = slow_factor
+        self.breaker_failures = breaker_failures
+        self.breaker_pause = breaker_pause
+        self.max_pause = max_pause
+        self.breaker_trips = 0
+        self.processes = 1
+        self._synced_rate = rate
+        self._tokens = 1.0
+        self._updated = time.monotonic()
+        self._baseline = {}
+        self._last_decrease = 0
+        self._failures = 0
+        self._pause = breaker_pause
+        self._open_until = 0
+        self._probing = False
+        self._cond = threading.Condition()
+
+    def _share(self):
+        return self.rate / self.processes
+
+    def _refill(self, now):
+        self._tokens = min(max(1.0, self._share()), self._tokens + (now - self._updated) * self._share())
+        self._updated = now
+
+    def acquire(self):
+        """Block until a page load may start; returns the seconds waited."""
+        started = time.monotonic()
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if now < self._open_until:
+                    self._cond.wait(self._open_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return time.monotonic() - started
+                self._cond.wait((1 - self._tokens) / self._share())
+
+    def record(self, kind, seconds, ok=True):
+        """Feed back one page load: how long it took and whether Chartink answered properly."""
+        with self._cond:
+            now = time.monotonic()
+            baseline = self._baseline.get(kind)
+            slow = baseline is not None and seconds > baseline * self.slow_factor and seconds - baseline > 1
+            if ok:
+                # Slowly rising minimum, so the baseline follows a lasting change in page weight
+                self._baseline[kind] = seconds if baseline is None else min(seconds, baseline * 1.02)
+            if ok and not slow:
+                self._failures = 0
+                self._probing = False
+                self._pause = self.breaker_pause
+                self._refill(now)
+                self.rate = min(self.max_rate, self.rate + self.increase / max(self.rate, 1.0))
+                return
+
+            if now - self._last_decrease >= max(1.0, seconds): # One halving per episode, not per in-flight page
+                self._refill(now)
+                self.rate = max(self.min_rate, self.rate / 2)
+                self._last_decrease = now
+            if ok:
+                return
+            self._failures += 1
+            if self._probing or self._failures >= self.breaker_failures:
+                self._open_until = now + self._pause
+                self.breaker_trips += 1
+                print(f"Chartink circuit breaker open for {self._pause:.0f}s after {self._failures} failure(s)")
+                self._pause = min(self._pause * 2, self.max_pause)
+                self._failures = 0
+                self._tokens = 0
+                self._probing = True
+                self._cond.notify_all()
+
+    def take_changes(self):
+        """``(rate factor since the last call, seconds the breaker stays open)`` for merging into the shared state."""
+        with self._cond:
+            factor = self.rate / self._synced_rate
+            self._synced_rate = self.rate
+            return factor, max(0.0, self._open_until - time.monotonic())
+
+    def apply_shared(self, rate, open_for, processes):
+        """Adopt the shared rate (keeping changes made since take_changes), a breaker opened
+        elsewhere for ``open_for`` more seconds, and the number of processes splitting the rate."""
+        with self._cond:
+            now = time.monotonic()
+            self._refill(now)
+            pending = self.rate / self._synced_rate
+            self.rate = min(self.max_rate, max(self.min_rate, rate * pending))
+            self._synced_rate = rate
+            self.processes = max(1, processes)
+            if open_for > 0 and now + open_for > self._open_until + 1:
+                self._open_until = now + open_for
+                self._tokens = 0
+                self._probing = True # As after a trip here: the next failure reopens it
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {'rate': round(self.rate, 3), 'breaker_open': time.monotonic() < self._open_until,
+                    'breaker_trips': self.breaker_trips, 'processes': self.processes}
+
+class _UnlimitedRate:
+    """Stand-in limiter for RATE_LIMIT_ENABLED=false."""
+
+    def acquire(self):
+        return 0.0
+
+    def record(self, kind, seconds, ok=True):
+        pass
+
+    def stats(self):
+        return {'rate': None, 'breaker_open': False, 'breaker_trips': 0, 'processes': 1}
+
+chartink_limiter = AdaptiveRateLimiter(
+    RATE_LIMIT_INITIAL, RATE_LIMIT_MIN, RATE_LIMIT_MAX, RATE_LIMIT_INCREASE, RATE_LIMIT_SLOW_FACTOR,
+    BREAKER_FAILURES, BREAKER_PAUSE_SECONDS, BREAKER_MAX_PAUSE_SECONDS
+) if RATE_LIMIT_ENABLED else _UnlimitedRate()
+
+def live_worker_processes():
+    """Worker processes loading Chartink pages now: those running jobs or chart units with a fresh heartbeat."""
+    cutoff = datetime.utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+    worker_ids = {worker_id for worker_id, in (
+        ScanJob.query.with_entities(ScanJob.worker_id)
+        .filter(ScanJob.worker_id.isnot(None), ScanJob.status.notin_(('queued',) + TERMINAL_STATUSES),
+                ScanJob.heartbeat_at >= cutoff))}
+    worker_ids |= {worker_id for worker_id, in (
+        ChartTask.query.with_entities(ChartTask.worker_id)
+        .filter(ChartTask.status == 'running', ChartTask.worker_id.isnot(None),
+                db.func.coalesce(ChartTask.heartbeat_at, ChartTask.claimed_at) >= cutoff))}
+    # Worker ids are host:pid:tag (chart workers add /n); one process may run both kinds
+    return len({worker_id.split('/')[0].rsplit(':', 1)[0] for worker_id in worker_ids})
+
+def sync_upstream_limit(limiter=None):
+    """Merge this process's rate changes and breaker into the shared UpstreamState row and adopt the result."""
+    limiter = limiter or chartink_limiter
+    if not isinstance(limiter, AdaptiveRateLimiter):
+        return
+    factor, open_for = limiter.take_changes()
+    now = datetime.utcnow()
+    with app.app_context():
+        state = db.session.get(UpstreamState, 'chartink', with_for_update=True)
+        if state is None:
+            state = UpstreamState(id='chartink', rate=limiter.rate)
+            db.session.add(state)
+        else:
+            state.rate = min(limiter.max_rate, max(limiter.min_rate, state.rate * factor))
+        if open_for and (state.breaker_open_until is None or state.breaker_open_until < now + timedelta(seconds=open_for)):
+            state.breaker_open_until = now + timedelta(seconds=open_for)
+        rate = state.rate
+        open_for = (state.breaker_open_until - now).total_seconds() if state.breaker_open_until else 0
+        db.session.commit()
+        processes = live_worker_processes()
+        db.session.remove()
+    limiter.apply_shared(rate, open_for, processes)
+
+_upstream_sync_started = threading.Event()
+
+def start_upstream_sync(stop_event):
+    """Keep this process's limiter in step with the shared state, once per process."""
+    if not RATE_LIMIT_ENABLED or _upstream_sync_started.is_set():
+        return
+    _upstream_sync_started.set()
+
+    def loop():
+        while not stop_event.wait(RATE_LIMIT_SYNC_INTERVAL):
+            try:
+                sync_upstream_limit()
+            except Exception as e:
+                print(f"Upstream limiter sync failed: {e}")
+        _upstream_sync_started.clear()
+    threading.Thread(target=loop, daemon=True).start()
+
+CHARTINK_BASE_URL = os.environ.get('CHARTINK_BASE_URL', 'https://chartink.com') # Overridden by the offline benchmark
+SCREENER_FETCH_MODE = os.environ.get('SCREENER_FETCH_MODE', 'auto') # 'auto' or 'paginate'
+
+# Reads every row of a client-side DataTable in one call. Returns null while there
+# is no jQuery DataTable or it has no rows yet, and SERVER_SIDE_TABLE when it is
+# server-side paginated (only the current page is held client-side), which
+# never changes, so the caller paginates at once instead of waiting.
+SERVER_SIDE_TABLE = 'server-side'
+SCREENER_ROWS_JS = """
+if (!window.jQuery || !jQuery.fn.dataTable) return null;
+const tables = jQuery.fn.dataTable.tables();
+if (!tables.length) return null;
+const dt = jQuery(tables[0]).DataTable();
+if (dt.page.info().serverSide) return 'server-side'; // SERVER_SIDE_TABLE
+const data = dt.rows().data().toArray();
+if (!data.length) return null;
+const nodes = dt.rows().nodes().toArray();
+const hrefs = [];
+data.forEach((row, i) => {
+    if (row && typeof row === 'object' && !Array.isArray(row) && row.nsecode) {
+        hrefs.push('/fundamentals/' + row.nsecode + '.html');
+        return;
+    }
+    if (nodes[i]) {
+        nodes[i].querySelectorAll('a[href]').forEach(a => hrefs.push(a.getAttribute('href')));
+    } else {
+        const html = document.createElement('div');
+        html.innerHTML = Array.isArray(row) ? row.join(' ') : String(row);
+        html.querySelectorAll('a[href]').forEach(a => hrefs.push(a.getAttribute('href')));
+    }
+});
+return hrefs;
+"""
+
+PAGE_HREFS_JS = "return Array.from(document.querySelectorAll('a[href]'), a => a.getAttribute('href'));"
+
+def stock_link_from_href(href):
+    """Normalise a screener result link to the /stocks/SYMBOL.html chart page, or None."""
+    # --- Old format: /fundamentals/SYMBOL.html ---
+    if 'fundamentals' in href:
+        return f"{CHARTINK_BASE_URL}{href.replace('fundamentals', 'stocks')}"
+
+    # --- New format: /stocks-new?...&symbol=SYMBOL ---
+    if 'stocks-new' in href and 'symbol=' in href:
+        symbol_list = parse_qs(urlparse(href).query).get('symbol', [])
+        if symbol_list:
+            return f"{CHARTINK_BASE_URL}/stocks/{symbol_list[0]}.html"
+    return None
+
+def _add_links(hrefs, results, seen):
+    """Append new stock links to ``results`` in order, using ``seen`` for O(1) dedupe."""
+    added = 0
+    for href in hrefs:
+        full_link = stock_link_from_href(href or '')
+        if full_link and full_link not in seen:
+            seen.add(full_link)
+            results.append(full_link)
+            added += 1
+    return added
+
+def get_url_and_index(driver, mode=None, page_timings=None):
+    results = []
+    seen = set()
+    mode = mode or SCREENER_FETCH_MODE
 
-async def send_telegram_pdf(token, chat_id, pdf_bytes, filename):
+    # Wait for table
     try:
-        bot = Bot(token=token)
-        await bot.send_document(chat_id=chat_id, document=pdf_bytes, filename=filename, caption="Here is your Chartink Scan PDF.")
+        WebDriverWait(driver, 60).until(
+            EC.presence_of_element_located((By.XPATH, "//*[contains(text(), 'Stock Name')]"))
+        )
     except Exception as e:
-        print(f"Telegram Error: {e}")
+        print("Error scraping URL:", e)
+        return results
 
-def get_url_and_index(driver):
-    results = []
-    # Logic from previous robust implementation
-    while True:
+    # Fast path: read the full result set from the DataTable in one shot
+    if mode == 'auto':
         try:
-            # Wait for table
-            WebDriverWait(driver, 60).until(
-                EC.presence_of_element_located((By.XPATH, "//*[contains(text(), 'Stock Name')]"))
+            hrefs = WebDriverWait(driver, 10, poll_frequency=0.2).until(
+                lambda d: d.execute_script(SCREENER_ROWS_JS)
             )
+            if hrefs == SERVER_SIDE_TABLE:
+                print("Screener DataTable is server-side paginated, falling back to pagination")
+            else:
+                _add_links(hrefs, results, seen)
+                print(f"Found {len(results)} links from the screener DataTable")
+                if results:
+                    return results
+        except Exception as e:
+            print(f"DataTable read unavailable ({e.__class__.__name__}), falling back to pagination")
 
-            soup = BeautifulSoup(driver.page_source, 'html.parser')
-            links = soup.find_all('a', href=True)
-            page_links = []
-            for link in links:
-                href = link.get('href')
-
-                # --- Old format: /fundamentals/SYMBOL.html ---
-                if 'fundamentals' in href:
-                    href = href.replace('fundamentals', 'stocks')
-                    full_link = f"https://chartink.com{href}"
-                    if full_link not in results and full_link not in page_links:
-                        page_links.append(full_link)
-
-                # --- New format: /stocks-new?...&symbol=SYMBOL ---
-                elif 'stocks-new' in href and 'symbol=' in href:
-                    parsed = urlparse(href)
-                    qs = parse_qs(parsed.query)
-                    symbol_list = qs.get('symbol', [])
-                    if symbol_list:
-                        symbol = symbol_list[0]
-                        full_link = f"https://chartink.com/stocks/{symbol}.html"
-                        if full_link not in results and full_link not in page_links:
-                            page_links.append(full_link)
-            
-            # Check for empty scrape on subsequent pages
-            if not page_links and results:
-                pass # Retrying implicitly or break
-
-            results.extend(page_links)
-            print(f"Found {len(page_links)} links on this page. Total: {len(results)}")
+    # Fallback: click through DataTables pagination
+    page_started = time.time()
+    while True:
+        try:
+            found = _add_links(driver.execute_script(PAGE_HREFS_JS), results, seen)
+            print(f"Found {found} links on this page. Total: {len(results)}")
+            # Each page's time covers waiting for it after the Next click plus reading it
+            if page_timings is not None:
+                page_timings.append(time.time() - page_started)
+            page_started = time.time()
 
             # Pagination Logic
             try:
@@ -246,15 +1104,16 @@ def get_url_and_index(driver):
 
                 # Find Next button
                 next_buttons = driver.find_elements(By.XPATH, "//button[contains(., 'Next')]")
-                
+
                 if next_buttons:
                     btn = next_buttons[0]
                     if btn.get_attribute('disabled') is not None:
                         break
-                    
+
                     driver.execute_script("arguments[0].scrollIntoView(true);", btn)
+                    chartink_limiter.acquire() # Each page is another request to Chartink
                     driver.execute_script("arguments[0].click();", btn)
-                    
+
                     try:
                         if current_first_stock:
                              WebDriverWait(driver, 10).until(
@@ -274,75 +1133,398 @@ def get_url_and_index(driver):
             break
     return results
 
-def get_image_from_link(driver, url, period, s_range, moving_averages):
-    try:
-        driver.get(url)
-        
-        # 1. Update Form/Settings (Simplified version of user's JS injection or using Selenium)
-        # We will use Selenium for stability as I might not have the full form structure to inject JS easily right now
-        # But the key is to set the Period/Range and CLICK UPDATE.
-        
-        # 1. Update Form/Settings via JS Injection
-        # Mappings
-        # Chartink 'ti' = Period (Duration eg 1 year). User passes this in 's_range' (e.g "1 year")
-        # Chartink 'd' = Range (Interval eg Weekly). User passes this in 'period' (e.g "weekly")
-        
-        ti_map = {
-            "1 day": "1", "2 days": "2", "3 days": "3", "5 days": "5", "10 days": "10",
-            "1 month": "22", "2 months": "44", "3 months": "66", "4 months": "91",
-            "6 months": "121", "9 months": "198", "1 year": "252", "2 years": "504",
-            "3 years": "756", "5 years": "1008", "8 years": "1764", "all data": "5000"
-        }
-        
-        d_map = {
-            "daily": "d", "weekly": "w", "monthly": "m",
-            "1 minute": "1_minute", "2 minute": "2_minute", "3 minute": "3_minute",
-            "5 minute": "5_minute", "10 minute": "10_minute", "15 minute": "15_minute",
-            "20 minute": "20_minute", "25 minute": "25_minute",
-            "30 minute": "30_minute", "45 minute": "45_minute", "75 minute": "75_minute",
-            "125 minute": "125_minute", "60 minute": "60_minute",
-            "120 minute": "120_minute", "180 minute": "180_minute", "240 minute": "240_minute"
-        }
+# Chartink 'ti' = Period (Duration eg 1 year). User passes this in 's_range' (e.g "1 year")
+# Chartink 'd' = Range (Interval eg Weekly). User passes this in 'period' (e.g "weekly")
+TI_MAP = {
+    "1 day": "1", "2 days": "2", "3 days": "3", "5 days": "5", "10 days": "10",
+    "1 month": "22", "2 months": "44", "3 months": "66", "4 months": "91",
+    "6 months": "121", "9 months": "198", "1 year": "252", "2 years": "504",
+    "3 years": "756", "5 years": "1008", "8 years": "1764", "all data": "5000"
+}
 
-        # Normalize inputs
-        user_duration = s_range.lower() if s_range else "1 year" # Maps to 'ti'
-        user_interval = period.lower() if period else "weekly"   # Maps to 'd'
+D_MAP = {
+    "daily": "d", "weekly": "w", "monthly": "m",
+    "1 minute": "1_minute", "2 minute": "2_minute", "3 minute": "3_minute",
+    "5 minute": "5_minute", "10 minute": "10_minute", "15 minute": "15_minute",
+    "20 minute": "20_minute", "25 minute": "25_minute",
+    "30 minute": "30_minute", "45 minute": "45_minute", "75 minute": "75_minute",
+    "125 minute": "125_minute", "60 minute": "60_minute",
+    "120 minute": "120_minute", "180 minute": "180_minute", "240 minute": "240_minute"
+}
 
-        ti_val = ti_map.get(user_duration, "252") 
-        d_val = d_map.get(user_interval, "w")
+def chart_interval_duration(period, s_range):
+    """Map the user's period/range to Chartink's (d, ti) values."""
+    user_duration = s_range.lower() if s_range else "1 year" # Maps to 'ti'
+    user_interval = period.lower() if period else "weekly"   # Maps to 'd'
+    return D_MAP.get(user_interval, "w"), TI_MAP.get(user_duration, "252")
 
-        # Prepare Data Dictionaries
-        inner_form_data = {
-            "ti": {"type": "select", "value": ti_val},
-            "d": {"type": "select", "value": d_val},
-            "c": {"type": "select", "value": "None"} # Default to CandleStick
-        }
+def build_chart_form_data(period, s_range, moving_averages):
+    """Build the ``innerform`` and ``newone3`` (moving averages) field values for a chart."""
+    d_val, ti_val = chart_interval_duration(period, s_range)
 
-        ma_form_data = {}
-        # Apply Moving Averages
-        type_map = {"Simple": "SMA", "Exponential": "EMA", "Weighted": "WMA", "Triangular": "TMA"}
-        field_map = {"Close": "c", "Open": "o", "High": "h", "Low": "l"}
-        
-        for i in range(1, 6):
-            ma_key = f"ma_{i}"
-            enabled = False
-            ma_data = {}
-            
-            if moving_averages and ma_key in moving_averages:
-                 ma_data = moving_averages[ma_key]
-                 if ma_data.get('enabled'):
-                     enabled = True
+    inner_form_data = {
+        "ti": {"type": "select", "value": ti_val},
+        "d": {"type": "select", "value": d_val},
+        "c": {"type": "select", "value": "None"} # Default to CandleStick
+    }
 
-            # Always set the checkbox state
-            ma_form_data[f"a{i}"] = {"type": "checkbox", "value": enabled}
-            
-            if enabled:
-                ma_form_data[f"a{i}t"] = {"type": "select", "value": field_map.get(ma_data.get('field'), 'c')}
-                ma_form_data[f"a{i}v"] = {"type": "select", "value": type_map.get(ma_data.get('type'), 'SMA')}
-                ma_form_data[f"a{i}l"] = {"type": "text", "value": str(ma_data.get('period', 20))}
+    ma_form_data = {}
+    type_map = {"Simple": "SMA", "Exponential": "EMA", "Weighted": "WMA", "Triangular": "TMA"}
+    field_map = {"Close": "c", "Open": "o", "High": "h", "Low": "l"}
+
+    for i in range(1, 6):
+        ma_key = f"ma_{i}"
+        enabled = False
+        ma_data = {}
+
+        if moving_averages and ma_key in moving_averages:
+            ma_data = moving_averages[ma_key]
+            if ma_data.get('enabled'):
+                enabled = True
+
+        # Always set the checkbox state
+        ma_form_data[f"a{i}"] = {"type": "checkbox", "value": enabled}
+
+        if enabled:
+            ma_form_data[f"a{i}t"] = {"type": "select", "value": field_map.get(ma_data.get('field'), 'c')}
+            ma_form_data[f"a{i}v"] = {"type": "select", "value": type_map.get(ma_data.get('type'), 'SMA')}
+            ma_form_data[f"a{i}l"] = {"type": "text", "value": str(ma_data.get('period', 20))}
+
+    return inner_form_data, ma_form_data
+
+# --- Direct HTTP Chart Engine ---
+# Fetches the stock page without a browser, replays the innerform/newone3
+# submission against the form's own action and reads img#cross (or the raw
+# image) from the response. Selenium is only used for symbols where this fails.
+HTTP_FETCH_CONCURRENCY = int(os.environ.get('HTTP_FETCH_CONCURRENCY', 8))
+HTTP_TIMEOUT = int(os.environ.get('HTTP_TIMEOUT', 20))
+DEFAULT_CHART_ENGINE = os.environ.get('CHART_ENGINE', 'selenium')
+http_slots = threading.BoundedSemaphore(HTTP_FETCH_CONCURRENCY)
+
+def _build_http_session():
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_FETCH_CONCURRENCY)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers['User-Agent'] = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36'
+    return session
+
+http_session = _build_http_session()
+
+def _form_fields(form):
+    """Default submission values of a parsed <form>, as a dict."""
+    fields = {}
+    if not form:
+        return fields
+    for field in form.find_all(['input', 'select', 'textarea']):
+        name = field.get('name')
+        if not name:
+            continue
+        if field.name == 'select':
+            option = field.find('option', selected=True) or field.find('option')
+            fields[name] = option.get('value', option.text) if option else ''
+        elif field.get('type') in ('checkbox', 'radio'):
+            if field.has_attr('checked'):
+                fields[name] = field.get('value', 'on')
+        elif field.get('type') not in ('submit', 'button', 'image'):
+            fields[name] = field.get('value', '')
+    return fields
+
+def _apply_form_data(fields, data):
+    for key, info in data.items():
+        if info['type'] == 'checkbox':
+            if info['value']:
+                fields[key] = fields.get(key) or 'on'
             else:
-                 # Ensure strict uncheck behavior
-                pass
+                fields.pop(key, None)
+        else:
+            fields[key] = info['value']
+
+def _company_name_from_soup(soup):
+    h3 = soup.find('h3', style='margin: 0px;margin-left: 5px;font-size:20px')
+    if h3 and h3.get_text(strip=True):
+        return h3.get_text(strip=True)
+    h1 = soup.find('h1')
+    return h1.get_text(strip=True) if h1 else "Unknown"
+
+def fetch_chart_http(url, period, s_range, moving_averages, timings=None):
+    """Fetch a chart without Selenium. Returns (company_name, base64 PNG) or (None, None)."""
+    if timings is None:
+        timings = {}
+    fetch_started = None
+    try:
+        with http_slots:
+            step_start = time.time()
+            chartink_limiter.acquire()
+            step_start = _record_step(timings, 'rate_limit_wait', step_start)
+            fetch_started = step_start
+            page = http_session.get(url, timeout=HTTP_TIMEOUT)
+            page.raise_for_status()
+            soup = BeautifulSoup(page.text, 'html.parser')
+            step_start = _record_step(timings, 'navigate', step_start)
+
+            form = soup.find('form', id='innerform')
+            if not form:
+                return None, None
+            fields = _form_fields(form)
+            fields.update(_form_fields(soup.find('form', id='newone3')))
+            inner_form_data, ma_form_data = build_chart_form_data(period, s_range, moving_averages)
+            _apply_form_data(fields, inner_form_data)
+            _apply_form_data(fields, ma_form_data)
+
+            action = urljoin(url, form.get('action') or url)
+            if (form.get('method') or 'get').lower() == 'post':
+                resp = http_session.post(action, data=fields, timeout=HTTP_TIMEOUT, headers={'Referer': url})
+            else:
+                resp = http_session.get(action, params=fields, timeout=HTTP_TIMEOUT, headers={'Referer': url})
+            resp.raise_for_status()
+            chartink_limiter.record('http_chart', time.time() - fetch_started)
+            step_start = _record_step(timings, 'chart_ready', step_start)
+
+        if resp.headers.get('Content-Type', '').startswith('image/'):
+            img_b64_str = base64.b64encode(resp.content).decode('ascii')
+        else:
+            img = BeautifulSoup(resp.text, 'html.parser').find('img', id='cross')
+            src = img.get('src') if img else None
+            if not src or 'base64' not in src:
+                return None, None
+            img_b64_str = src.split(",")[1]
+        _record_step(timings, 'extract', step_start)
+        return _company_name_from_soup(soup), img_b64_str
+
+    except requests.RequestException as e:
+        # Timeouts, dropped connections, 429 and 5xx mean Chartink is struggling; other errors are ours
+        status = e.response.status_code if e.response is not None else None
+        if fetch_started is not None:
+            chartink_limiter.record('http_chart', time.time() - fetch_started, ok=status is not None and status != 429 and status < 500)
+        print(f"HTTP chart fetch failed for {url}: {e}")
+        return None, None
+    except Exception as e:
+        print(f"HTTP chart fetch failed for {url}: {e}")
+        return None, None
+
+# --- Chart Image Cache ---
+# Decoded chart PNGs are cached on disk keyed by (symbol, d, ti, MA config) so
+# repeated presets and overlapping screeners do not re-render the same chart.
+CHART_CACHE_ENABLED = os.environ.get('CHART_CACHE_ENABLED', 'true').lower() == 'true'
+CHART_CACHE_DIR = os.environ.get('CHART_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'chartink_chart_cache'))
+CHART_CACHE_MAX_MB = int(os.environ.get('CHART_CACHE_MAX_MB', 500))
+CHART_CACHE_TTL_INTRADAY = int(os.environ.get('CHART_CACHE_TTL_INTRADAY', 5 * 60))
+CHART_CACHE_TTL_DAILY = int(os.environ.get('CHART_CACHE_TTL_DAILY', 4 * 3600))
+CHART_CACHE_TTL_WEEKLY = int(os.environ.get('CHART_CACHE_TTL_WEEKLY', 12 * 3600))
+
+def symbol_from_url(url):
+    match = re.search(r'/stocks/([^/]+)\.html', url)
+    return match.group(1) if match else url
+
+def chart_identity(url, period, s_range, moving_averages):
+    """Canonical (symbol, d, ti, MA config) of a chart; equal identities render the same image."""
+    d_val, ti_val = chart_interval_duration(period, s_range)
+    _, ma_form_data = build_chart_form_data(period, s_range, moving_averages)
+    return json.dumps([symbol_from_url(url).upper(), d_val, ti_val, ma_form_data], sort_keys=True)
+
+class ChartCache:
+    """Size-bounded, TTL-aware on-disk cache of chart PNGs.
+
+    Each entry is ``<key>.png`` plus a ``<key>.json`` sidecar holding the company
+    name and fetch time. The PNG's mtime is bumped on every hit, so evicting the
+    oldest mtimes first gives LRU order.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size = None
+        self._lock = threading.Lock()
+
+    def key(self, url, period, s_range, moving_averages):
+        """Return (cache key, TTL in seconds) for a chart request."""
+        d_val, _ = chart_interval_duration(period, s_range)
+        raw = chart_identity(url, period, s_range, moving_averages)
+        if d_val.endswith('_minute'):
+            ttl = CHART_CACHE_TTL_INTRADAY
+        elif d_val == 'd':
+            ttl = CHART_CACHE_TTL_DAILY
+        else:
+            ttl = CHART_CACHE_TTL_WEEKLY
+        return hashlib.sha256(raw.encode()).hexdigest(), ttl
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key)
+        return base + '.png', base + '.json'
+
+    def get(self, key, ttl):
+        """Return (company_name, png_bytes) for a fresh entry, or None."""
+        png_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if time.time() - meta['fetched_at'] > ttl:
+                return None
+            with open(png_path, 'rb') as f:
+                png_bytes = f.read()
+            os.utime(png_path)
+            return meta['company_name'], png_bytes
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, key, company_name, png_bytes):
+        png_path, meta_path = self._paths(key)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{png_path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(png_bytes)
+            os.replace(tmp_path, png_path)
+            with open(meta_path, 'w') as f:
+                json.dump({'company_name': company_name, 'fetched_at': time.time()}, f)
+        except OSError as e:
+            print(f"Chart cache write failed: {e}")
+            return
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += len(png_bytes)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.png'):
+                try:
+                    st = os.stat(os.path.join(self.directory, name))
+                    entries.append((st.st_mtime, st.st_size, name[:-4]))
+                except OSError:
+                    pass
+        return entries
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9 # Leave headroom so we do not evict on every put
+        for _, size, key in entries:
+            if total <= target:
+                break
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+        self._size = total
+
+chart_cache = ChartCache(CHART_CACHE_DIR, CHART_CACHE_MAX_MB * 1024 * 1024) if CHART_CACHE_ENABLED else None
+
+# Returns the current base64 src of img#cross inside the ChartImage iframe, or null.
+CHART_SRC_JS = """
+const frame = document.getElementById('ChartImage');
+try {
+    const doc = frame && frame.contentDocument;
+    if (!doc || doc.readyState !== 'complete') return null; // Its load event could still fire after Update
+    const img = doc.getElementById('cross');
+    return img && img.src && img.src.indexOf('base64') !== -1 ? img.src : null;
+} catch (e) {
+    return null;
+}
+"""
+
+# Resolves with the img#cross src of the chart that Update produced. The form
+# injection marks the iframe document shown before Update (__beforeUpdate), so
+# its late loads are ignored. A new document counts once fully loaded, even
+# with an identical chart (e.g. the requested settings are the defaults). In
+# the marked document only a change after Update counts - img#cross's src
+# reassigned, or differing from arguments[0] - and only if arguments[0] is set
+# (i.e. that document had finished loading with a chart before the click).
+CHART_READY_JS = """
+const previous = arguments[0];
+const done = arguments[arguments.length - 1];
+const frame = document.getElementById('ChartImage');
+if (!frame) { done(null); return; }
+
+let finished = false, observer = null, timer = null;
+function chartSrc(doc) {
+    const img = doc.getElementById('cross');
+    return img && img.src && img.src.indexOf('base64') !== -1 ? img.src : null;
+}
+function finish(value) {
+    if (finished) return;
+    finished = true;
+    if (observer) observer.disconnect();
+    clearInterval(timer);
+    frame.removeEventListener('load', observe);
+    done(value);
+}
+function check(reassigned) {
+    let doc;
+    try { doc = frame.contentDocument; } catch (e) { return; }
+    if (!doc || doc.readyState !== 'complete') return;
+    const src = chartSrc(doc);
+    if (!src) return;
+    if (!doc.__beforeUpdate || (previous && (reassigned || src !== previous))) finish(src);
+}
+function observe() {
+    try {
+        if (observer) observer.disconnect();
+        observer = new MutationObserver(mutations => check(
+            mutations.some(m => m.type === 'attributes' && m.target.id === 'cross')));
+        observer.observe(frame.contentDocument, {subtree: true, childList: true, attributes: true, attributeFilter: ['src']});
+    } catch (e) {}
+    check(false);
+}
+frame.addEventListener('load', observe);
+timer = setInterval(() => check(false), 250);
+observe();
+"""
+
+# Titles of the error pages a browser shows for 429 and 5xx answers (status codes are not visible to Selenium)
+UPSTREAM_ERROR_TITLE = re.compile(r'^\W*(error\s*)?(429|50[0-4])\b|too many requests|bad gateway|service unavailable|gateway time-?out'
+                                  r'|internal server error', re.I)
+CHART_READY_TIMEOUT = int(os.environ.get('CHART_READY_TIMEOUT', 15))
+
+def _record_step(timings, step, started):
+    """Store the elapsed time for ``step`` and return the start time of the next step."""
+    now = time.time()
+    timings[step] = round(now - started, 3)
+    return now
+
+def get_image_from_link(driver, url, period, s_range, moving_averages, timings=None, errors=None):
+    """Fetch one chart with Selenium. Returns (company_name, base64 PNG) or (None, None);
+    on failure the reason is appended to ``errors`` if given."""
+    if timings is None:
+        timings = {}
+    if errors is None:
+        errors = []
+    step_start = time.time()
+    chartink_limiter.acquire()
+    step_start = _record_step(timings, 'rate_limit_wait', step_start)
+    fetch_started = step_start
+    deadline = fetch_started + SYMBOL_TIMEOUT
+
+    def remaining(cap):
+        # Every wait below shares the symbol's SYMBOL_TIMEOUT budget
+        return max(0.5, min(cap, deadline - time.time()))
+
+    navigated = False
+    try:
+        driver.set_page_load_timeout(remaining(SYMBOL_TIMEOUT))
+        driver.get(url)
+        navigated = True
+        # Only the page load tells about Chartink's health; a loaded page without a chart is the symbol's problem
+        upstream_error = UPSTREAM_ERROR_TITLE.search(driver.title or '')
+        chartink_limiter.record('chart', time.time() - fetch_started, ok=not upstream_error)
+        if upstream_error:
+            errors.append(f"Chartink error page: {driver.title.strip()[:120]}")
+            return None, None
+        step_start = _record_step(timings, 'navigate', step_start)
+        
+        # 1. Update Form/Settings via JS Injection
+        inner_form_data, ma_form_data = build_chart_form_data(period, s_range, moving_averages)
 
         # JS Injection
         js_script = """
@@ -369,228 +1551,1999 @@ def get_image_from_link(driver, url, period, s_range, moving_averages):
         // Fill both forms
         fillForm('innerform', innerData);
         fillForm('newone3', maData);
+
+        // Mark the chart shown before Update so CHART_READY_JS only accepts what Update loads
+        try { document.getElementById('ChartImage').contentDocument.__beforeUpdate = true; } catch (e) {}
         """ % (json.dumps(inner_form_data), json.dumps(ma_form_data))
 
+        # Wait for the initial chart so a late default render is not mistaken for our update. Without
+        # it the Update could not be told apart from the default chart, so reload once, then give up
+        previous_src = None
+        for reload in range(2):
+            if reload:
+                chartink_limiter.acquire()
+                driver.refresh()
+            try:
+                previous_src = WebDriverWait(driver, remaining(10), poll_frequency=0.1).until(
+                    lambda d: d.execute_script(CHART_SRC_JS)
+                )
+                break
+            except Exception:
+                if time.time() >= deadline:
+                    break
+        step_start = _record_step(timings, 'initial_chart', step_start)
+        if not previous_src:
+            errors.append('Initial chart did not load')
+            return None, None
+
         try:
             driver.execute_script(js_script)
-            time.sleep(0.5) # Allow DOM updates
-            
-            # Click Update
+            # Click Update once; the refresh is detected below instead of sleeping
             update_btn = driver.find_element(By.ID, "innerb")
             driver.execute_script("arguments[0].click();", update_btn)
-            time.sleep(2) # Important: Wait for chart reload
-            
         except Exception as e:
             print(f"Error updating chart settings: {e}")
-            pass
+        step_start = _record_step(timings, 'form_injection', step_start)
 
-        # IMPORTANT: Click Update Chart
+        src = None
         try:
-            driver.find_element(By.ID, "innerb").click()
-            time.sleep(1) # Wait for update to trigger
-        except:
+            driver.set_script_timeout(remaining(CHART_READY_TIMEOUT))
+            src = driver.execute_async_script(CHART_READY_JS, previous_src)
+        except Exception:
             pass
+        step_start = _record_step(timings, 'chart_ready', step_start)
 
         # 2. Extract Company Name
         company_name = "Unknown"
-        try:
-            company_name = WebDriverWait(driver, 5).until(
-                EC.presence_of_element_located((By.XPATH, "//h3[@style='margin: 0px;margin-left: 5px;font-size:20px']"))
-            ).text
-        except:
+        names = driver.find_elements(By.XPATH, "//h3[@style='margin: 0px;margin-left: 5px;font-size:20px']")
+        if names and names[0].text:
+            company_name = names[0].text
+        else:
             try:
                 company_name = driver.find_element(By.TAG_NAME, "h1").text.strip()
             except:
                 pass
 
-
-        # 3. Switch to Iframe and Get Image
-        try:
-            iframe = WebDriverWait(driver, 10).until(
-                EC.presence_of_element_located((By.ID, "ChartImage"))
-            )
-            driver.switch_to.frame(iframe)
-            
-            # Wait for img#cross
-            img_tag = WebDriverWait(driver, 10).until(
-                EC.presence_of_element_located((By.ID, "cross"))
-            )
-            
-            src = img_tag.get_attribute("src")
-            if src and "base64" in src:
-                img_b64_str = src.split(",")[1]
-                return company_name, img_b64_str
-            else:
-                # Fallback if src is a link (download it) or not base64
-                # Or re-read user's code: they expect base64 splitting. 
+        # 3. Fallback: switch to the iframe and read img#cross directly. Only a chart that differs from
+        # the one shown before Update is ours; the default chart would be cached under our settings
+        if not src:
+            try:
+                iframe = WebDriverWait(driver, remaining(10)).until(
+                    EC.presence_of_element_located((By.ID, "ChartImage"))
+                )
+                driver.switch_to.frame(iframe)
+
+                img_tag = WebDriverWait(driver, remaining(10)).until(
+                    EC.presence_of_element_located((By.ID, "cross"))
+                )
+                src = img_tag.get_attribute("src")
+            except Exception:
                 pass
-
-        except Exception as e:
-            # print(f"Iframe/Img extraction failed: {e}")
-            pass
-            
-        # Fallback to screenshotting the body if img#cross failing (just in case)
-        # But per user request we focused on img#cross
+            finally:
+                driver.switch_to.default_content()
+            if src == previous_src:
+                errors.append('Timed out waiting for the updated chart')
+                return None, None
+        _record_step(timings, 'extract', step_start)
+
+        if src and "base64" in src:
+            img_b64_str = src.split(",")[1]
+            return company_name, img_b64_str
+        errors.append('No chart image on the page' if time.time() < deadline else 'Timed out waiting for the chart')
         return None, None
 
     except Exception as e:
+        if not navigated: # Navigation errors and page-load timeouts
+            chartink_limiter.record('chart', time.time() - fetch_started, ok=False)
         print(f"Error getting image for {url}: {e}")
+        errors.append(f"{e.__class__.__name__}: {str(e).strip().splitlines()[0][:120] if str(e).strip() else 'no details'}")
         return None, None
 
-def generate_pdf(data):
-    buffer = BytesIO()
-    c = canvas.Canvas(buffer, pagesize=A4)
-    page_width = A4[0] 
+# Finished PDFs are spooled here instead of being held in the job dict
+JOB_OUTPUT_DIR = os.environ.get('JOB_OUTPUT_DIR', os.path.join(tempfile.gettempdir(), 'chartink_jobs'))
+
+# --- PDF Output Profiles ---
+# Charts can be re-encoded before they go into the PDF. reportlab embeds JPEGs
+# as-is but expands everything else to raw RGB and deflates it again, so
+# 'small' (JPEG) also makes PDF assembly much cheaper. A profile is a name
+# from PDF_PROFILES or a spec such as "width=1000,jpeg=70" or "palette=32".
+PDF_PROFILES = {
+    'original': {},
+    'compact': {'width': 1000, 'palette': 32},  # Charts are flat-colour line art; best for them
+    'small': {'width': 800, 'jpeg': 60},        # Smallest for anti-aliased or photo-like charts
+}
+PDF_PROFILE = os.environ.get('PDF_PROFILE', 'original')
+PDF_ENCODE_WORKERS = int(os.environ.get('PDF_ENCODE_WORKERS', os.cpu_count() or 2))
+# Output is split into parts so each stays under Telegram's 50 MB bot upload limit (0 = never split)
+PDF_MAX_MB = float(os.environ.get('PDF_MAX_MB', 45))
+
+rl_config.useA85 = 0 # Write image streams as binary; ASCII85 only inflates them by a quarter
+
+# Shared by all jobs; PIL releases the GIL while resizing, quantizing and encoding
+pdf_encode_pool = ThreadPoolExecutor(max_workers=PDF_ENCODE_WORKERS, thread_name_prefix='pdf-encode')
+atexit.register(pdf_encode_pool.shutdown, wait=False)
+
+def parse_pdf_profile(profile):
+    """Return the encoding options of a profile name or spec; raises ValueError if invalid."""
+    profile = (profile or PDF_PROFILE).strip()
+    if profile in PDF_PROFILES:
+        return dict(PDF_PROFILES[profile])
+    options = {}
+    for part in profile.split(','):
+        key, _, value = part.partition('=')
+        key = key.strip()
+        if key not in ('width', 'palette', 'jpeg'):
+            raise ValueError(f"Unknown PDF profile '{profile}'")
+        options[key] = int(value)
+    if not 100 <= options.get('width', 100) <= 10000 or not 2 <= options.get('palette', 2) <= 256 \
+            or not 1 <= options.get('jpeg', 1) <= 95:
+        raise ValueError(f"PDF profile '{profile}' is out of range")
+    return options
+
+def encode_chart(path, options, target_base):
+    """Re-encode the chart PNG at ``path`` per the profile ``options``; returns the new file's path."""
+    with PILImage.open(path) as image:
+        image = image.convert('RGB')
+        width = options.get('width')
+        if width and image.width > width:
+            image = image.resize((width, round(image.height * width / image.width)), PILImage.LANCZOS)
+        if options.get('jpeg'):
+            target = target_base + '.jpg' # reportlab only passes JPEGs through untouched
+            image.save(target, 'JPEG', quality=options['jpeg'], optimize=True)
+        else:
+            if options.get('palette'):
+                image = image.quantize(options['palette'], method=PILImage.Quantize.FASTOCTREE)
+            target = target_base + '.png'
+            image.save(target, 'PNG')
+    return target
+
+class PageEncoder:
+    """Re-encodes a job's charts for its PDF profile on the shared pool, then feeds the sinks.
+
+    With the 'original' profile, charts go to the sinks unchanged.
+    """
+
+    def __init__(self, options, sinks, checkpoint, job_id=None):
+        self.options = options
+        self.sinks = sinks
+        self.checkpoint = checkpoint
+        self.job_id = job_id
+        self._futures = []
+        self._lock = threading.Lock()
+
+    def put(self, index, item):
+        if not item or not self.options:
+            self._deliver(index, item)
+            return
+        future = pdf_encode_pool.submit(self._encode, index, item)
+        with self._lock:
+            self._futures.append(future)
+
+    def _encode(self, index, item):
+        company_name, path = item
+        started = time.time()
+        try:
+            item = (company_name, encode_chart(path, self.options, self.checkpoint.chart_path(index)[:-4] + '.pdf'))
+            record_stage(self.job_id, 'pdf_encode', time.time() - started)
+        except Exception as e:
+            print(f"Chart re-encode failed for {path}, using the original: {e}")
+        self._deliver(index, item)
+
+    def _deliver(self, index, item):
+        for sink in self.sinks:
+            sink.put(index, item)
+
+    def wait(self):
+        """Block until every submitted chart has been encoded and delivered."""
+        with self._lock:
+            futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+
+class PdfStreamWriter:
+    """Writes one chart per page to a PDF as charts arrive.
+
+    Pages take the chart files straight from disk, so no decoded PIL image is
+    kept around. With ``max_bytes`` (``target`` must be a path) the output
+    rolls over to ``<name>.part2.pdf`` and so on before a part would exceed it.
+    """
+
+    def __init__(self, target, max_bytes=None):
+        self.target = target
+        self.max_bytes = max_bytes
+        self.paths = [target]
+        self.canvas = canvas.Canvas(target, pagesize=A4)
+        self.pages = 0
+        self._part_bytes = 0
+        self._part_pages = 0
+
+    def _reserve(self, size):
+        """Account for a page of about ``size`` bytes, starting a new part if it would not fit."""
+        if self.max_bytes and self._part_pages and self._part_bytes + size > self.max_bytes:
+            self.canvas.save()
+            base, ext = os.path.splitext(self.target)
+            path = f"{base}.part{len(self.paths) + 1}{ext}"
+            self.paths.append(path)
+            self.canvas = canvas.Canvas(path, pagesize=A4)
+            self._part_bytes = 0
+            self._part_pages = 0
+        self._part_bytes += size
+        self._part_pages += 1
+
+    @staticmethod
+    def _image_bytes(image):
+        size = len(image) if isinstance(image, bytes) else os.path.getsize(image)
+        if isinstance(image, str) and image.endswith('.jpg'):
+            return size + 2048
+        return int(size * 1.5) + 2048 # PNG pixels are re-deflated by reportlab; allow for it growing
+
+    def add_page(self, company_name, image):
+        """Add a chart page; ``image`` is PNG bytes or the path of a PNG or JPEG file."""
+        self._reserve(self._image_bytes(image))
+        c = self.canvas
+        page_width = A4[0]
+        reader = ImageReader(BytesIO(image) if isinstance(image, bytes) else image)
 
-    for item in data:
-        company_name = item['company_name']
-        image = item['image']
-        
-        img_buffer = BytesIO()
-        image.save(img_buffer, format='PNG')
-        img_buffer.seek(0)
-        
         margin = 20
         draw_width = page_width - (margin * 2)
-        
-        img_width, img_height = image.size
+
+        img_width, img_height = reader.getSize()
         aspect_ratio = img_height / img_width
         draw_height = draw_width * aspect_ratio
-        
+
         total_page_height = 50 + draw_height + 20
         c.setPageSize((page_width, total_page_height))
-        
+
         c.setFont("Helvetica-Bold", 16)
         c.drawCentredString(page_width / 2, total_page_height - 35, company_name)
-        c.drawImage(ImageReader(img_buffer), margin, 20, width=draw_width, height=draw_height)
+        c.drawImage(reader, margin, 20, width=draw_width, height=draw_height)
+        c.showPage()
+        self.pages += 1
+
+    def add_section(self, title, subtitle=''):
+        """Add a short title page that starts a screener's section in a combined PDF."""
+        self._reserve(2048)
+        c = self.canvas
+        page_width = A4[0]
+        page_height = 160
+        c.setPageSize((page_width, page_height))
+        c.setFont("Helvetica-Bold", 22)
+        c.drawCentredString(page_width / 2, page_height / 2 + 8, title)
+        if subtitle:
+            c.setFont("Helvetica", 12)
+            c.drawCentredString(page_width / 2, page_height / 2 - 18, subtitle)
         c.showPage()
+        self.pages += 1
+
+    def add_text_page(self, title, lines):
+        """Add a page with a heading and a list of lines (e.g. symbols that left a screener)."""
+        self._reserve(2048 + 40 * len(lines))
+        c = self.canvas
+        page_width = A4[0]
+        line_height = 16
+        page_height = 70 + line_height * max(len(lines), 1) + 20
+        c.setPageSize((page_width, page_height))
+        c.setFont("Helvetica-Bold", 16)
+        c.drawCentredString(page_width / 2, page_height - 35, title)
+        c.setFont("Helvetica", 11)
+        y = page_height - 70
+        for line in lines:
+            c.drawString(40, y, line)
+            y -= line_height
+        c.showPage()
+        self.pages += 1
+
+    def close(self):
+        self.canvas.save()
+
+# A layout entry for a page of text, e.g. the symbols that dropped out of a screener
+TextPage = namedtuple('TextPage', 'title lines')
+
+class OrderedPageSink:
+    """Feeds out-of-order chart results to a PdfStreamWriter in layout order.
+
+    ``layout`` lists the pages: an int is the index of a chart task, a str is a
+    section title and a ``TextPage`` is a page of text. A task may appear more than once (the same chart in several
+    sections). Workers call ``put(index, item)`` with ``(company_name,
+    png_bytes_or_path)`` or ``None`` for a chart that could not be fetched; an
+    item is only kept until its last page in the layout has been written.
+    """
+
+    def __init__(self, writer, layout, job_id=None):
+        self.writer = writer
+        self.layout = layout
+        self.job_id = job_id
+        self.charts = 0
+        self._remaining = {}
+        for entry in layout:
+            if isinstance(entry, int):
+                self._remaining[entry] = self._remaining.get(entry, 0) + 1
+        self._done = {}
+        self._position = 0
+        self._lock = threading.Lock()
+
+    def put(self, index, item):
+        with self._lock:
+            if index not in self._remaining:
+                return # Not a chart of this document
+            self._done[index] = item
+            self._advance()
+
+    def flush(self):
+        """Write the rest of the layout, skipping charts that never arrived."""
+        with self._lock:
+            self._advance(skip_missing=True)
+
+    def _advance(self, skip_missing=False):
+        while self._position < len(self.layout):
+            entry = self.layout[self._position]
+            if isinstance(entry, str):
+                self.writer.add_section(entry, self._section_subtitle())
+            elif isinstance(entry, TextPage):
+                self.writer.add_text_page(entry.title, entry.lines)
+            elif entry in self._done:
+                self._write(self._done[entry])
+                self._remaining[entry] -= 1
+                if not self._remaining[entry]:
+                    del self._done[entry]
+            elif not skip_missing:
+                break
+            self._position += 1
 
-    c.save()
-    return buffer.getvalue()
+    def _section_subtitle(self):
+        count = 0
+        for entry in self.layout[self._position + 1:]:
+            if isinstance(entry, str):
+                break
+            if isinstance(entry, int):
+                count += 1
+        return f"{count} stock{'s' if count != 1 else ''}"
+
+    def _write(self, item):
+        if item:
+            started = time.time()
+            self.writer.add_page(*item)
+            self.charts += 1
+            record_stage(self.job_id, 'pdf_page', time.time() - started)
+
+class JobCheckpoint:
+    """On-disk progress for one job so a failed or stopped scan can be resumed.
+
+    Layout under ``JOB_OUTPUT_DIR/<job_id>/``: ``urls.json`` (the scraped stock
+    URLs, one list per screener), ``diffs.json`` (the diff-mode comparison the
+    chart tasks were planned from), ``charts/<index>.png`` per unique chart task
+    with a ``charts/<index>.json`` sidecar written after the PNG (so a sidecar
+    implies a complete PNG), and the output PDFs.
+    """
+
+    def __init__(self, job_id):
+        self.directory = os.path.join(JOB_OUTPUT_DIR, job_id)
+        self.charts_dir = os.path.join(self.directory, 'charts')
+        self.pdf_path = os.path.join(self.directory, 'charts.pdf')
+
+    def _write_atomic(self, path, data):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def load_urls(self):
+        """Return the scraped URLs as one list per screener, or None if not scraped yet."""
+        try:
+            with open(os.path.join(self.directory, 'urls.json')) as f:
+                urls = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if urls and isinstance(urls[0], str):
+            urls = [urls] # Checkpoint of a single-screener job from before batching
+        return urls
+
+    def save_urls(self, screener_urls):
+        os.makedirs(self.charts_dir, exist_ok=True)
+        self._write_atomic(os.path.join(self.directory, 'urls.json'), json.dumps(screener_urls).encode())
+
+    def load_diffs(self):
+        """Return the saved screener_diffs result, or None if the job has not planned its charts yet."""
+        try:
+            with open(os.path.join(self.directory, 'diffs.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save_diffs(self, diffs):
+        self._write_atomic(os.path.join(self.directory, 'diffs.json'), json.dumps(diffs).encode())
+
+    def output_path(self, name):
+        return os.path.join(self.directory, name)
+
+    def chart_path(self, index):
+        return os.path.join(self.charts_dir, f"{index:05d}.png")
+
+    def save_chart(self, index, company_name, png_bytes):
+        """Persist one fetched chart and return the path of its PNG."""
+        path = self.chart_path(index)
+        self._write_atomic(path, png_bytes)
+        self._write_atomic(path[:-4] + '.json', json.dumps({'company_name': company_name}).encode())
+        return path
+
+    def completed(self):
+        """Return ``{index: company_name}`` for every checkpointed chart."""
+        done = {}
+        try:
+            names = os.listdir(self.charts_dir)
+        except OSError:
+            return done
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.charts_dir, name)) as f:
+                    done[int(name[:-5])] = json.load(f)['company_name']
+            except (OSError, ValueError, KeyError):
+                pass
+        return done
+
+    def clear_charts(self):
+        shutil.rmtree(self.charts_dir, ignore_errors=True)
+
+def add_step_timings(job_id, timings, prefix=''):
+    """Record the per-step chart fetch timings (seconds) from one fetch."""
+    for step, seconds in timings.items():
+        record_stage(job_id, prefix + step, seconds)
+
+# Attempts per chart: the first in the main pass, the rest in retry passes at the end of the job
+SYMBOL_MAX_ATTEMPTS = max(1, int(os.environ.get('SYMBOL_MAX_ATTEMPTS', 2)))
+
+class SymbolFailures:
+    """Per-chart attempt counts, the deferred retry queue and the final failure list of one job.
+
+    A chart that fails is set aside and retried after every other chart has
+    been fetched, with fresh browsers, instead of holding up a worker now.
+    """
+
+    def __init__(self, max_attempts=SYMBOL_MAX_ATTEMPTS):
+        self.max_attempts = max_attempts
+        self.attempts = {}
+        self.failed = {} # index -> report entry
+        self._deferred = []
+        self._lock = threading.Lock()
+
+    def fail(self, index, task, reason):
+        """Record a failed attempt; returns True if the chart was deferred for another try."""
+        with self._lock:
+            attempts = self.attempts[index] = self.attempts.get(index, 0) + 1
+            if attempts < self.max_attempts:
+                self._deferred.append((index, task))
+                return True
+            self.failed[index] = {'symbol': symbol_from_url(task['url']), 'url': task['url'],
+                                  'reason': reason, 'attempts': attempts}
+            return False
+
+    def defer(self, index, task):
+        """Set a chart aside for the retry pass without counting an attempt (e.g. no browser was available)."""
+        with self._lock:
+            self._deferred.append((index, task))
+
+    def take_deferred(self):
+        with self._lock:
+            deferred, self._deferred = self._deferred, []
+        return deferred
+
+    def report(self, indices=None):
+        """Failure entries, in task order, optionally only for ``indices``."""
+        with self._lock:
+            return [self.failed[index] for index in sorted(self.failed) if indices is None or index in indices]
+
+def failed_symbols_page(failed):
+    return TextPage(f"Charts that could not be fetched ({len(failed)})",
+                    [f"{entry['symbol']}: {entry['reason']} ({entry['attempts']} attempt{'s' if entry['attempts'] != 1 else ''})"
+                     for entry in failed])
+
+def fetch_chart(job_id, task, engine='selenium', fresh=False, errors=None):
+    """Fetch one chart task; returns ``(company_name, png_bytes, cached)``.
+
+    ``png_bytes`` is None when no chart came back (the reason is appended to
+    ``errors``). With ``engine='http'`` the chart is fetched directly first and
+    a leased driver is only used if that fails; ``fresh`` leases a new browser
+    and retires it afterwards. Raises when no browser could be leased or the
+    browser broke.
+    """
+    url, period, s_range, moving_averages = task['url'], task.get('period'), task.get('range'), task.get('moving_averages')
+    cache_key = None
+    if chart_cache:
+        cache_key, cache_ttl = chart_cache.key(url, period, s_range, moving_averages)
+        cached = chart_cache.get(cache_key, cache_ttl)
+        if cached:
+            return cached[0], cached[1], True
+
+    company_name = img_data_base64 = None
+    if engine == 'http':
+        timings = {}
+        company_name, img_data_base64 = fetch_chart_http(url, period, s_range, moving_averages, timings)
+        add_step_timings(job_id, timings, prefix='http_')
+
+    if not (company_name and img_data_base64):
+        pooled = None
+        try:
+            pooled = driver_pool.lease(job_id, CHART_DRIVER_PROFILE, fresh=fresh)
+            timings = {}
+            company_name, img_data_base64 = get_image_from_link(pooled.driver, url, period, s_range, moving_averages, timings, errors)
+            pooled.pages += 1
+            add_step_timings(job_id, timings)
+        except Exception:
+            if pooled:
+                driver_pool.release(pooled, broken=True)
+            raise
+        driver_pool.release(pooled, broken=fresh) # Retry passes never hand their browser to the next chart
+
+    if not (company_name and img_data_base64):
+        return company_name, None, False
+    decode_started = time.time()
+    img_data = base64.b64decode(img_data_base64)
+    if cache_key:
+        chart_cache.put(cache_key, company_name, img_data)
+    record_stage(job_id, 'decode', time.time() - decode_started)
+    return company_name, img_data, False
+
+def chart_worker(job_id, task_queue, sinks, checkpoint, progress_lock, engine='selenium', failures=None, fresh=False):
+    """Pull (index, task) pairs off the shared queue and fetch each chart.
+
+    A task is a dict with the chart's ``url``, ``period``, ``range`` and
+    ``moving_averages``; every finished chart is handed to all ``sinks``. A
+    chart that fails goes to ``failures`` (a SymbolFailures), which defers it
+    for a retry pass or gives up on it; ``fresh`` leases a new browser for
+    every chart (retry passes). See fetch_chart for ``engine``.
+    """
+    max_retries = 5 # Give up on this worker after 5 browser crashes or failed starts
+    retry_count = 0
+    failures = failures or SymbolFailures(max_attempts=1)
+
+    def deliver(index, item):
+        for sink in sinks:
+            sink.put(index, item)
+
+    while retry_count < max_retries:
+        if jobs[job_id].get('canceled'):
+            return
+        try:
+            index, task = task_queue.get_nowait()
+        except queue.Empty:
+            return
+
+        jobs[job_id]['current_company'] = task['url'] # Update status
+        fetch_started = time.time()
+        errors = []
+        try:
+            company_name, img_data, cached = fetch_chart(job_id, task, engine, fresh, errors)
+        except Exception as e:
+            print(f"Driver crashed/error in job {job_id} at index {index}: {e}. Restarting driver...")
+            failures.defer(index, task) # A browser problem, not the symbol's: retried at the end without using an attempt
+            retry_count += 1
+            time.sleep(random.uniform(0, min(30, 2 ** retry_count))) # Jittered backoff so workers do not retry in step
+            continue
+        if chart_cache:
+            with progress_lock:
+                jobs[job_id]['cache_hits' if cached else 'cache_misses'] += 1
+
+        if img_data:
+            deliver(index, (company_name, checkpoint.save_chart(index, company_name, img_data)))
+            jobs[job_id]['current_company'] = company_name # Better name
+        else:
+            record_stage(job_id, 'chart_fetch_failed', time.time() - fetch_started)
+            if failures.fail(index, task, errors[-1] if errors else 'No chart returned'):
+                continue # Deferred: counted as processed once its last attempt is done
+            deliver(index, None)
+        if not cached:
+            record_stage(job_id, 'chart_fetch', time.time() - fetch_started)
+
+        with progress_lock:
+            jobs[job_id]['processed'] += 1
+
+    print(f"Max retries reached for a worker in job {job_id}")
+
+def fetch_charts_locally(job_id, tasks, done, checkpoint, sinks, engine='selenium'):
+    """Fetch every chart not in ``done`` with this process's chart workers; returns the SymbolFailures."""
+    task_queue = queue.Queue()
+    for index, task in enumerate(tasks):
+        if index not in done:
+            task_queue.put((index, task))
+
+    progress_lock = threading.Lock()
+    failures = SymbolFailures()
+
+    def run_workers(engine, cap, fresh=False):
+        workers = [
+            threading.Thread(target=chart_worker, daemon=True,
+                             args=(job_id, task_queue, sinks, checkpoint, progress_lock, engine, failures, fresh))
+            for _ in range(max(1, min(cap, task_queue.qsize())))
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        # Workers that gave up (browser would not start) leave tasks behind; retry those too
+        while not task_queue.empty():
+            failures.defer(*task_queue.get_nowait())
+
+    # The HTTP engine is I/O-bound, so it can run more workers than there are browsers
+    run_workers(engine, HTTP_FETCH_CONCURRENCY if engine == 'http' else CHART_WORKERS_PER_JOB)
+
+    # Failed charts were set aside so they did not hold up the rest; retry them with fresh browsers
+    for _ in range(SYMBOL_MAX_ATTEMPTS):
+        retry = failures.take_deferred()
+        if not retry or jobs[job_id].get('canceled'):
+            break
+        jobs[job_id]['current_company'] = f"Retrying {len(retry)} failed chart{'s' if len(retry) != 1 else ''}"
+        for item in retry:
+            task_queue.put(item)
+        run_workers('selenium', CHART_WORKERS_PER_JOB, fresh=True)
+    leftover = failures.take_deferred()
+    if not jobs[job_id].get('canceled'): # A stopped job retries these when resumed
+        for index, task in leftover: # Browsers never became available
+            failures.failed[index] = {'symbol': symbol_from_url(task['url']), 'url': task['url'],
+                                      'reason': 'No browser available', 'attempts': failures.attempts.get(index, 0)}
+            jobs[job_id]['processed'] += 1
+    return failures
+
+def screener_title(url):
+    """A readable section title for a screener URL (its last path segment)."""
+    path = urlparse(url).path.rstrip('/')
+    return path.rsplit('/', 1)[-1] or url
+
+def plan_chart_tasks(screeners, screener_urls):
+    """Dedupe the charts of several screeners.
+
+    Returns ``(tasks, sections)``: one task per unique (symbol, interval,
+    duration, MA) chart, and for each screener the task indices of its charts
+    in screener order.
+    """
+    tasks = []
+    sections = []
+    seen = {}
+    for screener, urls in zip(screeners, screener_urls):
+        indices = []
+        for url in urls:
+            identity = chart_identity(url, screener.get('period'), screener.get('range'), screener.get('moving_averages'))
+            if identity not in seen:
+                seen[identity] = len(tasks)
+                tasks.append({
+                    'url': url,
+                    'period': screener.get('period'),
+                    'range': screener.get('range'),
+                    'moving_averages': screener.get('moving_averages')
+                })
+            indices.append(seen[identity])
+        sections.append(indices)
+    return tasks, sections
+
+def screener_diffs(screeners, screener_urls):
+    """Compare diff-mode screeners with their preset's last completed run.
+
+    Returns one entry per screener: None for a full run, otherwise a dict with
+    the preset id, the mode, every scraped ``symbols``, the ``urls`` to fetch
+    (newly entered symbols only) and their symbols as ``new``, and the symbols
+    that ``dropped`` out ('changes' mode only). A preset with no baseline yet
+    fetches everything.
+    """
+    diffs = []
+    with app.app_context():
+        for screener, urls in zip(screeners, screener_urls):
+            preset = db.session.get(ScanPreset, screener['diff_preset_id']) if screener.get('diff_mode') else None
+            if preset is None:
+                diffs.append(None)
+                continue
+            try:
+                previous = set(json.loads(preset.last_symbols)) if preset.last_symbols else None
+            except ValueError:
+                previous = None
+            symbols = [symbol_from_url(url).upper() for url in urls]
+            if previous is None:
+                new_urls, dropped = urls, []
+            else:
+                new_urls = [url for url, symbol in zip(urls, symbols) if symbol not in previous]
+                dropped = sorted(previous - set(symbols)) if screener['diff_mode'] == 'changes' else []
+            diffs.append({
+                'preset_id': preset.id,
+                'mode': screener['diff_mode'],
+                'symbols': symbols,
+                'urls': new_urls,
+                'new': [symbol_from_url(url).upper() for url in new_urls],
+                'dropped': dropped,
+                'first_run': previous is None
+            })
+    return diffs
+
+def save_diff_baselines(diffs):
+    """Make this run's symbols the baseline of each diff-mode preset."""
+    with app.app_context():
+        for diff in diffs:
+            if not diff:
+                continue
+            preset = db.session.get(ScanPreset, diff['preset_id'])
+            if preset:
+                preset.last_symbols = json.dumps(diff['symbols'])
+        db.session.commit()
 
-def process_job(job_id, screener_url, period, s_range, moving_averages, user_config):
+def diff_summary_text(screeners, diffs):
+    lines = ['Chartink changes since the last run']
+    for screener, diff in zip(screeners, diffs):
+        if not diff:
+            continue
+        lines.append('')
+        lines.append(screener['title'] + (' (first run)' if diff['first_run'] else ''))
+        lines.append(f"New ({len(diff['new'])}): {', '.join(diff['new']) or '-'}")
+        if diff['mode'] == 'changes':
+            lines.append(f"Dropped ({len(diff['dropped'])}): {', '.join(diff['dropped']) or '-'}")
+    return '\n'.join(lines)
+
+def _file_slug(text):
+    return re.sub(r'[^A-Za-z0-9_-]+', '_', text).strip('_') or 'screener'
+
+def process_job(job_id, screeners, user_config, engine='selenium', output='combined', pdf_profile=None):
+    """Scrape every screener, fetch each unique chart once and build the PDF(s).
+
+    ``screeners`` is a list of ``{'title', 'url', 'period', 'range',
+    'moving_averages'}`` (plus ``diff_mode``/``diff_preset_id`` for presets in
+    diff mode). ``output='combined'`` writes one PDF with a section per
+    screener; ``'per_screener'`` writes one PDF per screener (zipped for download).
+    ``pdf_profile`` picks how charts are encoded (see PDF_PROFILES) and every
+    PDF is split into parts of at most PDF_MAX_MB. Telegram targets listed in
+    ``user_config['telegram_stream_targets']`` also get the charts in albums
+    while they are fetched; the finished PDFs are sent by deliver_job_result.
+
+    With CHART_QUEUE_ENABLED the charts are handed to the chart queue instead:
+    the job leaves off in 'fetching_charts' and is run again for its PDF
+    stage once every chart unit is finished.
+    """
     jobs[job_id]['status'] = 'running'
-    jobs[job_id]['canceled'] = False
+    jobs[job_id].setdefault('canceled', False)
     
-    processed_data = [] # Accumulate data
-    urls = []
-    
-    # Attempt to get URLs first
-    driver = None
+    checkpoint = JobCheckpoint(job_id)
+    screener_urls = checkpoint.load_urls()
+
+    # Attempt to get URLs first (skipped when resuming from a checkpoint)
+    if screener_urls is None:
+        screener_urls = []
+        pooled = None
+        broken = False
+        try:
+            pooled = driver_pool.lease(job_id, SCREENER_DRIVER_PROFILE)
+            for screener in screeners:
+                jobs[job_id]['status'] = 'scraping_urls'
+                jobs[job_id]['current_company'] = screener['title']
+                record_stage(job_id, 'rate_limit_wait', chartink_limiter.acquire())
+                scrape_started = time.time()
+                pooled.driver.get(screener['url'])
+                page_timings = []
+                urls = get_url_and_index(pooled.driver, page_timings=page_timings)
+                screener_urls.append(urls)
+                pooled.pages += 1
+                # An empty screener is legitimate, so only the first page's load time feeds the limiter
+                chartink_limiter.record('screener', page_timings[0] if page_timings else time.time() - scrape_started)
+                record_stage(job_id, 'screener_scrape', time.time() - scrape_started)
+                for seconds in page_timings:
+                    record_stage(job_id, 'screener_page', seconds)
+        except Exception as e:
+            broken = True
+            jobs[job_id]['status'] = 'failed'
+            jobs[job_id]['error'] = f"URL Scraping Failed: {str(e)}"
+            return
+        finally:
+            if pooled: driver_pool.release(pooled, broken=broken)
+
+        if not any(screener_urls):
+            jobs[job_id]['status'] = 'failed'
+            jobs[job_id]['error'] = 'No stocks found.'
+            return
+        checkpoint.save_urls(screener_urls)
+
+    # Diff-mode presets only fetch symbols that entered since their last completed run. The
+    # comparison is made once per job: checkpointed charts are numbered by the tasks planned from
+    # it, so a resume must not re-plan against a baseline another run has moved since.
+    diffs = checkpoint.load_diffs()
+    if diffs is None or len(diffs) != len(screeners):
+        diffs = screener_diffs(screeners, screener_urls)
+        checkpoint.save_diffs(diffs)
+    fetch_urls = [diff['urls'] if diff else urls for diff, urls in zip(diffs, screener_urls)]
+    if any(diffs):
+        jobs[job_id]['diff'] = [
+            {'title': screener['title'], 'new': diff['new'], 'dropped': diff['dropped']}
+            for screener, diff in zip(screeners, diffs) if diff
+        ]
+
+    # Overlapping screeners share one fetch per unique chart
+    tasks, sections = plan_chart_tasks(screeners, fetch_urls)
+    jobs[job_id]['total'] = len(tasks)
+    jobs[job_id]['charts_deduped'] = sum(len(urls) for urls in fetch_urls) - len(tasks)
+
+    # With the chart queue, workers on any node fetch the charts; this job comes back for the PDF once they are done
+    done = checkpoint.completed()
+    if CHART_QUEUE_ENABLED and not jobs[job_id].get('canceled'):
+        pending = distribute_chart_tasks(job_id, tasks, done, engine)
+        if pending:
+            # Streamed charts are sent by the PDF stage instead
+            jobs[job_id]['telegram_stream_deferred'] = bool(user_config.get('telegram_stream_targets'))
+            jobs[job_id]['status'] = 'fetching_charts'
+            jobs[job_id]['processed'] = len(tasks) - pending
+            jobs[job_id]['chart_units_pending'] = pending
+            return
+
+    def dropped_page(screener, diff):
+        if diff and diff['dropped']:
+            return [TextPage(f"{screener['title']}: dropped out since the last run", diff['dropped'])]
+        return []
+
+    # Pages are written to the PDF(s) on disk as charts arrive
+    max_bytes = int(PDF_MAX_MB * 1024 * 1024) or None
+    documents = [] # (title, writer, sink)
+    if output == 'per_screener' and len(screeners) > 1:
+        for n, (screener, indices, diff) in enumerate(zip(screeners, sections, diffs), start=1):
+            path = checkpoint.output_path(f"{n:02d}_{_file_slug(screener['title'])}.pdf")
+            writer = PdfStreamWriter(path, max_bytes)
+            layout = dropped_page(screener, diff) + indices
+            documents.append((screener['title'], writer, OrderedPageSink(writer, layout, job_id)))
+    else:
+        layout = []
+        for screener, indices, diff in zip(screeners, sections, diffs):
+            if len(screeners) > 1:
+                layout.append(screener['title'] + (' - new since last run' if diff else ''))
+            layout.extend(dropped_page(screener, diff))
+            layout.extend(indices)
+        writer = PdfStreamWriter(checkpoint.pdf_path, max_bytes)
+        documents.append((None, writer, OrderedPageSink(writer, layout, job_id)))
+    # Charts pass through the profile's re-encoding on their way to the PDF(s)
+    encoder = PageEncoder(parse_pdf_profile(pdf_profile), [sink for _, _, sink in documents], checkpoint, job_id)
+
+    # Replay charts fetched before a crash or stop (or by the chart queue), then fetch only the rest
+    for index, company_name in done.items():
+        encoder.put(index, (company_name, checkpoint.chart_path(index)))
+    jobs[job_id]['processed'] = len(done)
+
+    stream_targets = user_config.get('telegram_stream_targets') or []
+    streamer = TelegramStreamSink(stream_targets, job_id) if stream_targets else None
+    jobs[job_id]['telegram_streamer'] = streamer # Its albums are tracked with the PDF by deliver_job_result
+    if CHART_QUEUE_ENABLED:
+        # Every chart unit is finished (or the job was stopped); only the PDF stage is left. Chart
+        # workers do not stream, so the albums go out now, ahead of the PDF
+        if streamer:
+            jobs[job_id]['telegram_stream_deferred'] = True
+            for index, company_name in sorted(done.items()):
+                streamer.put(index, (company_name, checkpoint.chart_path(index)))
+        failures = chart_unit_failures(job_id)
+        jobs[job_id]['processed'] += len(failures.failed)
+        with _stage_lock:
+            merge_step_timings(jobs[job_id].setdefault('step_timings', {}), chart_unit_timings(job_id))
+    else:
+        # Charts replayed from a checkpoint were already streamed by the earlier run
+        chart_sinks = [encoder]
+        if streamer:
+            chart_sinks.append(streamer)
+        jobs[job_id]['status'] = 'fetching_charts'
+        failures = fetch_charts_locally(job_id, tasks, done, checkpoint, chart_sinks, engine)
+    jobs[job_id]['failed_symbols'] = failures.report()
+
+    # Completion Handling
+    if streamer:
+        streamer.flush() # Before the chart files are cleared and ahead of the PDF in each chat
+    jobs[job_id]['status'] = 'generating_pdf'
     try:
-        driver = web_driver()
-        driver.get(screener_url)
-        jobs[job_id]['status'] = 'scraping_urls'
-        urls = get_url_and_index(driver)
-        jobs[job_id]['total'] = len(urls)
+        pdf_started = time.time()
+        encoder.wait()
+        outputs = [] # (title, path) of every PDF part
+        for n, (title, writer, sink) in enumerate(documents):
+            sink.flush()
+            failed = failures.report(set(sections[n]) if title is not None else None)
+            if sink.charts and failed:
+                page = failed_symbols_page(failed)
+                writer.add_text_page(page.title, page.lines)
+            if sink.charts: # Screeners with no charts get no file
+                writer.close()
+                for part, path in enumerate(writer.paths, start=1):
+                    part_title = f"{title or 'Scan'} part {part}" if len(writer.paths) > 1 else title
+                    outputs.append((part_title, path))
+        canceled = jobs[job_id].get('canceled')
+        if not outputs and not (any(diffs) and not tasks and not canceled):
+            jobs[job_id]['status'] = 'failed'
+            jobs[job_id]['error'] = 'Job stopped or no data collected.' if canceled else 'No charts fetched.'
+            return
+        if not outputs:
+            result_path = None # Diff run with no new symbols: the summary message is the result
+        elif len(outputs) > 1:
+            result_path = checkpoint.output_path('charts.zip')
+            with zipfile.ZipFile(result_path, 'w', zipfile.ZIP_STORED) as bundle: # PDFs are already compressed
+                for _, path in outputs:
+                    bundle.write(path, os.path.basename(path))
+        else:
+            result_path = outputs[0][1]
+        record_stage(job_id, 'pdf_generation', time.time() - pdf_started)
+        jobs[job_id]['result_path'] = result_path
+        jobs[job_id]['status'] = 'completed' if not jobs[job_id].get('canceled') else 'stopped' # allow download even if stopped
+        if jobs[job_id]['status'] == 'completed':
+            checkpoint.clear_charts() # Only failed/stopped jobs can be resumed
+            if CHART_QUEUE_ENABLED:
+                clear_chart_units(job_id)
+            if any(diffs):
+                save_diff_baselines(diffs)
+
+        # Kept with the job so every subscriber, including late ones, gets the same files
+        jobs[job_id]['outputs'] = outputs
+        jobs[job_id]['telegram_summary'] = diff_summary_text(screeners, diffs) if any(diffs) else None
+
     except Exception as e:
         jobs[job_id]['status'] = 'failed'
-        jobs[job_id]['error'] = f"URL Scraping Failed: {str(e)}"
-        if driver: driver.quit()
+        jobs[job_id]['error'] = f"PDF Gen Error: {str(e)}"
+
+# --- Job Queue ---
+
+JOB_SYNC_INTERVAL = float(os.environ.get('JOB_SYNC_INTERVAL', 1))
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 2))
+JOB_STALE_SECONDS = int(os.environ.get('JOB_STALE_SECONDS', 120))
+JOB_WORKER_CONCURRENCY = int(os.environ.get('JOB_WORKER_CONCURRENCY', 2))
+EMBEDDED_WORKER = os.environ.get('EMBEDDED_WORKER', 'true').lower() == 'true'
+
+TERMINAL_STATUSES = ('completed', 'stopped', 'failed')
+LIVE_FIELDS = ('status', 'processed', 'total', 'current_company', 'error', 'result_path', 'telegram_sent')
+STATS_FIELDS = ('cache_hits', 'cache_misses', 'charts_deduped', 'diff', 'failed_symbols', 'outputs', 'telegram_summary',
+                'telegram_stream_deferred', 'step_timings')
+
+def job_status_payload(job):
+    """The JSON shape returned by /status and pushed by /status/<job_id>/stream."""
+    stats = json.loads(job.stats) if job.stats else {}
+    return {
+        'status': job.status,
+        'processed': job.processed or 0,
+        'total': job.total or 0,
+        'current_company': job.current_company or '',
+        'error': job.error,
+        'telegram_sent': job.telegram_sent,
+        'telegram_stream_deferred': bool(stats.get('telegram_stream_deferred')),
+        'telegram_streamed': stats.get('telegram_streamed', 0),
+        'telegram_failed': stats.get('telegram_failed', 0),
+        'cache_hits': stats.get('cache_hits', 0),
+        'cache_misses': stats.get('cache_misses', 0),
+        'charts_deduped': stats.get('charts_deduped', 0),
+        'diff': stats.get('diff'),
+        'failed_symbols': stats.get('failed_symbols') or [],
+        'queue_position': queue_position(job) if job.status == 'queued' else None,
+        'download_ready': bool(job.result_path),
+        'expired': bool(job.expired_at),
+        'step_timings': {
+            step: {
+                'count': t['count'],
+                'avg_ms': round(t['total'] / t['count'] * 1000),
+                'total_ms': round(t['total'] * 1000),
+                'max_ms': round(t.get('max', 0) * 1000)
+            }
+            for step, t in stats.get('step_timings', {}).items()
+        }
+    }
+
+def job_screeners(params):
+    """The screeners of a job. Jobs queued before batching carry a single url/period/range."""
+    if params.get('screeners'):
+        return params['screeners']
+    return [{
+        'title': screener_title(params['url']),
+        'url': params['url'],
+        'period': params.get('period'),
+        'range': params.get('range'),
+        'moving_averages': params.get('moving_averages')
+    }]
+
+def preset_screener(preset):
+    moving_averages = None
+    if preset.ma_config:
+        try:
+            moving_averages = json.loads(preset.ma_config)
+        except ValueError:
+            pass
+    screener = {
+        'title': preset.title,
+        'url': preset.url,
+        'period': preset.period,
+        'range': preset.range_val,
+        'moving_averages': moving_averages
+    }
+    if preset.diff_mode:
+        screener['diff_mode'] = preset.diff_mode
+        screener['diff_preset_id'] = preset.id
+    return screener
+
+def screener_fingerprint(screener):
+    """Hash of what a screener run produces: its URL and chart settings."""
+    d_val, ti_val = chart_interval_duration(screener.get('period'), screener.get('range'))
+    _, ma_form_data = build_chart_form_data(screener.get('period'), screener.get('range'), screener.get('moving_averages'))
+    # A diff run depends on its own preset's baseline, so it is never shared with another preset
+    raw = json.dumps([screener['url'].strip(), d_val, ti_val, ma_form_data, screener.get('diff_preset_id')], sort_keys=True)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+def job_fingerprint(params):
+    """Hash of what a job produces (screeners, output layout, PDF profile), for sharing identical runs."""
+    screeners = job_screeners(params)
+    output = params.get('output', 'combined') if len(screeners) > 1 else 'combined'
+    # Titles name the sections and per-screener files of multi-screener jobs; a single screener's is not shown
+    titles = [screener.get('title') for screener in screeners] if len(screeners) > 1 else None
+    raw = json.dumps([[screener_fingerprint(screener) for screener in screeners], output,
+                      params.get('pdf_profile') or PDF_PROFILE, titles])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+def enqueue_job(user_id, params, fingerprint=None, subscribers=None, telegram_stream=None, priority=0):
+    """Persist a new queued job with its subscribers (``user_id`` plus ``subscribers``) and return its id."""
+    job_id = str(uuid.uuid4())
+    db.session.add(ScanJob(id=job_id, user_id=user_id, status='queued', params=json.dumps(params),
+                           fingerprint=fingerprint, priority=priority))
+    for subscriber_id in dict.fromkeys([user_id] + (subscribers or [])):
+        if subscriber_id is not None:
+            db.session.add(JobSubscriber(job_id=job_id, user_id=subscriber_id,
+                                         telegram_stream=telegram_stream if subscriber_id == user_id else None))
+    db.session.commit()
+    return job_id
+
+# --- Single-Flight Jobs ---
+# Identical requests (same screeners, chart settings, output and PDF profile)
+# attach to a job that is still queued or running, or that completed within
+# JOB_SHARE_WINDOW_SECONDS, instead of scraping the same pages again. Each
+# subscriber still gets the result in their own Telegram chat.
+JOB_COALESCING = os.environ.get('JOB_COALESCING', 'true').lower() == 'true'
+JOB_SHARE_WINDOW_SECONDS = int(os.environ.get('JOB_SHARE_WINDOW_SECONDS', 300))
+_submit_lock = threading.Lock()
+
+def find_shared_job(fingerprint, include_finished=True):
+    """An identical job that is still in flight or finished within the share window, or None."""
+    identical = ScanJob.query.filter_by(fingerprint=fingerprint, canceled=False)
+    live = identical.filter(ScanJob.status.notin_(TERMINAL_STATUSES)).order_by(ScanJob.created_at.desc()).first()
+    if live or not (include_finished and JOB_SHARE_WINDOW_SECONDS):
+        return live
+    return (identical.filter(ScanJob.status == 'completed', ScanJob.result_path.isnot(None), ScanJob.expired_at.is_(None),
+                             ScanJob.finished_at >= datetime.utcnow() - timedelta(seconds=JOB_SHARE_WINDOW_SECONDS))
+            .order_by(ScanJob.finished_at.desc()).first())
+
+def submit_job(user_id, params, subscribers=None, telegram_stream=None, priority=0):
+    """Enqueue a job, or subscribe to an identical one; returns ``(job_id, shared)``.
+
+    ``subscribers`` are further users who get the result (coalesced scheduled runs).
+    ``telegram_stream`` overrides ``user_id``'s streaming setting for this request.
+    A queued shared job is raised to ``priority`` if that is higher.
+    """
+    fingerprint = job_fingerprint(params)
+    # A finished diff run has already moved its preset's baseline, so only an in-flight one is shared
+    include_finished = not any(screener.get('diff_mode') for screener in job_screeners(params))
+    with _submit_lock: # Two identical requests in this process must not both miss
+        shared = find_shared_job(fingerprint, include_finished) if JOB_COALESCING else None
+        if not shared:
+            return enqueue_job(user_id, params, fingerprint, subscribers, telegram_stream, priority), False
+        ScanJob.query.filter(ScanJob.id == shared.id, ScanJob.status == 'queued',
+                           db.func.coalesce(ScanJob.priority, 0) < priority) \
+            .update({'priority': priority}, synchronize_session=False)
+        for subscriber_id in dict.fromkeys([user_id] + (subscribers or [])):
+            if not JobSubscriber.query.filter_by(job_id=shared.id, user_id=subscriber_id).first():
+                db.session.add(JobSubscriber(job_id=shared.id, user_id=subscriber_id,
+                                             telegram_stream=telegram_stream if subscriber_id == user_id else None))
+        db.session.commit()
+    # Re-read after subscribing: if the job finished meanwhile, its own delivery may have missed us
+    if db.session.get(ScanJob, shared.id).status in TERMINAL_STATUSES:
+        deliver_job_result(shared.id)
+    return shared.id, True
+
+def deliver_job_result(job_id, streamer=None):
+    """Queue a finished job's PDFs (and diff summary) for every subscriber not yet served.
+
+    Safe to call repeatedly and from several processes: each subscriber is
+    claimed (delivery_claimed_at, a lease of TELEGRAM_DELIVERY_LEASE_SECONDS)
+    before anything is sent, and delivered_at is only set once all of their
+    sends succeeded. Deliveries that failed or were cut short by a restart are
+    sent again by retry_pending_deliveries. ``streamer``, the job's
+    TelegramStreamSink, is tracked with the PDFs, also when the job failed or
+    has nothing to send.
+    """
+    with app.app_context():
+        row = db.session.get(ScanJob, job_id)
+        stats = json.loads(row.stats) if row and row.stats else {}
+        outputs = stats.get('outputs') or []
+        summary = stats.get('telegram_summary')
+        now = datetime.utcnow()
+        if row is not None and row.status in ('completed', 'stopped') and not (outputs or summary):
+            JobSubscriber.query.filter_by(job_id=job_id, delivered_at=None).update({'delivered_at': now}) # Nothing to send
+            db.session.commit()
+        if row is None or row.status not in ('completed', 'stopped') or row.expired_at or not (outputs or summary):
+            db.session.remove()
+            if streamer and streamer.futures:
+                track_telegram_delivery(job_id, [], streamer)
+            return
+        stamp = (row.finished_at or now).strftime('%Y%m%d_%H%M')
+        targets = {}
+        for subscriber in pending_deliveries(now).filter(JobSubscriber.job_id == job_id).all():
+            claimed = (pending_deliveries(now).filter(JobSubscriber.id == subscriber.id)
+                       .update({'delivery_claimed_at': now,
+                                'delivery_attempts': db.func.coalesce(JobSubscriber.delivery_attempts, 0) + 1},
+                               synchronize_session=False))
+            db.session.commit()
+            if not claimed:
+                continue
+            user = db.session.get(User, subscriber.user_id)
+            if user and user.telegram_bot_token and user.telegram_chat_id:
+                targets.setdefault((user.telegram_bot_token, user.telegram_chat_id), []).append(subscriber.id)
+            else: # No Telegram to send to
+                JobSubscriber.query.filter_by(id=subscriber.id).update({'delivered_at': now})
+                db.session.commit()
+        db.session.remove()
+
+    # Queued on the delivery thread; the caller (and its worker slot) does not wait
+    deliveries = []
+    for (token, chat_id), subscriber_ids in targets.items():
+        sends = []
+        if summary:
+            sends.append(telegram_delivery.send_message(token, chat_id, summary, job_id))
+        for title, path in outputs:
+            fname = f"Chartink_{_file_slug(title)}_{stamp}.pdf" if title else f"Chartink_Scan_{stamp}.pdf"
+            sends.append(telegram_delivery.send_document(
+                token, chat_id, path, fname, caption="Here is your Chartink Scan PDF.", job_id=job_id))
+        mark_delivered_when_sent(job_id, subscriber_ids, sends)
+        deliveries.extend(sends)
+    if deliveries or (streamer and streamer.futures):
+        track_telegram_delivery(job_id, deliveries, streamer)
+
+def pending_deliveries(now):
+    """Query for subscribers still owed a result: not delivered, not claimed by a live sender, attempts left."""
+    lease_cutoff = now - timedelta(seconds=TELEGRAM_DELIVERY_LEASE_SECONDS)
+    return JobSubscriber.query.filter(
+        JobSubscriber.delivered_at.is_(None),
+        db.func.coalesce(JobSubscriber.delivery_attempts, 0) < TELEGRAM_DELIVERY_ATTEMPTS,
+        db.or_(JobSubscriber.delivery_claimed_at.is_(None), JobSubscriber.delivery_claimed_at < lease_cutoff))
+
+def _may_have_arrived(error):
+    """True for an upload that failed after its bytes went out (see TelegramDelivery), so it is not resent."""
+    return (isinstance(error, NetworkError) and not isinstance(error, BadRequest)
+            and not isinstance(error.__cause__, _UNSENT_ERRORS))
+
+def mark_delivered_when_sent(job_id, subscriber_ids, futures):
+    """Set delivered_at for ``subscriber_ids`` once all of ``futures`` (their sends) succeeded.
+
+    If a send failed, the claim is released so retry_pending_deliveries sends
+    the result again; unless an upload may still have reached the chat, in
+    which case it is left undelivered rather than risk a duplicate PDF.
+    """
+    remaining = [len(futures)]
+    errors = []
+    lock = threading.Lock()
+
+    def done(future):
+        with lock:
+            remaining[0] -= 1
+            if future.exception() is not None:
+                errors.append(future.exception())
+            finished = remaining[0] == 0
+        if not finished:
+            return
+        if not errors:
+            values = {'delivered_at': datetime.utcnow()}
+        elif any(_may_have_arrived(error) for error in errors):
+            print(f"Telegram delivery of job {job_id} may have partly arrived, not resending: {errors[0]}")
+            values = {'delivery_claimed_at': None, 'delivery_attempts': TELEGRAM_DELIVERY_ATTEMPTS}
+        else:
+            values = {'delivery_claimed_at': None}
+        with app.app_context():
+            JobSubscriber.query.filter(JobSubscriber.id.in_(subscriber_ids)).update(values, synchronize_session=False)
+            db.session.commit()
+            db.session.remove()
+
+    for future in futures:
+        future.add_done_callback(done)
+
+def retry_pending_deliveries():
+    """Send results whose Telegram delivery failed, or was lost with the worker that queued it."""
+    with app.app_context():
+        now = datetime.utcnow()
+        job_ids = [job_id for (job_id,) in pending_deliveries(now)
+                   .join(ScanJob, ScanJob.id == JobSubscriber.job_id)
+                   .filter(ScanJob.status.in_(('completed', 'stopped')), ScanJob.expired_at.is_(None),
+                           # Freshly finished jobs are still being delivered by their own worker
+                           ScanJob.finished_at.between(now - timedelta(hours=TELEGRAM_DELIVERY_MAX_AGE_HOURS),
+                                                       now - timedelta(seconds=JOB_STALE_SECONDS)))
+                   .with_entities(JobSubscriber.job_id).distinct()]
+        db.session.remove()
+    for job_id in job_ids:
+        print(f"Retrying Telegram delivery of job {job_id}")
+        deliver_job_result(job_id)
+
+def save_job_state(job_id, final=False, state=None):
+    """Copy live progress from ``jobs`` (or ``state``) to the ScanJob row and pick up cancellation."""
+    state = state if state is not None else jobs.get(job_id)
+    if state is None:
         return
-    finally:
-        if driver: driver.quit()
+    with app.app_context():
+        row = db.session.get(ScanJob, job_id)
+        if row is None:
+            return
+        for field in LIVE_FIELDS:
+            if field in state:
+                setattr(row, field, state[field])
+        with _stage_lock:
+            row.stats = json.dumps({field: state[field] for field in STATS_FIELDS if field in state})
+        row.heartbeat_at = datetime.utcnow()
+        if final:
+            row.finished_at = datetime.utcnow()
+        if row.canceled:
+            state['canceled'] = True
+        db.session.commit()
 
-    if not urls:
+def _sync_job_state(job_id, stop_event):
+    while not stop_event.wait(JOB_SYNC_INTERVAL):
+        try:
+            save_job_state(job_id)
+        except Exception as e:
+            print(f"Job state sync failed for {job_id}: {e}")
+
+def run_job(job_id):
+    """Run a claimed job to completion, keeping its ScanJob row up to date."""
+    with app.app_context():
+        row = db.session.get(ScanJob, job_id)
+        params = json.loads(row.params)
+        subscribers = JobSubscriber.query.filter_by(job_id=job_id).all()
+        if not subscribers: # Queued before subscribers were stored per job
+            for subscriber_id in params.get('subscribers') or ([row.user_id] if row.user_id else []):
+                db.session.add(JobSubscriber(job_id=job_id, user_id=subscriber_id,
+                                             telegram_stream=params.get('telegram_stream') if subscriber_id == row.user_id else None))
+            db.session.commit()
+            subscribers = JobSubscriber.query.filter_by(job_id=job_id).all()
+        # Charts are streamed to those subscribed at the start; everyone gets the PDF at the end
+        stream_targets = []
+        for subscriber in subscribers:
+            user = db.session.get(User, subscriber.user_id)
+            if not (user and user.telegram_bot_token and user.telegram_chat_id):
+                continue
+            stream = subscriber.telegram_stream
+            if stream is None:
+                stream = user.telegram_stream
+            if stream:
+                target = (user.telegram_bot_token, user.telegram_chat_id)
+                if target not in stream_targets:
+                    stream_targets.append(target)
+        user_config = {'telegram_stream_targets': stream_targets}
+        canceled = bool(row.canceled) # A stopped chart-queue job is claimed only to write what was fetched
+        # The chart queue's PDF stage carries on the timings of the run that scraped the screeners
+        step_timings = (json.loads(row.stats).get('step_timings') or {}) if row.status == 'generating_pdf' and row.stats else {}
+
+    jobs[job_id] = {
+        'canceled': canceled,
+        'status': 'running',
+        'processed': 0,
+        'total': 0,
+        'current_company': '',
+        'telegram_sent': False,
+        'cache_hits': 0,
+        'cache_misses': 0,
+        'charts_deduped': 0,
+        'step_timings': step_timings
+    }
+    stop_event = threading.Event()
+    syncer = threading.Thread(target=_sync_job_state, args=(job_id, stop_event), daemon=True)
+    syncer.start()
+    try:
+        process_job(job_id, job_screeners(params), user_config, params.get('engine', 'selenium'),
+                    params.get('output', 'combined'), params.get('pdf_profile'))
+    except Exception as e:
+        print(f"Job {job_id} crashed: {e}")
         jobs[job_id]['status'] = 'failed'
-        jobs[job_id]['error'] = 'No stocks found.'
+        jobs[job_id]['error'] = f"Job Error: {str(e)}"
+    finally:
+        stop_event.set()
+        syncer.join()
+        # Taken out of ``jobs`` before the final save: a Telegram timing recorded from here on is
+        # kept for track_telegram_delivery instead of landing in state that is no longer saved
+        with _stage_lock:
+            state = jobs.pop(job_id)
+        handed_off = bool(state.get('chart_units_pending'))
+        if state['status'] not in TERMINAL_STATUSES and not handed_off:
+            state['status'] = 'failed'
+        save_job_state(job_id, final=not handed_off, state=state)
+    if handed_off:
+        release_to_chart_queue(job_id)
         return
+    # After the final state is committed, so a subscriber attaching now is either seen here or delivers itself
+    deliver_job_result(job_id, state.get('telegram_streamer'))
+
+# --- Fair-Share Admission ---
+# Workers claim jobs across all processes by priority (scheduled runs before
+# ad-hoc ones), then favouring users with fewer jobs running, then oldest
+# first. A user runs at most JOB_MAX_RUNNING_PER_USER jobs at once, and the
+# browsers that running jobs use (counted across all workers) stay within
+# JOB_BROWSER_BUDGET, which also paces the scheduler.
+JOB_PRIORITY_SCHEDULED = int(os.environ.get('JOB_PRIORITY_SCHEDULED', 10))
+JOB_PRIORITY_ADHOC = int(os.environ.get('JOB_PRIORITY_ADHOC', 0))
+JOB_MAX_RUNNING_PER_USER = int(os.environ.get('JOB_MAX_RUNNING_PER_USER', 2))
+JOB_BROWSER_BUDGET = int(os.environ.get('JOB_BROWSER_BUDGET') or os.environ.get('SCHEDULER_BROWSER_BUDGET') or MAX_BROWSERS)
+JOB_CLAIM_CANDIDATES = 50
+
+def job_browsers(params):
+    """Browsers a job keeps busy: its chart workers, or one for the HTTP engine's Selenium fallback."""
+    return 1 if params.get('engine') == 'http' else CHART_WORKERS_PER_JOB
+
+def user_running_jobs(user_id):
+    """A subquery counting ``user_id``'s claimed, unfinished jobs.
+
+    The count goes through a derived table: MySQL rejects an UPDATE whose
+    subquery reads the table being updated (error 1093), but materializes a
+    derived table first, so the claiming UPDATE may filter on it.
+    """
+    running = db.aliased(ScanJob)
+    counted = (db.select(db.func.count().label('running')).select_from(running)
+               .where(running.user_id == user_id, running.status.notin_(('queued',) + TERMINAL_STATUSES))
+               .subquery('user_running'))
+    return db.select(counted.c.running).scalar_subquery()
+
+def queue_position(job):
+    """1-based place of a queued job in the claim order (ignoring per-user limits), or None."""
+    ahead = (ScanJob.query.filter_by(status='queued', canceled=False)
+             .filter(db.or_(ScanJob.priority > (job.priority or 0),
+                            db.and_(db.func.coalesce(ScanJob.priority, 0) == (job.priority or 0),
+                                    ScanJob.created_at < job.created_at)))
+             .count())
+    return ahead + 1
+
+def claim_next_job(worker_id):
+    """Atomically move the next admissible queued job to 'running' for this worker."""
+    with app.app_context():
+        running = (ScanJob.query.filter(ScanJob.status.notin_(('queued',) + TERMINAL_STATUSES))
+                   .with_entities(ScanJob.user_id, ScanJob.params).all())
+        per_user = Counter(user_id for user_id, _ in running)
+        browsers_in_use = sum(job_browsers(json.loads(params)) for _, params in running)
+
+        candidates = (ScanJob.query.filter_by(status='queued', canceled=False)
+                      .order_by(db.func.coalesce(ScanJob.priority, 0).desc(), ScanJob.created_at)
+                      .limit(JOB_CLAIM_CANDIDATES).all())
+        admissible = []
+        for candidate in candidates:
+            if candidate.user_id is not None and per_user[candidate.user_id] >= JOB_MAX_RUNNING_PER_USER:
+                continue
+            needed = job_browsers(json.loads(candidate.params))
+            if browsers_in_use and browsers_in_use + needed > JOB_BROWSER_BUDGET:
+                continue # An idle system still admits a job larger than the budget
+            admissible.append(candidate)
+        admissible.sort(key=lambda job: (-(job.priority or 0), per_user[job.user_id], job.created_at))
+
+        for candidate in admissible:
+            now = datetime.utcnow()
+            query = ScanJob.query.filter_by(id=candidate.id, status='queued')
+            if candidate.user_id is not None:
+                # The per-user limit is checked in the claiming UPDATE itself, not from the counts read above
+                query = query.filter(user_running_jobs(candidate.user_id) < JOB_MAX_RUNNING_PER_USER)
+            claimed = query.update({'status': 'running', 'worker_id': worker_id, 'started_at': now, 'heartbeat_at': now},
+                                   synchronize_session=False)
+            db.session.commit()
+            if not claimed:
+                continue
+            if candidate.user_id is not None and (db.session.query(user_running_jobs(candidate.user_id)).scalar()
+                                                  > JOB_MAX_RUNNING_PER_USER):
+                # Another worker's claim committed alongside ours (snapshot isolation): hand it back
+                ScanJob.query.filter_by(id=candidate.id, worker_id=worker_id, status='running').update(
+                    {'status': 'queued', 'worker_id': None}, synchronize_session=False)
+                db.session.commit()
+                continue
+            return candidate.id
+    return None
+
+def requeue_stale_jobs():
+    """Put jobs whose worker stopped heartbeating (crash, restart) back on the queue."""
+    with app.app_context():
+        cutoff = datetime.utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+        stale = (ScanJob.query
+                 .filter(ScanJob.status.notin_(('queued',) + TERMINAL_STATUSES))
+                 .filter(ScanJob.heartbeat_at < cutoff)
+                 .filter(db.or_(ScanJob.status != 'fetching_charts', ScanJob.worker_id.isnot(None))) # Waiting on the chart queue
+                 .update({'status': 'queued', 'worker_id': None}, synchronize_session=False))
+        stale_units = (ChartTask.query
+                       .filter(ChartTask.status == 'running',
+                               db.func.coalesce(ChartTask.heartbeat_at, ChartTask.claimed_at) < cutoff)
+                       .update({'status': 'queued', 'worker_id': None}, synchronize_session=False))
+        db.session.commit()
+        if stale:
+            print(f"Requeued {stale} stale job(s)")
+        if stale_units:
+            print(f"Requeued {stale_units} stale chart unit(s)")
+
+def run_worker(concurrency=None, stop_event=None, chart_workers=None):
+    """Claim and run queued jobs, at most ``concurrency`` at a time, until stopped.
+
+    With CHART_QUEUE_ENABLED this also runs ``chart_workers`` chart unit
+    workers (CHART_QUEUE_WORKERS by default) and the PDF stage of jobs whose
+    charts are all fetched.
+    """
+    concurrency = concurrency or JOB_WORKER_CONCURRENCY
+    stop_event = stop_event or threading.Event()
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+    running = []
+    last_stale_check = 0
+    last_retention_run = 0
+    print(f"Job worker {worker_id} started (concurrency={concurrency})")
+    start_upstream_sync(stop_event)
+    if SCHEDULER_ENABLED:
+        threading.Thread(target=run_scheduler, args=(stop_event,), daemon=True).start()
+    if CHART_QUEUE_ENABLED:
+        run_chart_workers(CHART_QUEUE_WORKERS if chart_workers is None else chart_workers, stop_event)
+
+    while not stop_event.is_set():
+        running = [t for t in running if t.is_alive()]
+        try:
+            if time.time() - last_stale_check > JOB_STALE_SECONDS / 2:
+                requeue_stale_jobs()
+                retry_pending_deliveries()
+                last_stale_check = time.time()
+            if time.time() - last_retention_run > JOB_RETENTION_INTERVAL:
+                enforce_job_retention()
+                last_retention_run = time.time()
+
+            job_id = None
+            if len(running) < concurrency:
+                # Jobs that only need their PDF go first; their charts are already paid for
+                job_id = (CHART_QUEUE_ENABLED and claim_chart_stage_job(worker_id)) or claim_next_job(worker_id)
+        except Exception as e:
+            print(f"Job worker {worker_id} poll failed: {e}")
+            job_id = None
+
+        if job_id:
+            thread = threading.Thread(target=run_job, args=(job_id,), daemon=True)
+            thread.start()
+            running.append(thread)
+        else:
+            stop_event.wait(JOB_POLL_INTERVAL)
+
+# --- Distributed Chart Queue ---
+# With CHART_QUEUE_ENABLED a job's charts become ChartTask rows that chart
+# workers in any process, on any node, claim one at a time. Chart PNGs go to
+# the job's checkpoint under JOB_OUTPUT_DIR, which must then be storage all
+# nodes share. Once no unit is left to fetch, a job worker claims the job
+# again and process_job builds the PDF from the checkpoint. Scale out by
+# running more `worker.py --role charts` processes.
+CHART_QUEUE_ENABLED = os.environ.get('CHART_QUEUE_ENABLED', 'false').lower() == 'true'
+CHART_QUEUE_WORKERS = int(os.environ.get('CHART_QUEUE_WORKERS', CHART_WORKERS_PER_JOB))
+CHART_UNIT_MAX_CLAIMS = SYMBOL_MAX_ATTEMPTS + 5 # Claims lost to browser failures before a unit gives up
+OPEN_UNIT_STATUSES = ('queued', 'running')
+
+# A claimed chart unit, detached from the session
+ChartUnit = namedtuple('ChartUnit', 'id job_id index task attempts claims')
+
+# Units this process is fetching. A fetch can outlast JOB_STALE_SECONDS (symbol
+# timeouts, rate-limiter waits, breaker pauses), so chart_unit_heartbeat keeps
+# their heartbeat_at fresh and requeue_stale_jobs only takes back units whose
+# process stopped.
+_fetching_units = set()
+_fetching_units_lock = threading.Lock()
+
+def distribute_chart_tasks(job_id, tasks, done, engine='selenium'):
+    """Create the job's chart units (once; ``done`` ones already finished) and return how many are still open."""
+    with app.app_context():
+        if not ChartTask.query.filter_by(job_id=job_id).count():
+            for index, task in enumerate(tasks):
+                db.session.add(ChartTask(job_id=job_id, task_index=index, params=json.dumps(dict(task, engine=engine)),
+                                         status='done' if index in done else 'queued', company_name=done.get(index)))
+            db.session.commit()
+        pending = ChartTask.query.filter(ChartTask.job_id == job_id, ChartTask.status.in_(OPEN_UNIT_STATUSES)).count()
+        db.session.remove()
+    return pending
+
+def release_to_chart_queue(job_id):
+    """Leave a job waiting on its chart units; claim_chart_stage_job picks it up when they are done."""
+    with app.app_context():
+        ScanJob.query.filter_by(id=job_id, status='fetching_charts').update({'worker_id': None})
+        db.session.commit()
+        db.session.remove()
+
+def chart_unit_failures(job_id):
+    """A SymbolFailures holding the job's units that failed for good."""
+    failures = SymbolFailures()
+    with app.app_context():
+        for unit in ChartTask.query.filter_by(job_id=job_id, status='failed'):
+            task = json.loads(unit.params)
+            failures.attempts[unit.task_index] = unit.attempts
+            failures.failed[unit.task_index] = {'symbol': symbol_from_url(task['url']), 'url': task['url'],
+                                                'reason': unit.error or 'No chart returned', 'attempts': unit.attempts}
+        db.session.remove()
+    return failures
+
+def chart_unit_timings(job_id):
+    """The step timings recorded by chart workers for the job's units, summed."""
+    timings = {}
+    with app.app_context():
+        for unit_timings, in ChartTask.query.with_entities(ChartTask.timings).filter_by(job_id=job_id):
+            if unit_timings:
+                merge_step_timings(timings, json.loads(unit_timings))
+        db.session.remove()
+    return timings
+
+def clear_chart_units(job_id):
+    with app.app_context():
+        ChartTask.query.filter_by(job_id=job_id).delete()
+        db.session.commit()
+        db.session.remove()
+
+def claim_chart_unit(worker_id):
+    """Atomically claim the next queued chart unit: higher job priority, then first attempts, then oldest job."""
+    with app.app_context():
+        candidates = (db.session.query(ChartTask.id)
+                      .join(ScanJob, ScanJob.id == ChartTask.job_id)
+                      .filter(ChartTask.status == 'queued', ScanJob.canceled.isnot(True))
+                      .order_by(db.func.coalesce(ScanJob.priority, 0).desc(), ChartTask.attempts,
+                                ScanJob.created_at, ChartTask.task_index)
+                      .limit(5).all())
+        for unit_id, in candidates:
+            claimed = (ChartTask.query.filter_by(id=unit_id, status='queued')
+                       .update({'status': 'running', 'worker_id': worker_id, 'claimed_at': datetime.utcnow(),
+                                'heartbeat_at': datetime.utcnow(), 'claims': db.func.coalesce(ChartTask.claims, 0) + 1}, synchronize_session=False))
+            db.session.commit()
+            if claimed:
+                unit = db.session.get(ChartTask, unit_id)
+                claimed_unit = ChartUnit(unit.id, unit.job_id, unit.task_index, json.loads(unit.params),
+                                         unit.attempts or 0, unit.claims)
+                db.session.remove()
+                return claimed_unit
+        db.session.remove()
+    return None
+
+def finish_chart_unit(unit, timings=None, **values):
+    """Store a unit's outcome, the step ``timings`` of this fetch and the job's progress (finished units) on its row."""
+    with app.app_context():
+        if timings:
+            row = db.session.get(ChartTask, unit.id)
+            values['timings'] = json.dumps(merge_step_timings(json.loads(row.timings) if row and row.timings else {},
+                                                              timings))
+        ChartTask.query.filter_by(id=unit.id, status='running').update(values, synchronize_session=False)
+        finished = (ChartTask.query.filter(ChartTask.job_id == unit.job_id, ChartTask.status.notin_(OPEN_UNIT_STATUSES))
+                    .count())
+        ScanJob.query.filter_by(id=unit.job_id, status='fetching_charts').update(
+            {'processed': finished, 'current_company': values.get('company_name') or unit.task['url'],
+             'heartbeat_at': datetime.utcnow()}, synchronize_session=False)
+        db.session.commit()
+        db.session.remove()
 
-    # Image Processing Loop with Auto-Recovery
-    jobs[job_id]['status'] = 'fetching_charts'
-    current_index = 0
-    max_retries = 5 # Try to recover driver crashes up to 5 times
-    retry_count = 0
-    
-    while current_index < len(urls):
-        if jobs[job_id].get('canceled'):
-            break
-
-        if retry_count >= max_retries:
-            print(f"Max retries reached for job {job_id}")
-            break
+def run_chart_unit(unit):
+    """Fetch one claimed chart unit into the job's checkpoint; returns False if the browser failed."""
+    _unit_stage_timings.job_id, _unit_stage_timings.timings = unit.job_id, {}
+    try:
+        return _run_chart_unit(unit)
+    finally:
+        _unit_stage_timings.job_id = None
 
-        driver = None
+def _run_chart_unit(unit):
+    fetch_started = time.time()
+    timings = _unit_stage_timings.timings
+    errors = []
+    try:
+        company_name, img_data, cached = fetch_chart(unit.job_id, unit.task, unit.task.get('engine', 'selenium'),
+                                                     fresh=unit.attempts > 0, errors=errors)
+    except Exception as e:
+        print(f"Driver crashed/error on chart unit {unit.id} of job {unit.job_id}: {e}")
+        if unit.claims >= CHART_UNIT_MAX_CLAIMS:
+            finish_chart_unit(unit, timings, status='failed', error='No browser available', worker_id=None)
+        else:
+            finish_chart_unit(unit, timings, status='queued', worker_id=None) # Not the symbol's fault: no attempt used
+        return False
+
+    if img_data:
+        JobCheckpoint(unit.job_id).save_chart(unit.index, company_name, img_data)
+        if not cached:
+            record_stage(unit.job_id, 'chart_fetch', time.time() - fetch_started)
+        finish_chart_unit(unit, timings, status='done', company_name=company_name, worker_id=None)
+    else:
+        record_stage(unit.job_id, 'chart_fetch_failed', time.time() - fetch_started)
+        attempts = unit.attempts + 1
+        # Requeued attempts sort after every first attempt, so they run once the rest are fetched
+        finish_chart_unit(unit, timings, status='queued' if attempts < SYMBOL_MAX_ATTEMPTS else 'failed', attempts=attempts,
+                          error=errors[-1] if errors else 'No chart returned', worker_id=None)
+    return True
+
+def chart_unit_worker(worker_id, stop_event):
+    """Claim and fetch chart units until stopped, backing off while browsers keep failing."""
+    crashes = 0
+    while not stop_event.is_set():
         try:
-            driver = web_driver()
-            
-            # Inner loop for processing
-            while current_index < len(urls):
-                if jobs[job_id].get('canceled'):
-                     break
-                
-                url = urls[current_index]
-                jobs[job_id]['current_company'] = url # Update status
-                
-                # Fetch Image
-                company_name, img_data_base64 = get_image_from_link(driver, url, period, s_range, moving_averages)
-                
-                if company_name and img_data_base64:
-                    img_data = base64.b64decode(img_data_base64)
-                    image = PILImage.open(BytesIO(img_data))
-                    processed_data.append({"company_name": company_name, "image": image})
-                    jobs[job_id]['current_company'] = company_name # Better name
-                
-                current_index += 1
-                jobs[job_id]['processed'] = current_index
-        
+            unit = claim_chart_unit(worker_id)
+            if unit is None:
+                stop_event.wait(JOB_POLL_INTERVAL)
+                continue
+            with _fetching_units_lock:
+                _fetching_units.add(unit.id)
+            try:
+                crashes = 0 if run_chart_unit(unit) else crashes + 1
+            finally:
+                with _fetching_units_lock:
+                    _fetching_units.discard(unit.id)
         except Exception as e:
-            print(f"Driver crashed/error at index {current_index}: {e}. Restarting driver...")
-            retry_count += 1
-            # We do NOT increment current_index here, so we retry the current URL
-            time.sleep(3) # Cooldown
-        finally:
-            if driver: 
-                try: 
-                    driver.quit()
-                except: 
-                    pass
-    
-    # Completion Handling
-    if not processed_data:
-        jobs[job_id]['status'] = 'failed'
-        jobs[job_id]['error'] = 'Job stopped or no data collected.' if jobs[job_id].get('canceled') else 'No charts fetched.'
-        return
+            print(f"Chart worker {worker_id} failed: {e}")
+            crashes += 1
+        if crashes:
+            stop_event.wait(random.uniform(0, min(30, 2 ** crashes))) # Jittered, like chart_worker
+
+def chart_unit_heartbeat(stop_event):
+    """Refresh heartbeat_at of the units this process is fetching until stopped."""
+    while not stop_event.wait(JOB_STALE_SECONDS / 4):
+        with _fetching_units_lock:
+            unit_ids = list(_fetching_units)
+        if not unit_ids:
+            continue
+        try:
+            with app.app_context():
+                (ChartTask.query.filter(ChartTask.id.in_(unit_ids), ChartTask.status == 'running')
+                 .update({'heartbeat_at': datetime.utcnow()}, synchronize_session=False))
+                db.session.commit()
+                db.session.remove()
+        except Exception as e:
+            print(f"Chart unit heartbeat failed: {e}")
+
+def run_chart_workers(count, stop_event):
+    """Start ``count`` chart unit worker threads in this process and return them."""
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+    threads = [threading.Thread(target=chart_unit_worker, args=(f"{worker_id}/{n}", stop_event), daemon=True)
+               for n in range(count)]
+    for thread in threads:
+        thread.start()
+    if threads:
+        threading.Thread(target=chart_unit_heartbeat, args=(stop_event,), daemon=True).start()
+        start_upstream_sync(stop_event)
+        print(f"Chart workers {worker_id} started ({count} threads)")
+    return threads
+
+def claim_chart_stage_job(worker_id):
+    """Claim a job whose chart units are all finished (or that was stopped) for its PDF stage."""
+    with app.app_context():
+        open_units = db.session.query(ChartTask.job_id).filter(ChartTask.status.in_(OPEN_UNIT_STATUSES))
+        running_units = db.session.query(ChartTask.job_id).filter(ChartTask.status == 'running')
+        candidates = (db.session.query(ScanJob.id)
+                      .filter(ScanJob.status == 'fetching_charts', ScanJob.worker_id.is_(None))
+                      .filter(db.or_(ScanJob.id.notin_(open_units),
+                                     db.and_(ScanJob.canceled.is_(True), ScanJob.id.notin_(running_units))))
+                      .order_by(db.func.coalesce(ScanJob.priority, 0).desc(), ScanJob.created_at)
+                      .limit(5).all())
+        for job_id, in candidates:
+            claimed = (ScanJob.query.filter_by(id=job_id, status='fetching_charts', worker_id=None)
+                       .update({'status': 'generating_pdf', 'worker_id': worker_id, 'heartbeat_at': datetime.utcnow()},
+                               synchronize_session=False))
+            db.session.commit()
+            if claimed:
+                db.session.remove()
+                return job_id
+        db.session.remove()
+    return None
+
+# --- Job Retention ---
+# Finished jobs keep their PDFs (and failed/stopped jobs their resume
+# checkpoints) under JOB_OUTPUT_DIR. Workers periodically delete them once
+# JOB_RESULT_TTL_HOURS old, or oldest first while the directory is over
+# JOB_OUTPUT_MAX_MB, and drop finished ScanJob rows after JOB_ROW_RETENTION_DAYS.
+JOB_RESULT_TTL_HOURS = float(os.environ.get('JOB_RESULT_TTL_HOURS', 24))
+JOB_OUTPUT_MAX_MB = float(os.environ.get('JOB_OUTPUT_MAX_MB', 2000))
+JOB_ROW_RETENTION_DAYS = float(os.environ.get('JOB_ROW_RETENTION_DAYS', 30))
+JOB_RETENTION_INTERVAL = int(os.environ.get('JOB_RETENTION_INTERVAL', 600))
+
+def directory_size(path):
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass # Removed while walking
+    return total
 
-    jobs[job_id]['status'] = 'generating_pdf'
+def job_output_usage():
+    """Return ``[(job_id, bytes, mtime)]`` for every job directory under JOB_OUTPUT_DIR."""
     try:
-        pdf_bytes = generate_pdf(processed_data)
-        jobs[job_id]['result'] = pdf_bytes
-        jobs[job_id]['status'] = 'completed' if not jobs[job_id].get('canceled') else 'stopped' # allow download even if stopped
-        
-        # --- Telegram Integration ---
-        token = user_config.get('tg_token')
-        chat_id = user_config.get('tg_chat_id')
-        if token and chat_id:
+        names = os.listdir(JOB_OUTPUT_DIR)
+    except OSError:
+        return []
+    usage = []
+    for name in names:
+        path = os.path.join(JOB_OUTPUT_DIR, name)
+        try:
+            if os.path.isdir(path):
+                usage.append((name, directory_size(path), os.path.getmtime(path)))
+        except OSError:
+            pass
+    return usage
+
+def process_memory_bytes():
+    """Resident memory of this process (peak RSS where /proc is unavailable)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def _expire_job_output(job_id, row):
+    shutil.rmtree(os.path.join(JOB_OUTPUT_DIR, job_id), ignore_errors=True)
+    if row is not None:
+        row.result_path = None
+        row.expired_at = datetime.utcnow()
+
+def enforce_job_retention():
+    """Delete expired job output and old job rows; returns (directories removed, rows deleted).
+
+    Queued and running jobs are never touched. Directories without a ScanJob
+    row age by their mtime.
+    """
+    with app.app_context():
+        now = datetime.utcnow()
+        usage = job_output_usage()
+        rows = {}
+        if usage:
+            rows = {row.id: row for row in ScanJob.query.filter(ScanJob.id.in_([job_id for job_id, _, _ in usage]))}
+
+        cutoff = now - timedelta(hours=JOB_RESULT_TTL_HOURS)
+        removed = 0
+        total = 0
+        evictable = [] # (finished_at, job_id, bytes)
+        for job_id, size, mtime in usage:
+            row = rows.get(job_id)
+            if row is not None and row.status not in TERMINAL_STATUSES:
+                total += size
+                continue
+            finished = row.finished_at if row is not None and row.finished_at else \
+                datetime.fromtimestamp(mtime, timezone.utc).replace(tzinfo=None)
+            if finished < cutoff:
+                _expire_job_output(job_id, row)
+                removed += 1
+            else:
+                evictable.append((finished, job_id, size))
+                total += size
+
+        max_bytes = JOB_OUTPUT_MAX_MB * 1024 * 1024
+        if max_bytes and total > max_bytes:
+            for _, job_id, size in sorted(evictable):
+                if total <= max_bytes * 0.9: # Leave headroom so every finished job does not trigger eviction
+                    break
+                _expire_job_output(job_id, rows.get(job_id))
+                removed += 1
+                total -= size
+
+        deleted = 0
+        if JOB_ROW_RETENTION_DAYS:
+            old_ids = [job_id for job_id, in ScanJob.query.with_entities(ScanJob.id)
+                       .filter(ScanJob.status.in_(TERMINAL_STATUSES))
+                       .filter(ScanJob.finished_at < now - timedelta(days=JOB_ROW_RETENTION_DAYS))]
+            if old_ids:
+                JobSubscriber.query.filter(JobSubscriber.job_id.in_(old_ids)).delete(synchronize_session=False)
+                ChartTask.query.filter(ChartTask.job_id.in_(old_ids)).delete(synchronize_session=False)
+                deleted = ScanJob.query.filter(ScanJob.id.in_(old_ids)).delete(synchronize_session=False)
+        db.session.commit()
+        db.session.remove()
+    if removed or deleted:
+        print(f"Retention: removed output of {removed} job(s), deleted {deleted} old job row(s)")
+    return removed, deleted
+
+# --- Scheduled Presets ---
+# Presets with a cron schedule are enqueued by a scheduler thread that runs next
+# to every job worker. Claims are a compare-and-set on next_run_at, so several
+# workers can run the scheduler without double-starting a preset.
+
+SCHEDULER_ENABLED = os.environ.get('SCHEDULER_ENABLED', 'true').lower() == 'true'
+SCHEDULER_TZ = os.environ.get('SCHEDULER_TZ', 'Asia/Kolkata') # Schedules are written in market time
+SCHEDULER_INTERVAL = float(os.environ.get('SCHEDULER_INTERVAL', 15))
+# Runs due at the same minute are spread over this many seconds (per screener, deterministic)
+SCHEDULE_STAGGER_SECONDS = int(os.environ.get('SCHEDULE_STAGGER_SECONDS', 120))
+# Runs missed by more than this (e.g. the box was down) are skipped, not started late
+SCHEDULE_MAX_LATE_MINUTES = int(os.environ.get('SCHEDULE_MAX_LATE_MINUTES', 60))
+scheduler_tzinfo = ZoneInfo(SCHEDULER_TZ)
+
+class CronSchedule:
+    """A five-field cron expression: minute hour day-of-month month day-of-week.
+
+    Fields accept ``*``, lists, ranges and steps (``*/5``, ``1-5``, ``9,15``).
+    Day-of-week is 0-7 with 0 and 7 both Sunday. As in Vixie cron, when
+    neither day-of-month nor day-of-week starts with ``*`` a day matches if
+    either does; otherwise both must match (so ``*/2`` still ANDs).
+    """
+
+    FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, expr):
+        parts = expr.split()
+        if len(parts) != 5:
+            raise ValueError(f"Expected 5 fields in cron expression '{expr}'")
+        minutes, hours, days, months, weekdays = (self._parse(part, lo, hi) for part, (lo, hi) in zip(parts, self.FIELDS))
+        self.minutes = sorted(minutes)
+        self.hours = sorted(hours)
+        self.days = days
+        self.months = months
+        self.weekdays = {day % 7 for day in weekdays}
+        self.star_day = parts[2].startswith('*')
+        self.star_weekday = parts[4].startswith('*')
+
+    @staticmethod
+    def _parse(field, lo, hi):
+        values = set()
+        for part in field.split(','):
+            step = 1
+            if '/' in part:
+                part, step = part.split('/', 1)
+                step = int(step)
+                if step < 1:
+                    raise ValueError(f"Invalid step in cron field '{field}'")
+            if part == '*':
+                start, end = lo, hi
+            elif '-' in part:
+                start, end = (int(value) for value in part.split('-', 1))
+            else:
+                start = int(part)
+                end = hi if step > 1 else start
+            if not lo <= start <= end <= hi:
+                raise ValueError(f"Cron field '{field}' is outside {lo}-{hi}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, day):
+        if day.month not in self.months:
+            return False
+        dom = day.day in self.days
+        dow = (day.weekday() + 1) % 7 in self.weekdays # cron counts from Sunday
+        if self.star_day or self.star_weekday:
+            return dom and dow
+        return dom or dow
+
+    def next_after(self, after):
+        """First firing time strictly after the naive local datetime ``after``."""
+        start = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = start.date()
+        for _ in range(366 * 5): # Covers Feb 29 schedules
+            if self._day_matches(day):
+                for hour in self.hours:
+                    for minute in self.minutes:
+                        candidate = datetime.combine(day, dtime(hour, minute))
+                        if candidate >= start:
+                            return candidate
+            day += timedelta(days=1)
+        raise ValueError('Cron expression never fires')
+
+def parse_schedule(schedule):
+    """Parse a ';'-separated list of cron expressions; raises ValueError if any is invalid."""
+    return [CronSchedule(expr) for expr in (schedule or '').split(';') if expr.strip()]
+
+def schedule_offset(fingerprint):
+    """Deterministic stagger for a screener. Identical presets share it, so they stay coalescable."""
+    if SCHEDULE_STAGGER_SECONDS <= 0:
+        return 0
+    return int(fingerprint[:8], 16) % (SCHEDULE_STAGGER_SECONDS + 1)
+
+def next_scheduled_run(schedule, offset, after=None):
+    """Next run time (naive UTC, like the other timestamps) strictly after ``after``."""
+    crons = parse_schedule(schedule)
+    if not crons:
+        return None
+    after = (after or datetime.utcnow()) - timedelta(seconds=offset)
+    local_after = after.replace(tzinfo=timezone.utc).astimezone(scheduler_tzinfo).replace(tzinfo=None)
+    fire = min(cron.next_after(local_after) for cron in crons)
+    fire = fire.replace(tzinfo=scheduler_tzinfo).astimezone(timezone.utc).replace(tzinfo=None)
+    return fire + timedelta(seconds=offset)
+
+def preset_next_run(preset, after=None):
+    return next_scheduled_run(preset.schedule, schedule_offset(screener_fingerprint(preset_screener(preset))), after)
+
+def _claim_scheduled_run(preset, due_at, now):
+    """Advance a preset past ``due_at``; only the worker whose update lands runs it."""
+    claimed = (ScanPreset.query.filter_by(id=preset.id, next_run_at=due_at)
+               .update({'next_run_at': preset_next_run(preset, now), 'last_run_at': now}, synchronize_session=False))
+    db.session.commit()
+    return bool(claimed)
+
+def schedule_due_presets():
+    """Enqueue scheduled presets that are due, within the browser budget.
+
+    Due presets with the same screener fingerprint and due time are coalesced
+    into one job that delivers to every subscribing user.
+    """
+    with app.app_context():
+        now = datetime.utcnow()
+        for preset in ScanPreset.query.filter(ScanPreset.schedule.isnot(None), ScanPreset.next_run_at.is_(None)).all():
             try:
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                fname = f"Chartink_Scan_{datetime.now().strftime('%Y%m%d_%H%M')}.pdf"
-                loop.run_until_complete(send_telegram_pdf(token, chat_id, pdf_bytes, fname))
-                loop.close()
-                jobs[job_id]['telegram_sent'] = True
-            except Exception as e:
-                print(f"Failed to send telegram: {e}")
+                preset.next_run_at = preset_next_run(preset, now) # New or edited schedules
+            except ValueError as e:
+                print(f"Preset {preset.id} has an invalid schedule: {e}")
+                preset.schedule = None
+        db.session.commit()
 
-    except Exception as e:
-        jobs[job_id]['status'] = 'failed'
-        jobs[job_id]['error'] = f"PDF Gen Error: {str(e)}"
+        due = (ScanPreset.query.filter(ScanPreset.schedule.isnot(None), ScanPreset.next_run_at <= now)
+               .order_by(ScanPreset.next_run_at).all())
+        if not due:
+            return
+
+        active = ScanJob.query.filter(ScanJob.status.notin_(TERMINAL_STATUSES)).count()
+        slots = max(1, JOB_BROWSER_BUDGET // CHART_WORKERS_PER_JOB) - active # Due runs wait while it is used up
+
+        groups = {}
+        for preset in due:
+            due_at = preset.next_run_at
+            if now - due_at > timedelta(minutes=SCHEDULE_MAX_LATE_MINUTES):
+                if _claim_scheduled_run(preset, due_at, now):
+                    print(f"Skipped scheduled run of preset {preset.id} due at {due_at} (too late)")
+                continue
+            screener = preset_screener(preset)
+            groups.setdefault((screener_fingerprint(screener), due_at), []).append(preset)
+
+        for (_, due_at), presets in groups.items():
+            if slots <= 0:
+                break # Still due; picked up on a later tick once browsers free up
+            claimed = [preset for preset in presets if _claim_scheduled_run(preset, due_at, now)]
+            if not claimed:
+                continue
+            job_id, shared = submit_job(claimed[0].user_id, {
+                'screeners': [preset_screener(claimed[0])],
+                'engine': DEFAULT_CHART_ENGINE,
+                'output': 'combined',
+                'scheduled_presets': [preset.id for preset in claimed]
+            }, subscribers=[preset.user_id for preset in claimed], priority=JOB_PRIORITY_SCHEDULED)
+            if not shared:
+                slots -= 1
+            print(f"Scheduled {'shared ' if shared else ''}job {job_id} for preset(s) {[preset.id for preset in claimed]}")
+
+def run_scheduler(stop_event):
+    print(f"Preset scheduler started (tz={SCHEDULER_TZ})")
+    while not stop_event.wait(SCHEDULER_INTERVAL):
+        try:
+            schedule_due_presets()
+        except Exception as e:
+            print(f"Scheduler tick failed: {e}")
+
+_embedded_worker_started = False
+_embedded_worker_lock = threading.Lock()
+
+@app.before_request
+def _ensure_embedded_worker():
+    # Single-process setups (python app.py, PythonAnywhere) run the worker inside
+    # the web process. Set EMBEDDED_WORKER=false and run worker.py to split them.
+    global _embedded_worker_started
+    if not EMBEDDED_WORKER or _embedded_worker_started:
+        return
+    with _embedded_worker_lock:
+        if not _embedded_worker_started:
+            threading.Thread(target=run_worker, daemon=True).start()
+            _embedded_worker_started = True
 
 # --- Routes ---
 
 @app.route('/stop_job/<job_id>', methods=['POST'])
 @login_required
 def stop_job(job_id):
-    if job_id in jobs:
-        jobs[job_id]['canceled'] = True
-        return jsonify({'success': True})
-    return jsonify({'error': 'Job not found'}), 404
+    row = db.session.get(ScanJob, job_id)
+    if not row:
+        return jsonify({'error': 'Job not found'}), 404
+    # A job shared with other users keeps running for them; this user just stops following it
+    if JobSubscriber.query.filter(JobSubscriber.job_id == job_id, JobSubscriber.user_id != current_user.id).count():
+        JobSubscriber.query.filter_by(job_id=job_id, user_id=current_user.id).delete()
+        db.session.commit()
+        return jsonify({'success': True, 'unsubscribed': True})
+    row.canceled = True
+    if row.status == 'queued':
+        row.status = 'failed'
+        row.error = 'Job stopped before it started.'
+    db.session.commit()
+    return jsonify({'success': True})
+
+@app.route('/resume_job/<job_id>', methods=['POST'])
+@login_required
+def resume_job(job_id):
+    row = db.session.get(ScanJob, job_id)
+    if not row or row.user_id != current_user.id:
+        return jsonify({'error': 'Job not found'}), 404
+    if row.status not in ('failed', 'stopped'):
+        return jsonify({'error': 'Only failed or stopped jobs can be resumed'}), 400
+    # The worker picks it up again and continues from the job's checkpoint
+    row.status = 'queued'
+    row.canceled = False
+    row.error = None
+    row.worker_id = None
+    row.finished_at = None
+    row.expired_at = None # An expired checkpoint just means the scan starts over
+    JobSubscriber.query.filter_by(job_id=job_id).update( # Everyone gets the resumed result
+        {'delivered_at': None, 'delivery_claimed_at': None, 'delivery_attempts': 0})
+    ChartTask.query.filter_by(job_id=job_id, status='failed').update({'status': 'queued', 'attempts': 0, 'claims': 0})
+    db.session.commit()
+    return jsonify({'success': True, 'job_id': job_id})
 
 @app.route('/')
 def home():
     if not current_user.is_authenticated:
         return redirect(url_for('login'))
-    return render_template('index.html', user=current_user)
+    return render_template('index.html', user=current_user, status_stream=STATUS_STREAM_ENABLED)
 
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -680,12 +3633,16 @@ def logout():
     logout_user()
     return redirect(url_for('login'))
 
+DIFF_MODES = (None, 'new', 'changes')
+
 @app.route('/api/update_settings', methods=['POST'])
 @login_required
 def update_settings():
     data = request.json
     current_user.telegram_bot_token = data.get('telegram_bot_token')
     current_user.telegram_chat_id = data.get('telegram_chat_id')
+    if 'telegram_stream' in data:
+        current_user.telegram_stream = bool(data['telegram_stream'])
     db.session.commit()
     return jsonify({'success': True})
 
@@ -699,6 +3656,15 @@ def handle_presets():
         if data.get('moving_averages'):
             ma_config_json = json.dumps(data['moving_averages'])
 
+        schedule = (data.get('schedule') or '').strip() or None
+        try:
+            parse_schedule(schedule)
+        except ValueError as e:
+            return jsonify({'error': f'Invalid schedule: {e}'}), 400
+        diff_mode = data.get('diff_mode') or None
+        if diff_mode not in DIFF_MODES:
+            return jsonify({'error': 'Unknown diff mode'}), 400
+
         preset = ScanPreset(
             user_id=current_user.id,
             title=data['title'],
@@ -706,8 +3672,12 @@ def handle_presets():
             url=data['url'],
             period=data.get('period', 'weekly'),
             range_val=data.get('range', '1 year'),
-            ma_config=ma_config_json
+            ma_config=ma_config_json,
+            schedule=schedule,
+            diff_mode=diff_mode
         )
+        if schedule:
+            preset.next_run_at = preset_next_run(preset)
         db.session.add(preset)
         db.session.commit()
         return jsonify({'success': True, 'id': preset.id})
@@ -730,10 +3700,45 @@ def handle_presets():
                 'url': p.url,
                 'period': p.period,
                 'range': p.range_val,
-                'moving_averages': ma_data
+                'moving_averages': ma_data,
+                'schedule': p.schedule,
+                'next_run_at': p.next_run_at.isoformat() + 'Z' if p.schedule and p.next_run_at else None,
+                'last_run_at': p.last_run_at.isoformat() + 'Z' if p.last_run_at else None,
+                'diff_mode': p.diff_mode
             })
         return jsonify(result)
 
+@app.route('/api/presets/<int:id>/schedule', methods=['PUT'])
+@login_required
+def update_preset_schedule(id):
+    preset = ScanPreset.query.get_or_404(id)
+    if preset.user_id != current_user.id:
+        return jsonify({'error': 'Unauthorized'}), 403
+    schedule = (request.json.get('schedule') or '').strip() or None
+    try:
+        parse_schedule(schedule)
+        preset.schedule = schedule
+        preset.next_run_at = preset_next_run(preset) if schedule else None
+    except ValueError as e:
+        return jsonify({'error': f'Invalid schedule: {e}'}), 400
+    db.session.commit()
+    return jsonify({'success': True, 'next_run_at': preset.next_run_at.isoformat() + 'Z' if preset.next_run_at else None})
+
+@app.route('/api/presets/<int:id>/diff_mode', methods=['PUT'])
+@login_required
+def update_preset_diff_mode(id):
+    preset = ScanPreset.query.get_or_404(id)
+    if preset.user_id != current_user.id:
+        return jsonify({'error': 'Unauthorized'}), 403
+    diff_mode = request.json.get('diff_mode') or None
+    if diff_mode not in DIFF_MODES:
+        return jsonify({'error': 'Unknown diff mode'}), 400
+    if not diff_mode:
+        preset.last_symbols = None # Turning it back on starts from a fresh baseline
+    preset.diff_mode = diff_mode
+    db.session.commit()
+    return jsonify({'success': True})
+
 @app.route('/api/presets/<int:id>', methods=['DELETE'])
 @login_required
 def delete_preset(id):
@@ -748,64 +3753,231 @@ def delete_preset(id):
 @login_required
 def start_generation():
     data = request.json
-    # Can accept raw URL or preset ID
-    screener_url = data.get('url')
     period = data.get('period', 'weekly')
     s_range = data.get('range', '1 year')
     moving_averages = data.get('moving_averages') # New
-    
-    job_id = str(uuid.uuid4())
-    jobs[job_id] = {
-        'status': 'queued', 
-        'processed': 0, 
-        'total': 0, 
-        'current_company': '',
-        'telegram_sent': False
-    }
-
-    user_config = {
-        'tg_token': current_user.telegram_bot_token,
-        'tg_chat_id': current_user.telegram_chat_id
+    engine = data.get('engine') or DEFAULT_CHART_ENGINE
+    if engine not in ('selenium', 'http'):
+        return jsonify({'error': 'Unknown engine'}), 400
+    output = data.get('output') or 'combined'
+    if output not in ('combined', 'per_screener'):
+        return jsonify({'error': 'Unknown output'}), 400
+    pdf_profile = data.get('pdf_profile') or PDF_PROFILE
+    try:
+        parse_pdf_profile(pdf_profile)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Can accept a raw URL, a list of URLs and/or a list of preset IDs.
+    # Presets run with their own saved chart settings.
+    screeners = []
+    for preset_id in data.get('preset_ids') or []:
+        preset = db.session.get(ScanPreset, preset_id)
+        if not preset or preset.user_id != current_user.id:
+            return jsonify({'error': f'Preset {preset_id} not found'}), 404
+        screeners.append(preset_screener(preset))
+    urls = ([data['url']] if data.get('url') else []) + (data.get('urls') or [])
+    for screener_url in urls:
+        screeners.append({
+            'title': screener_title(screener_url),
+            'url': screener_url,
+            'period': period,
+            'range': s_range,
+            'moving_averages': moving_averages
+        })
+    if not screeners:
+        return jsonify({'error': 'No screener URL or preset given'}), 400
+
+    params = {
+        'screeners': screeners,
+        'engine': engine,
+        'output': output,
+        'pdf_profile': pdf_profile
     }
-
-    thread = threading.Thread(target=process_job, args=(job_id, screener_url, period, s_range, moving_averages, user_config))
-    thread.daemon = True
-    thread.start()
-    
-    return jsonify({'job_id': job_id})
+    telegram_stream = bool(data['telegram_stream']) if data.get('telegram_stream') is not None else None
+    job_id, shared = submit_job(current_user.id, params, telegram_stream=telegram_stream, priority=JOB_PRIORITY_ADHOC)
+    return jsonify({'job_id': job_id, 'shared': shared})
 
 @app.route('/status/<job_id>', methods=['GET'])
 def check_status(job_id):
-    job = jobs.get(job_id)
+    job = db.session.get(ScanJob, job_id)
     if not job:
         return jsonify({'status': 'not_found'}), 404
-    
-    response = {
-        'status': job['status'],
-        'processed': job.get('processed', 0),
-        'total': job.get('total', 0),
-        'current_company': job.get('current_company', ''),
-        'error': job.get('error'),
-        'telegram_sent': job.get('telegram_sent')
-    }
-    return jsonify(response)
+    return jsonify(job_status_payload(job))
+
+# Each open progress stream holds a web worker thread. Hosts without room for
+# long-lived connections (PythonAnywhere's WSGI workers) poll /status instead.
+STATUS_STREAM_ENABLED = os.environ.get(
+    'STATUS_STREAM_ENABLED', 'false' if 'PYTHONANYWHERE_DOMAIN' in os.environ else 'true').lower() == 'true'
+STATUS_STREAM_INTERVAL = float(os.environ.get('STATUS_STREAM_INTERVAL', 0.5))
+# Streams are closed after this long and the browser's EventSource reconnects,
+# so one tab never pins a web worker past gunicorn's request timeout.
+STATUS_STREAM_MAX_SECONDS = int(os.environ.get('STATUS_STREAM_MAX_SECONDS', 60))
+
+@app.route('/status/<job_id>/stream', methods=['GET'])
+def stream_status(job_id):
+    if not STATUS_STREAM_ENABLED:
+        return '', 204 # EventSource gives up on a 204 and the page polls /status
+    if not db.session.get(ScanJob, job_id):
+        return jsonify({'status': 'not_found'}), 404
+
+    def events():
+        yield "retry: 1000\n\n"
+        last_payload = None
+        last_sent = started = time.time()
+        while time.time() - started < STATUS_STREAM_MAX_SECONDS:
+            db.session.expire_all() # Re-read the row the worker is updating
+            job = db.session.get(ScanJob, job_id)
+            if not job:
+                break
+            payload = json.dumps(job_status_payload(job))
+            if payload != last_payload:
+                yield f"data: {payload}\n\n"
+                last_payload = payload
+                last_sent = time.time()
+            elif time.time() - last_sent > 15:
+                yield ": keepalive\n\n"
+                last_sent = time.time()
+            if job.status in TERMINAL_STATUSES:
+                break
+            db.session.remove() # Do not hold a pooled connection while sleeping
+            time.sleep(STATUS_STREAM_INTERVAL)
+        db.session.remove()
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+def metrics_text():
+    """Prometheus text exposition for this process."""
+    lines = [stage_histogram.render()]
+    pool = driver_pool.stats()
+    lines += [
+        "# HELP chartink_driver_pool_drivers Chrome drivers in this process's pool.",
+        "# TYPE chartink_driver_pool_drivers gauge",
+        f'chartink_driver_pool_drivers{{state="live"}} {pool["live"]}',
+        f'chartink_driver_pool_drivers{{state="idle"}} {pool["idle"]}',
+        "# HELP chartink_jobs_running Jobs running in this process.",
+        "# TYPE chartink_jobs_running gauge",
+        f"chartink_jobs_running {len(jobs)}",
+        "# HELP chartink_process_resident_bytes Resident memory of this process.",
+        "# TYPE chartink_process_resident_bytes gauge",
+        f"chartink_process_resident_bytes {process_memory_bytes()}",
+    ]
+    limiter = chartink_limiter.stats()
+    lines += [
+        "# HELP chartink_upstream_rate Page loads per second allowed against Chartink, across all worker processes.",
+        "# TYPE chartink_upstream_rate gauge",
+        f"chartink_upstream_rate {limiter['rate'] if limiter['rate'] is not None else '+Inf'}",
+        "# HELP chartink_upstream_breaker_open 1 while the Chartink circuit breaker pauses all jobs.",
+        "# TYPE chartink_upstream_breaker_open gauge",
+        f"chartink_upstream_breaker_open {int(limiter['breaker_open'])}",
+        "# HELP chartink_upstream_breaker_trips_total Times the circuit breaker opened.",
+        "# TYPE chartink_upstream_breaker_trips_total counter",
+        f"chartink_upstream_breaker_trips_total {limiter['breaker_trips']}",
+        "# HELP chartink_upstream_processes Worker processes splitting the upstream rate.",
+        "# TYPE chartink_upstream_processes gauge",
+        f"chartink_upstream_processes {limiter['processes']}",
+    ]
+    with app.app_context():
+        counts = db.session.query(ScanJob.status, db.func.count(ScanJob.id)).group_by(ScanJob.status).all()
+        unit_counts = (db.session.query(ChartTask.status, db.func.count(ChartTask.id))
+                       .filter(ChartTask.status.in_(OPEN_UNIT_STATUSES)).group_by(ChartTask.status).all())
+    lines += ["# HELP chartink_jobs Jobs in the database by status.", "# TYPE chartink_jobs gauge"]
+    lines += [f'chartink_jobs{{status="{status}"}} {count}' for status, count in counts]
+    lines += ["# HELP chartink_chart_units Chart queue units waiting or being fetched, across all workers.",
+              "# TYPE chartink_chart_units gauge"]
+    lines += [f'chartink_chart_units{{status="{status}"}} {count}' for status, count in unit_counts]
+    return '\n'.join(lines) + '\n'
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(metrics_text(), mimetype='text/plain; version=0.0.4')
+
+# Comma-separated usernames allowed to see /admin/usage
+ADMIN_USERS = {name.strip() for name in os.environ.get('ADMIN_USERS', '').split(',') if name.strip()}
+
+@app.route('/admin/usage', methods=['GET'])
+@login_required
+def admin_usage():
+    """Disk use per job directory and this process's memory, for spotting leaks in long-running deployments."""
+    if current_user.username not in ADMIN_USERS:
+        return jsonify({'error': 'Forbidden'}), 403
+    usage = sorted(job_output_usage(), key=lambda entry: entry[1], reverse=True)
+    rows = {}
+    if usage:
+        rows = {row.id: row for row in ScanJob.query.filter(ScanJob.id.in_([job_id for job_id, _, _ in usage]))}
+    job_dirs = []
+    for job_id, size, mtime in usage:
+        row = rows.get(job_id)
+        job_dirs.append({
+            'job_id': job_id,
+            'user_id': row.user_id if row else None,
+            'status': row.status if row else None,
+            'disk_mb': round(size / (1024 * 1024), 2),
+            'finished_at': row.finished_at.isoformat() if row and row.finished_at else None,
+            'modified_at': datetime.fromtimestamp(mtime, timezone.utc).isoformat()
+        })
+    return jsonify({
+        'process': {
+            'pid': os.getpid(),
+            'resident_mb': round(process_memory_bytes() / (1024 * 1024), 1),
+            # Hot state of jobs running in this process (results themselves live on disk)
+            'live_job_state_bytes': {job_id: len(json.dumps(state, default=str)) for job_id, state in list(jobs.items())},
+            'driver_pool': driver_pool.stats()
+        },
+        'job_output': {
+            'directory': JOB_OUTPUT_DIR,
+            'total_mb': round(sum(size for _, size, _ in usage) / (1024 * 1024), 2),
+            'max_mb': JOB_OUTPUT_MAX_MB,
+            'result_ttl_hours': JOB_RESULT_TTL_HOURS,
+            'jobs': job_dirs
+        },
+        'chart_cache_mb': round(chart_cache._scan_size() / (1024 * 1024), 2) if chart_cache and os.path.isdir(CHART_CACHE_DIR) else None,
+        'job_rows': ScanJob.query.count()
+    })
 
 @app.route('/download/<job_id>', methods=['GET'])
 def download(job_id):
-    job = jobs.get(job_id)
-    if not job or job['status'] != 'completed' or not job['result']:
+    job = db.session.get(ScanJob, job_id)
+    if job and job.expired_at:
+        return jsonify({'error': 'This result has expired and was deleted'}), 410
+    if not job or job.status not in ('completed', 'stopped') or not job.result_path:
          return jsonify({'error': 'File not ready or job failed'}), 400
-    
-    pdf_buffer = BytesIO(job['result'])
+
+    # Streamed from disk rather than loaded into memory. Per-screener output is a zip of PDFs.
+    is_zip = job.result_path.endswith('.zip')
     return send_file(
-        pdf_buffer,
+        job.result_path,
         as_attachment=True,
-        download_name=f"charts_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf",
-        mimetype='application/pdf'
+        download_name=f"charts_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{'zip' if is_zip else 'pdf'}",
+        mimetype='application/zip' if is_zip else 'application/pdf'
     )
 
+def ensure_columns():
+    """Add model columns missing from tables created by an older version.
+
+    ``create_all`` only creates missing tables, so new nullable columns on
+    existing tables (e.g. preset schedules) are added here.
+    """
+    inspector = db.inspect(db.engine)
+    quote = db.engine.dialect.identifier_preparer.quote
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            with db.engine.begin() as conn:
+                conn.execute(db.text(f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} {column_type}"))
+            print(f"Added column {table.name}.{column.name}")
+
 with app.app_context():
     db.create_all()
+    ensure_columns()
 
 if __name__ == '__main__':
     # Use 0.0.0.0 for external access
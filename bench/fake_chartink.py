@@ -0,0 +1,222 @@
+"""Local stand-in for chartink.com used by the offline benchmark.
+
+Serves just enough of the real site for the scraping pipeline to run unchanged:
+
+* ``/screener`` - a paginated results table (``DataTables_Table_0``) with a
+  "Stock Name" header, ``/fundamentals/SYMBOL.html`` links and a "Next" button,
+  plus a minimal ``jQuery.fn.dataTable`` shim so the one-shot DataTable read can
+  be benchmarked against pagination.
+* ``/stocks/SYMBOL.html`` - a stock page with the ``innerform`` and ``newone3``
+  forms, the ``innerb`` update button and the ``ChartImage`` iframe.
+* ``/chart`` - the iframe document holding ``img#cross`` with a base64 PNG.
+
+Run it standalone with ``python bench/fake_chartink.py --rows 500``.
+"""
+import argparse
+import base64
+import json
+import random
+import time
+from functools import lru_cache
+from io import BytesIO
+
+from flask import Flask, request
+from PIL import Image, ImageDraw
+
+SCREENER_PAGE = """<!doctype html>
+<html>
+<head><title>Fake Screener</title></head>
+<body>
+<table id="DataTables_Table_0">
+  <thead><tr><th>Sr.</th><th>Stock Name</th><th>Symbol</th></tr></thead>
+  <tbody></tbody>
+</table>
+<button id="next">Next</button>
+<script>
+const ROWS = %(rows)s;
+const PAGE_SIZE = %(page_size)d;
+let page = 0;
+
+function rowHtml(row, i) {
+    return '<td>' + (i + 1) + '</td><td><a href="/fundamentals/' + row.nsecode + '.html">' + row.name + '</a></td><td>' + row.nsecode + '</td>';
+}
+
+function render() {
+    const tbody = document.querySelector('#DataTables_Table_0 tbody');
+    tbody.innerHTML = '';
+    ROWS.slice(page * PAGE_SIZE, (page + 1) * PAGE_SIZE).forEach((row, i) => {
+        const tr = document.createElement('tr');
+        tr.innerHTML = rowHtml(row, page * PAGE_SIZE + i);
+        tbody.appendChild(tr);
+    });
+    const next = document.getElementById('next');
+    if ((page + 1) * PAGE_SIZE >= ROWS.length) next.setAttribute('disabled', 'disabled');
+}
+
+document.getElementById('next').addEventListener('click', () => {
+    // Simulate the XHR round-trip of a real page change
+    setTimeout(() => { page++; render(); }, %(latency_ms)d);
+});
+
+%(api_shim)s
+
+setTimeout(render, %(latency_ms)d);
+</script>
+</body>
+</html>
+"""
+
+# Just the slice of the jQuery DataTables API that the scraper's fast path uses
+DATATABLE_API_SHIM = """
+window.jQuery = function (table) {
+    return {
+        DataTable: function () {
+            return {
+                page: { info: function () { return { serverSide: false }; } },
+                rows: function () {
+                    return {
+                        data: function () { return { toArray: function () { return ROWS.slice(); } }; },
+                        nodes: function () { return { toArray: function () { return []; } }; }
+                    };
+                }
+            };
+        }
+    };
+};
+window.jQuery.fn = { dataTable: { tables: function () {
+    return document.querySelector('#DataTables_Table_0 tbody tr') ? [document.getElementById('DataTables_Table_0')] : [];
+} } };
+"""
+
+STOCK_PAGE = """<!doctype html>
+<html>
+<head><title>%(symbol)s</title></head>
+<body>
+<h3 style="margin: 0px;margin-left: 5px;font-size:20px">%(symbol)s Industries Ltd</h3>
+<form id="innerform" action="/chart" method="post" target="ChartImage">
+  <input type="hidden" name="s" value="%(symbol)s">
+  <select name="ti"><option value="252" selected>1 year</option><option value="504">2 years</option><option value="22">1 month</option></select>
+  <select name="d"><option value="d" selected>daily</option><option value="w">weekly</option><option value="m">monthly</option></select>
+  <select name="c"><option value="None" selected>Candle</option></select>
+</form>
+<form id="newone3">
+  %(ma_fields)s
+</form>
+<button id="innerb" onclick="submitChart()">Update</button>
+<iframe id="ChartImage" name="ChartImage" src="/chart?s=%(symbol)s&ti=252&d=d" width="900" height="500"></iframe>
+<script>
+function submitChart() {
+    const form = document.getElementById('innerform');
+    document.querySelectorAll('#newone3 [name]').forEach(field => {
+        let copy = form.querySelector('[data-ma="' + field.name + '"]');
+        if (!copy) {
+            copy = document.createElement('input');
+            copy.type = 'hidden';
+            copy.name = field.name;
+            copy.setAttribute('data-ma', field.name);
+            form.appendChild(copy);
+        }
+        copy.value = field.type === 'checkbox' ? (field.checked ? 'on' : '') : field.value;
+    });
+    form.submit();
+}
+</script>
+</body>
+</html>
+"""
+
+MA_FIELDS = ''.join(
+    f'<input type="checkbox" name="a{i}"><select name="a{i}t"><option value="c">c</option></select>'
+    f'<select name="a{i}v"><option value="SMA">SMA</option></select><input type="text" name="a{i}l" value="20">'
+    for i in range(1, 6)
+)
+
+CHART_DOC = '<!doctype html><html><body><img id="cross" src="data:image/png;base64,%s"></body></html>'
+
+
+@lru_cache(maxsize=4096)
+def chart_png(symbol, settings):
+    """A chart-sized PNG that differs per symbol and per chart settings.
+
+    Drawn like a real Chartink chart (grid, candles, volume bars, an MA line and
+    axis labels) so PNG sizes and PDF encoding costs are in a realistic range.
+    """
+    image = Image.new('RGB', (1200, 600), 'white')
+    draw = ImageDraw.Draw(image)
+    rng = random.Random(symbol + settings)
+    for y in range(20, 470, 30):
+        draw.line([(0, y), (1140, y)], fill=(230, 233, 240))
+        draw.text((1146, y - 6), f"{rng.uniform(100, 900):.2f}", fill=(90, 90, 90))
+    for x in range(0, 1140, 60):
+        draw.line([(x, 20), (x, 580)], fill=(230, 233, 240))
+        draw.text((x + 2, 584), f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}", fill=(90, 90, 90))
+
+    price = 250.0
+    closes = []
+    for x in range(4, 1136, 8):
+        open_ = price
+        price = min(440, max(40, price + rng.gauss(0, 6)))
+        high = max(open_, price) + rng.uniform(0, 6)
+        low = min(open_, price) - rng.uniform(0, 6)
+        colour = (38, 166, 91) if price >= open_ else (229, 57, 53)
+        draw.line([(x, 470 - high), (x, 470 - low)], fill=colour)
+        draw.rectangle([x - 3, 470 - max(open_, price), x + 3, 470 - min(open_, price)], fill=colour)
+        draw.rectangle([x - 3, 580 - rng.uniform(5, 90), x + 3, 580], fill=(158, 174, 200))
+        closes.append((x, 470 - price))
+    ma = [(x, sum(y for _, y in closes[max(0, i - 19):i + 1]) / len(closes[max(0, i - 19):i + 1]))
+          for i, (x, _) in enumerate(closes)]
+    draw.line(ma, fill=(37, 99, 235), width=2)
+    draw.text((20, 4), f"{symbol} {settings}", fill='black')
+    buffer = BytesIO()
+    image.save(buffer, format='PNG')
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def symbols(count):
+    return [f"SYM{i:05d}" for i in range(count)]
+
+
+def create_app(rows=50, page_size=25, latency=0.0):
+    """Build the fake site. ``latency`` (seconds) is added to every page and chart."""
+    app = Flask(__name__)
+    latency_ms = int(latency * 1000)
+
+    def wait():
+        if latency:
+            time.sleep(latency)
+
+    @app.route('/screener')
+    def screener():
+        wait()
+        count = int(request.args.get('rows', rows))
+        data = [{'nsecode': s, 'name': f"{s} Industries Ltd"} for s in symbols(count)]
+        return SCREENER_PAGE % {
+            'rows': json.dumps(data),
+            'page_size': int(request.args.get('page_size', page_size)),
+            'latency_ms': latency_ms,
+            'api_shim': '' if request.args.get('api') == '0' else DATATABLE_API_SHIM,
+        }
+
+    @app.route('/stocks/<symbol>.html')
+    def stock(symbol):
+        wait()
+        return STOCK_PAGE % {'symbol': symbol, 'ma_fields': MA_FIELDS}
+
+    @app.route('/chart', methods=['GET', 'POST'])
+    def chart():
+        wait()
+        values = request.values
+        settings = ','.join(f"{k}={values[k]}" for k in sorted(values) if k != 's' and values[k])
+        return CHART_DOC % chart_png(values.get('s', 'UNKNOWN'), settings)
+
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a local Chartink stand-in.')
+    parser.add_argument('--rows', type=int, default=50)
+    parser.add_argument('--page-size', type=int, default=25)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response.')
+    parser.add_argument('--port', type=int, default=5055)
+    args = parser.parse_args()
+    create_app(args.rows, args.page_size, args.latency).run(port=args.port, threaded=True)
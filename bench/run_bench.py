@@ -0,0 +1,262 @@
+"""Offline benchmark for the scraping pipeline.
+
+Starts the local Chartink stand-in (bench/fake_chartink.py) and measures, for
+each screener size N:
+
+* screener  - get_url_and_index in 'auto' (DataTable read) and 'paginate' mode
+* charts    - chart fetch throughput with the HTTP engine and with Selenium
+              (per Chrome driver profile, see --driver-profiles)
+* pdf       - PdfStreamWriter build time and file size for N charts, per PDF
+              output profile (re-encoding included)
+
+Every stage reports wall time, charts/second and the Python heap peak
+(tracemalloc, measured in a separate pass). Selenium stages are skipped when
+Chrome cannot be started.
+
+    python bench/run_bench.py --sizes 50 500 2000 --json bench_results.json
+    python bench/run_bench.py --baseline bench_results.json   # fail on regressions
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_chartink import create_app, symbols
+
+SCRATCH = tempfile.mkdtemp(prefix='chartink_bench_')
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log(self, *args):
+        pass
+
+
+def start_fake_site(latency, page_size):
+    server = make_server('127.0.0.1', 0, create_app(page_size=page_size, latency=latency),
+                         threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def import_app(base_url):
+    # The app reads these at import time
+    os.environ['CHARTINK_BASE_URL'] = base_url
+    os.environ['CHART_CACHE_ENABLED'] = 'false'
+    os.environ.setdefault('RATE_LIMIT_ENABLED', 'false') # Measure raw throughput, not the pacing
+    os.environ['EMBEDDED_WORKER'] = 'false'
+    os.environ['JOB_OUTPUT_DIR'] = os.path.join(SCRATCH, 'jobs')
+    os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(SCRATCH, 'bench.db')}")
+    import app
+    return app
+
+
+TRACE_MEMORY = True
+
+
+def measure(fn):
+    """Run ``fn`` and return (result, seconds, python heap peak in MB).
+
+    Timing comes from a clean run; tracemalloc slows allocation-heavy code a
+    lot, so the heap peak is taken from a second, traced run.
+    """
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+
+    peak = 0
+    if TRACE_MEMORY:
+        tracemalloc.start()
+        try:
+            fn()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return result, elapsed, peak / (1024 * 1024)
+
+
+def bench_screener(app, base_url, n, mode, profile='full'):
+    pooled = app.driver_pool.lease(profile=profile)
+    try:
+        def run():
+            pooled.driver.get(f"{base_url}/screener?rows={n}")
+            return app.get_url_and_index(pooled.driver, mode=mode)
+        urls, elapsed, peak = measure(run)
+    finally:
+        app.driver_pool.release(pooled)
+    assert len(urls) == n, f"screener ({mode}) found {len(urls)} of {n} rows"
+    return elapsed, peak
+
+
+def bench_charts_http(app, base_url, n):
+    urls = [f"{base_url}/stocks/{s}.html" for s in symbols(n)]
+
+    def run():
+        with ThreadPoolExecutor(app.HTTP_FETCH_CONCURRENCY) as pool:
+            return list(pool.map(lambda u: app.fetch_chart_http(u, 'weekly', '1 year', None), urls))
+    results, elapsed, peak = measure(run)
+    fetched = sum(1 for name, img in results if img)
+    assert fetched == n, f"http engine fetched {fetched} of {n} charts"
+    return elapsed, peak
+
+
+def bench_charts_selenium(app, base_url, n, profile='full'):
+    urls = [f"{base_url}/stocks/{s}.html" for s in symbols(n)]
+    workers = min(app.CHART_WORKERS_PER_JOB, n)
+
+    def fetch(url):
+        pooled = app.driver_pool.lease(profile=profile)
+        try:
+            return app.get_image_from_link(pooled.driver, url, 'weekly', '1 year', None)
+        finally:
+            app.driver_pool.release(pooled)
+
+    def run():
+        with ThreadPoolExecutor(workers) as pool:
+            return list(pool.map(fetch, urls))
+    results, elapsed, peak = measure(run)
+    fetched = sum(1 for name, img in results if img)
+    assert fetched == n, f"selenium engine fetched {fetched} of {n} charts"
+    return elapsed, peak
+
+
+def warm_up(app, base_url, n):
+    """Fetch every chart once, untimed, and keep them on disk for the PDF stage.
+
+    The stand-in renders each chart with PIL on first request; warming its cache
+    keeps the fake site from being the bottleneck of the timed stages.
+    """
+    charts_dir = os.path.join(SCRATCH, f"charts_{n}")
+    os.makedirs(charts_dir, exist_ok=True)
+    urls = [f"{base_url}/stocks/{s}.html" for s in symbols(n)]
+    with ThreadPoolExecutor(app.HTTP_FETCH_CONCURRENCY) as pool:
+        results = list(pool.map(lambda u: app.fetch_chart_http(u, 'weekly', '1 year', None), urls))
+
+    paths = []
+    for i, (name, b64) in enumerate(results):
+        path = os.path.join(charts_dir, f"{i:05d}.png")
+        with open(path, 'wb') as f:
+            f.write(app.base64.b64decode(b64))
+        paths.append((name, path))
+    return paths
+
+
+def bench_pdf(app, paths, profile):
+    n = len(paths)
+    pdf_path = os.path.join(SCRATCH, f"bench_{n}_{profile}.pdf")
+    options = app.parse_pdf_profile(profile)
+
+    def encode(item):
+        index, (name, path) = item
+        return name, app.encode_chart(path, options, os.path.join(SCRATCH, f"enc_{n}_{index:05d}"))
+
+    def run():
+        pages = paths
+        if options:
+            pages = list(app.pdf_encode_pool.map(encode, enumerate(paths)))
+        writer = app.PdfStreamWriter(pdf_path)
+        for name, path in pages:
+            writer.add_page(name, path)
+        writer.close()
+        return os.path.getsize(pdf_path)
+    size, elapsed, peak = measure(run)
+    return elapsed, peak, size
+
+
+def chrome_available(app):
+    try:
+        app.driver_pool.release(app.driver_pool.lease())
+        return True
+    except Exception as e:
+        print(f"Chrome unavailable, skipping Selenium stages ({e.__class__.__name__})")
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the scraping pipeline against a local fake Chartink.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 500, 2000])
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds of simulated latency per response.')
+    parser.add_argument('--page-size', type=int, default=25, help='Screener rows per page.')
+    parser.add_argument('--selenium-limit', type=int, default=50,
+                        help='Cap on charts fetched through Selenium per size (it is much slower).')
+    parser.add_argument('--stages', nargs='+', default=['screener', 'charts', 'pdf'])
+    parser.add_argument('--pdf-profiles', nargs='+', default=['original', 'compact', 'small'],
+                        help='PDF output profiles to build (names or specs like width=1000,jpeg=70).')
+    parser.add_argument('--driver-profiles', nargs='+', default=['full', 'lean'],
+                        help='Chrome driver profiles to run the Selenium stages with.')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the traced pass that measures heap peaks.')
+    parser.add_argument('--json', help='Write results to this file.')
+    parser.add_argument('--baseline', help='Compare against a previous --json file.')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed slowdown vs. baseline before failing (0.25 = 25%%).')
+    args = parser.parse_args()
+
+    global TRACE_MEMORY
+    TRACE_MEMORY = not args.no_memory
+    server, base_url = start_fake_site(args.latency, args.page_size)
+    app = import_app(base_url)
+    has_chrome = chrome_available(app) if {'screener', 'charts'} & set(args.stages) else False
+
+    results = []
+
+    def record(stage, n, items, elapsed, peak, output_bytes=None):
+        row = {'stage': stage, 'n': n, 'seconds': round(elapsed, 3),
+               'per_second': round(items / elapsed, 2) if elapsed else None, 'peak_mb': round(peak, 1)}
+        if output_bytes is not None:
+            row['output_mb'] = round(output_bytes / (1024 * 1024), 2)
+        results.append(row)
+        output = f"{row['output_mb']:>9.2f} MB" if output_bytes is not None else ''
+        print(f"{stage:<20} N={n:<6} {row['seconds']:>9.3f}s {row['per_second'] or 0:>10.2f}/s {row['peak_mb']:>8.1f} MB{output}")
+
+    print(f"{'stage':<20} {'size':<8} {'time':>10} {'rate':>12} {'py peak':>11} {'output':>12}")
+    try:
+        for n in args.sizes:
+            paths = warm_up(app, base_url, n)
+            if 'screener' in args.stages and has_chrome:
+                for profile in args.driver_profiles:
+                    for mode in ('auto', 'paginate'):
+                        record(f"screener_{mode}_{profile}", n, n, *bench_screener(app, base_url, n, mode, profile))
+            if 'charts' in args.stages:
+                record('charts_http', n, n, *bench_charts_http(app, base_url, n))
+                if has_chrome:
+                    limit = min(n, args.selenium_limit)
+                    for profile in args.driver_profiles:
+                        record(f"charts_selenium_{profile}", limit, limit,
+                               *bench_charts_selenium(app, base_url, limit, profile))
+            if 'pdf' in args.stages:
+                for profile in args.pdf_profiles:
+                    record(f"pdf_{profile}", n, n, *bench_pdf(app, paths, profile))
+    finally:
+        app.driver_pool.close()
+        server.shutdown()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {(r['stage'], r['n']): r for r in json.load(f)}
+        regressions = []
+        for row in results:
+            base = baseline.get((row['stage'], row['n']))
+            if base and row['seconds'] > base['seconds'] * (1 + args.tolerance):
+                regressions.append(f"{row['stage']} N={row['n']}: {base['seconds']}s -> {row['seconds']}s")
+        if regressions:
+            print("Regressions vs. baseline:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("No regressions vs. baseline.")
+
+
+if __name__ == '__main__':
+    main()
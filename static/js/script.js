@@ -1,6 +1,7 @@
 // ─── Globals ────────────────────────────────────────────────
 let currentJobId  = null;
 let pollInterval  = null;
+let statusSource  = null;
 let loadedPresets = [];
 
 // ─── Init ────────────────────────────────────────────────────
@@ -44,11 +45,12 @@ document.addEventListener('DOMContentLoaded', () => {
             e.preventDefault();
             const token  = document.getElementById('tg_bot_token').value;
             const chatId = document.getElementById('tg_chat_id').value;
+            const stream = document.getElementById('tg_stream').checked;
             try {
                 const res = await fetch('/api/update_settings', {
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ telegram_bot_token: token, telegram_chat_id: chatId })
+                    body: JSON.stringify({ telegram_bot_token: token, telegram_chat_id: chatId, telegram_stream: stream })
                 });
                 if (res.ok) {
                     showToast('Settings saved!');
@@ -119,14 +121,25 @@ function createPresetCard(preset) {
         ? `<span class="tag">${escapeHtml(preset.period)}</span>` : '';
     const rangeTag  = preset.range
         ? `<span class="tag">${escapeHtml(preset.range)}</span>`  : '';
+    const diffTag = preset.diff_mode
+        ? `<span class="tag" title="Only new symbols are fetched"><i class="fa-solid fa-code-compare"></i> ${DIFF_MODE_LABELS[preset.diff_mode]}</span>` : '';
+    const scheduleTag = preset.schedule
+        ? `<span class="tag" title="Next run: ${preset.next_run_at ? new Date(preset.next_run_at).toLocaleString() : 'pending'}"><i class="fa-regular fa-clock"></i> ${escapeHtml(preset.schedule)}</span>` : '';
 
     card.innerHTML = `
         <div class="preset-card-top">
+            <input type="checkbox" class="preset-select" value="${preset.id}" title="Select for a batch run">
             <div class="preset-card-title">${escapeHtml(preset.title)}</div>
             <div class="preset-card-actions">
                 <button class="btn-run" onclick="runPreset(${preset.id})" title="Run this scan">
                     <i class="fa-solid fa-play"></i> Run
                 </button>
+                <button class="btn-delete" onclick="cycleDiffMode(${preset.id})" title="Diff mode: only fetch symbols new since the last run">
+                    <i class="fa-solid fa-code-compare"></i>
+                </button>
+                <button class="btn-delete" onclick="editSchedule(${preset.id})" title="Schedule this scan">
+                    <i class="fa-regular fa-clock"></i>
+                </button>
                 <button class="btn-delete" onclick="deletePreset(${preset.id})" title="Delete preset">
                     <i class="fa-solid fa-trash"></i>
                 </button>
@@ -137,7 +150,7 @@ function createPresetCard(preset) {
             <i class="fa-solid fa-link" style="flex-shrink:0;font-size:11px;"></i>
             <span style="overflow:hidden;text-overflow:ellipsis;white-space:nowrap;">${escapeHtml(preset.url)}</span>
         </div>
-        <div class="preset-tags">${periodTag}${rangeTag}</div>
+        <div class="preset-tags">${periodTag}${rangeTag}${scheduleTag}${diffTag}</div>
     `;
     return card;
 }
@@ -192,6 +205,51 @@ async function deletePreset(id) {
     }
 }
 
+const DIFF_MODE_LABELS = { new: 'New only', changes: 'New + dropped' };
+
+async function cycleDiffMode(id) {
+    const preset = loadedPresets.find(p => p.id === id);
+    if (!preset) return;
+    // Off -> new symbols only -> new plus dropped-out list -> off
+    const next = { null: 'new', new: 'changes', changes: null }[preset.diff_mode || null];
+    try {
+        const res = await fetch(`/api/presets/${id}/diff_mode`, {
+            method: 'PUT',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ diff_mode: next })
+        });
+        if (!res.ok) { showToast('Could not change diff mode', true); return; }
+        showToast(next ? `Diff mode: ${DIFF_MODE_LABELS[next]}` : 'Diff mode off');
+        loadPresets();
+    } catch (err) {
+        showToast('Error changing diff mode', true);
+    }
+}
+
+async function editSchedule(id) {
+    const preset = loadedPresets.find(p => p.id === id);
+    if (!preset) return;
+    const schedule = prompt(
+        'Cron schedule(s) in market time, separated by ";" (minute hour day month weekday).\n' +
+        'Example: 20 9 * * 1-5; 35 15 * * 1-5\nLeave empty to turn scheduling off.',
+        preset.schedule || ''
+    );
+    if (schedule === null) return;
+    try {
+        const res = await fetch(`/api/presets/${id}/schedule`, {
+            method: 'PUT',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ schedule })
+        });
+        const data = await res.json();
+        if (!res.ok) { showToast(data.error || 'Could not save schedule', true); return; }
+        showToast(data.next_run_at ? `Next run: ${new Date(data.next_run_at).toLocaleString()}` : 'Schedule removed');
+        loadPresets();
+    } catch (err) {
+        showToast('Error saving schedule', true);
+    }
+}
+
 function runPreset(id) {
     const preset = loadedPresets.find(p => p.id === id);
     if (!preset) return;
@@ -229,6 +287,19 @@ function runPreset(id) {
     startScraping();
 }
 
+function runSelectedPresets() {
+    const ids = Array.from(document.querySelectorAll('.preset-select:checked'), box => parseInt(box.value));
+    if (ids.length === 0) { showToast('Select one or more presets first', true); return; }
+
+    // Each preset runs with its own saved settings; stocks shared between them are fetched once
+    window.scrollTo({ top: 0, behavior: 'smooth' });
+    submitJob({
+        preset_ids:  ids,
+        output:      document.getElementById('batchOutput').value,
+        pdf_profile: document.getElementById('pdf_profile').value
+    });
+}
+
 // ─── Scraping ────────────────────────────────────────────────
 async function startScraping() {
     const url    = document.getElementById('screener_url').value;
@@ -254,6 +325,10 @@ async function startScraping() {
         }
     }
 
+    submitJob({ url, period, range, moving_averages: maConfig, pdf_profile: document.getElementById('pdf_profile').value });
+}
+
+async function submitJob(payload) {
     // Show status box
     const statusBox = document.getElementById('statusContainer');
     statusBox.classList.add('show');
@@ -270,21 +345,22 @@ async function startScraping() {
     stopBtn.disabled       = false;
     stopBtn.innerHTML      = '<i class="fa-solid fa-stop"></i> Stop Scan';
     dlBtn.style.display    = 'none';
+    document.getElementById('resumeBtn').style.display = 'none';
 
     try {
         const res  = await fetch('/start_generation', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ url, period, range, moving_averages: maConfig })
+            body: JSON.stringify(payload)
         });
         const data = await res.json();
 
         if (data.job_id) {
             currentJobId = data.job_id;
-            if (pollInterval) clearInterval(pollInterval);
-            pollInterval = setInterval(pollStatus, 2000);
+            if (data.shared) showToast('Joined an identical scan that is already running');
+            watchJob();
         } else {
-            showToast('Failed to start job', true);
+            showToast(data.error || 'Failed to start job', true);
             stopBtn.style.display = 'none';
         }
     } catch (err) {
@@ -299,7 +375,14 @@ async function stopJob() {
     if (!confirm('Stop the current scan?')) return;
     try {
         const res = await fetch(`/stop_job/${currentJobId}`, { method: 'POST' });
-        if (res.ok) {
+        const data = await res.json();
+        if (res.ok && data.unsubscribed) {
+            // Shared with other users: the scan continues for them
+            stopWatching();
+            showToast('Stopped following the shared scan');
+            document.getElementById('stopBtn').style.display = 'none';
+            document.getElementById('statusText').innerText  = 'Stopped.';
+        } else if (res.ok) {
             showToast('Stopping scan...');
             const stopBtn = document.getElementById('stopBtn');
             stopBtn.disabled  = true;
@@ -310,64 +393,143 @@ async function stopJob() {
     }
 }
 
-async function pollStatus() {
+async function resumeJob() {
     if (!currentJobId) return;
     try {
-        const res  = await fetch(`/status/${currentJobId}`);
+        const res = await fetch(`/resume_job/${currentJobId}`, { method: 'POST' });
         const data = await res.json();
+        if (!res.ok) { showToast(data.error || 'Could not resume scan', true); return; }
+
+        const stopBtn = document.getElementById('stopBtn');
+        document.getElementById('resumeBtn').style.display   = 'none';
+        document.getElementById('downloadBtn').style.display = 'none';
+        document.getElementById('statusText').style.color    = '';
+        stopBtn.style.display = 'block';
+        stopBtn.disabled      = false;
+        stopBtn.innerHTML     = '<i class="fa-solid fa-stop"></i> Stop Scan';
+        showToast('Resuming scan...');
+        watchJob();
+    } catch (err) {
+        showToast('Error resuming scan', true);
+    }
+}
 
-        const statusText = document.getElementById('statusText');
-        const stopBtn    = document.getElementById('stopBtn');
-        const dlBtn      = document.getElementById('downloadBtn');
-
-        if (data.status === 'not_found' || data.error) {
-            clearInterval(pollInterval);
-            statusText.innerText   = data.error || 'Unknown error';
-            statusText.style.color = '#DC2626';
-            stopBtn.style.display  = 'none';
-            return;
-        }
+// ─── Status Updates ──────────────────────────────────────────
+// Progress is pushed over Server-Sent Events; polling /status every 2s is the
+// fallback for browsers without EventSource, servers with streaming turned off
+// (STATUS_STREAM_ENABLED) or when the stream cannot connect.
+function stopWatching() {
+    if (statusSource) { statusSource.close(); statusSource = null; }
+    if (pollInterval) { clearInterval(pollInterval); pollInterval = null; }
+}
 
-        // Progress
-        let percent = 0;
-        if (data.total > 0) {
-            percent = Math.round((data.processed / data.total) * 100);
-        } else if (data.status === 'scraping_urls') {
-            percent = 10;
-        }
-        document.getElementById('progressBar').style.width   = `${percent}%`;
-        document.getElementById('progressPercent').innerText = `${percent}%`;
-
-        // Status label
-        const statusMap = {
-            queued:        'Queued...',
-            running:       'Initializing...',
-            scraping_urls: 'Scraping stock links...',
-            fetching_charts: `Processing ${data.processed} of ${data.total} charts`,
-            generating_pdf: 'Generating PDF...',
-            completed:     '✓ Completed!',
-            stopped:       'Stopped.'
-        };
-        statusText.innerText   = statusMap[data.status] || data.status;
-        statusText.style.color = '';
-
-        if (data.current_company) {
-            document.getElementById('currentCompany').innerText = `Current: ${data.current_company}`;
-        }
+function watchJob() {
+    stopWatching();
+    if (!window.EventSource || window.STATUS_STREAM_ENABLED === false) {
+        pollInterval = setInterval(pollStatus, 2000);
+        return;
+    }
 
-        if (data.status === 'completed' || data.status === 'stopped') {
-            clearInterval(pollInterval);
-            stopBtn.style.display = 'none';
-            dlBtn.href            = `/download/${currentJobId}`;
-            dlBtn.style.display   = 'flex';
-            if (data.telegram_sent) showToast('PDF sent to Telegram! 🚀');
+    let failures = 0;
+    statusSource = new EventSource(`/status/${currentJobId}/stream`);
+    statusSource.onmessage = (e) => {
+        failures = 0;
+        renderStatus(JSON.parse(e.data));
+    };
+    statusSource.onerror = () => {
+        // The server closes the stream periodically and EventSource reconnects;
+        // only give up on it when it is closed for good or keeps failing.
+        failures++;
+        if (statusSource && (statusSource.readyState === EventSource.CLOSED || failures > 3)) {
+            stopWatching();
+            pollInterval = setInterval(pollStatus, 2000);
         }
+    };
+}
 
+async function pollStatus() {
+    if (!currentJobId) return;
+    try {
+        const res  = await fetch(`/status/${currentJobId}`);
+        renderStatus(await res.json());
     } catch (err) {
         console.error('Poll error', err);
     }
 }
 
+function renderStatus(data) {
+    const statusText = document.getElementById('statusText');
+    const stopBtn    = document.getElementById('stopBtn');
+    const dlBtn      = document.getElementById('downloadBtn');
+
+    if (data.status === 'not_found' || data.error) {
+        stopWatching();
+        statusText.innerText   = data.error || 'Unknown error';
+        statusText.style.color = '#DC2626';
+        stopBtn.style.display  = 'none';
+        if (data.status === 'failed') {
+            document.getElementById('resumeBtn').style.display = 'block';
+        }
+        return;
+    }
+
+    // Progress
+    let percent = 0;
+    if (data.total > 0) {
+        percent = Math.round((data.processed / data.total) * 100);
+    } else if (data.status === 'scraping_urls') {
+        percent = 10;
+    }
+    document.getElementById('progressBar').style.width   = `${percent}%`;
+    document.getElementById('progressPercent').innerText = `${percent}%`;
+
+    // Status label
+    const statusMap = {
+        queued:        data.queue_position ? `Queued (position ${data.queue_position})...` : 'Queued...',
+        running:       'Initializing...',
+        scraping_urls: 'Scraping stock links...',
+        fetching_charts: `Processing ${data.processed} of ${data.total} charts` +
+                         (data.charts_deduped ? ` (${data.charts_deduped} shared skipped)` : '') +
+                         (data.telegram_stream_deferred ? ' - charts go to Telegram with the PDF' : ''),
+        generating_pdf: 'Generating PDF...',
+        completed:     '✓ Completed!',
+        stopped:       'Stopped.'
+    };
+    statusText.innerText   = statusMap[data.status] || data.status;
+    statusText.style.color = '';
+
+    if (data.current_company) {
+        document.getElementById('currentCompany').innerText = `Current: ${data.current_company}`;
+    }
+
+    if (data.status === 'completed' || data.status === 'stopped') {
+        stopWatching();
+        stopBtn.style.display = 'none';
+        dlBtn.href            = `/download/${currentJobId}`;
+        dlBtn.style.display   = data.download_ready ? 'flex' : 'none';
+        if (data.diff) {
+            const added   = data.diff.reduce((n, d) => n + d.new.length, 0);
+            const dropped = data.diff.reduce((n, d) => n + d.dropped.length, 0);
+            document.getElementById('currentCompany').innerText =
+                `Since last run: ${added} new, ${dropped} dropped` + (data.download_ready ? '' : ' (no new charts)');
+        }
+        if (data.failed_symbols && data.failed_symbols.length) {
+            const names = data.failed_symbols.map(f => f.symbol).join(', ');
+            document.getElementById('currentCompany').innerText =
+                `${data.failed_symbols.length} chart(s) could not be fetched: ${names}` +
+                (data.download_ready ? ' (listed at the end of the PDF)' : '');
+        }
+        if (data.expired) {
+            document.getElementById('currentCompany').innerText = 'This result has expired and was deleted.';
+        }
+        if (data.status === 'stopped') {
+            document.getElementById('resumeBtn').style.display = 'block';
+        }
+        if (data.telegram_sent) showToast('PDF sent to Telegram! 🚀');
+        else if (data.telegram_failed) showToast(`${data.telegram_failed} Telegram message(s) could not be sent`, true);
+    }
+}
+
 // ─── Helpers ─────────────────────────────────────────────────
 function escapeHtml(text) {
     if (!text) return '';
@@ -0,0 +1,71 @@
+"""Standalone job worker.
+
+Claims queued scan jobs from the shared database and runs them, so the web
+processes only enqueue work and serve status/downloads. Run one or more of these
+next to the web app (with EMBEDDED_WORKER=false on the web side):
+
+    python worker.py --concurrency 2 --metrics-port 9100
+
+With CHART_QUEUE_ENABLED=true, chart fetching can be scaled on its own: run
+``--role charts`` workers on as many nodes as needed (sharing the database and
+JOB_OUTPUT_DIR) and at least one ``--role jobs`` or ``--role all`` worker to
+scrape screeners and build the PDFs:
+
+    python worker.py --role charts --chart-workers 4
+"""
+import argparse
+import os
+import threading
+import time
+from wsgiref.simple_server import make_server, WSGIRequestHandler
+
+# Never start a second, embedded worker inside this process
+os.environ['EMBEDDED_WORKER'] = 'false'
+
+from app import run_worker, run_chart_workers, metrics_text, JOB_WORKER_CONCURRENCY, CHART_QUEUE_WORKERS
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def metrics_app(environ, start_response):
+    # Stage histograms live in the process that runs the jobs, so workers expose their own /metrics
+    if environ.get('PATH_INFO') != '/metrics':
+        start_response('404 Not Found', [('Content-Type', 'text/plain')])
+        return [b'Not Found']
+    start_response('200 OK', [('Content-Type', 'text/plain; version=0.0.4')])
+    return [metrics_text().encode()]
+
+
+def serve_metrics(port):
+    server = make_server('0.0.0.0', port, metrics_app, handler_class=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving worker metrics on :{port}/metrics")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run Chartink scan jobs from the job queue.')
+    parser.add_argument('--concurrency', type=int, default=JOB_WORKER_CONCURRENCY,
+                        help='Maximum number of jobs this worker runs at once.')
+    parser.add_argument('--role', choices=['all', 'jobs', 'charts'], default='all',
+                        help="'jobs' runs jobs (scraping, PDFs), 'charts' only fetches chart queue units, 'all' both.")
+    parser.add_argument('--chart-workers', type=int, default=CHART_QUEUE_WORKERS,
+                        help='Chart queue units this worker fetches at once (with CHART_QUEUE_ENABLED).')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help='Serve Prometheus metrics for this worker on this port.')
+    args = parser.parse_args()
+
+    if args.metrics_port:
+        serve_metrics(args.metrics_port)
+
+    try:
+        if args.role == 'charts':
+            run_chart_workers(args.chart_workers, threading.Event())
+            while True:
+                time.sleep(60)
+        else:
+            run_worker(concurrency=args.concurrency, chart_workers=0 if args.role == 'jobs' else args.chart_workers)
+    except KeyboardInterrupt:
+        print("Worker stopped")